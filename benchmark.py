@@ -0,0 +1,222 @@
+#! /usr/bin/env python3
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import ModuleType
+from typing import Callable
+
+from genieutils.datfile import DatFile
+
+import create_mod
+from mods import age_diplomacy, helpers, tech_examples, unit_examples
+from tools import synthetic, tracking
+from tools.cache import DatCache, get_genieutils_version
+from tools.parallel import apply_per_civ
+from tools.profiling import gc_collections
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the peak memory use isn't reported
+    resource = None
+
+# Times each step create_mod.py goes through: parsing the base data, loading it from the cache, applying every mod and saving
+# For every step it reports how long it took, the peak memory use of the process and how many objects it allocated
+# The results are written as JSON, so that the numbers of two commits can be compared with --compare
+#
+# By default it runs against a synthetic DatFile (see tools/synthetic.py), so it works without the game files
+# The same arguments always give the same synthetic DatFile, so results are only comparable when they were made with the same arguments
+
+# The mods that are benchmarked, applied one after another to the same DatFile like create_mod.py does
+BENCHMARKED_MODS: list[tuple[ModuleType, Callable[[DatFile], None]]] = [
+    (tech_examples, tech_examples.run_tech_examples),
+    (unit_examples, unit_examples.run_unit_examples),
+    (age_diplomacy, age_diplomacy.run_age_diplomacy),
+]
+
+DEFAULT_RESULTS_DIR = Path("benchmarks")
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="aoe2-benchmark-") as work_dir:
+        input_file = args.dat
+        counts = None
+        if input_file is None:
+            input_file = Path(work_dir) / "synthetic.dat"
+            counts = get_synthetic_counts(args)
+            print(f"Generating a synthetic dat file with {counts['civs']} civs of {counts['units_per_civ']} units, {counts['techs']} techs and {counts['effects']} effects, or as many as constants/ names...")
+            synthetic.write_datfile(input_file, **counts)
+        size = input_file.stat().st_size
+        results = run_benchmarks(input_file, Path(work_dir) / "cache", args)
+
+    results["input"] = {"dat": str(args.dat) if args.dat else None, "size": size, "synthetic": counts}
+    print_results(results, load_results(args.compare) if args.compare else None)
+
+    output = args.output or DEFAULT_RESULTS_DIR / f"{results['commit'] or 'unknown'}.json"
+    output.parent.mkdir(exist_ok=True, parents=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Results written to {output}")
+    # The numbers of a run with a failed step don't compare to other runs, so a script running the benchmark has to notice
+    failed = [step["name"] for step in results["steps"] if step["error"]]
+    if failed:
+        raise SystemExit(f"Failed: {', '.join(failed)}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Time parsing, cache loading, the mods and saving, and write the results as JSON")
+    parser.add_argument("--dat", type=Path, help="Benchmark this dat file instead of a synthetic one, e.g. datfiles/base_game.dat")
+    parser.add_argument("--scale", type=float, default=1, help="Size of the synthetic dat file compared to the base game data, e.g. 10 or 0.1 (default: %(default)s)")
+    parser.add_argument("--civs", type=int, help="Number of civs of the synthetic dat file, instead of the one for --scale")
+    parser.add_argument("--units", type=int, help="Number of units per civ of the synthetic dat file, instead of the one for --scale")
+    parser.add_argument("--techs", type=int, help="Number of techs of the synthetic dat file, instead of the one for --scale")
+    parser.add_argument("--effects", type=int, help="Number of effects of the synthetic dat file, instead of the one for --scale")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic dat file (default: %(default)s)")
+    parser.add_argument("--compression-level", type=int, choices=tracking.COMPRESSION_LEVELS, metavar="{-1..9}", default=tracking.DEFAULT_COMPRESSION_LEVEL, help="zlib compression level of the save step (default: %(default)s)")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report the peak memory Python allocated in each step. Makes every step a lot slower")
+    parser.add_argument("--verbose", action="store_true", help="Show what the mods print")
+    parser.add_argument("--output", type=Path, help=f"Where to write the results (default: {DEFAULT_RESULTS_DIR}/<commit>.json)")
+    parser.add_argument("--compare", type=Path, help="Results of an earlier run to compare against")
+    return parser.parse_args()
+
+
+# The counts of the synthetic dat file, see synthetic.scaled_counts. Counts given on their own replace the scaled ones
+def get_synthetic_counts(args: argparse.Namespace) -> dict[str, int]:
+    counts = synthetic.scaled_counts(args.scale)
+    for name, value in [("civs", args.civs), ("units_per_civ", args.units), ("techs", args.techs), ("effects", args.effects)]:
+        if value is not None:
+            counts[name] = value
+    counts["seed"] = args.seed
+    return counts
+
+
+def run_benchmarks(input_file: Path, cache_dir: Path, args: argparse.Namespace) -> dict:
+    if args.tracemalloc:
+        tracemalloc.start()
+    steps = []
+
+    df, step = measure("DatFile.parse", lambda: DatFile.parse(input_file))
+    steps.append(step)
+    if df is None:
+        return make_results(steps, args)
+
+    cache = DatCache(cache_dir)
+    _, step = measure("write_cache", lambda: create_mod.write_cache(df, "benchmark", cache))
+    steps.append(step)
+    cached, step = measure("load_cache", lambda: create_mod.load_cache("benchmark", cache))
+    steps.append(step)
+    del cached
+
+    for module, run in BENCHMARKED_MODS:
+        _, step = measure(run.__name__, lambda: run_mod(df, module, run, args.verbose))
+        steps.append(step)
+
+    # Saved the way create_mod.py saves an untracked DatFile, see tracking.save
+    _, step = measure("save", lambda: tracking.save(df, cache_dir / "output.dat", args.compression_level))
+    steps.append(step)
+    return make_results(steps, args)
+
+
+# Apply the mod the same way create_mod.py does, including its per-civ modifications
+def run_mod(df: DatFile, module: ModuleType, run: Callable[[DatFile], None], verbose: bool):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+        run(df)
+        apply_per_civ(df, getattr(module, "PER_CIV_MODIFICATIONS", []))
+
+
+# Run one step and return its result together with its measurements
+# A step that fails is reported with its error instead of stopping the benchmark, its result is None. main() exits with an error once the results are written
+#
+# peak_rss_mib is the peak memory use of the whole process so far, so it only goes up from one step to the next
+# allocated_blocks is the number of memory blocks Python allocated during the step minus those it freed again,
+# and gc_collections how often the garbage collector ran, which goes up with the number of objects the step created
+def measure(name: str, function: Callable[[], object]) -> tuple[object, dict]:
+    print(f"Running {name}...")
+    gc.collect()
+    collections = gc_collections()
+    blocks = sys.getallocatedblocks()
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start_time = time.perf_counter()
+    start_cpu_time = time.process_time()
+    result, error = None, None
+    try:
+        result = function()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        print(f"{name} failed: {error}")
+    step = {
+        "name": name,
+        "wall_s": time.perf_counter() - start_time,
+        "cpu_s": time.process_time() - start_cpu_time,
+        "peak_rss_mib": _peak_rss_mib(),
+        "allocated_blocks": sys.getallocatedblocks() - blocks,
+        "gc_collections": gc_collections() - collections,
+        "traced_peak_mib": tracemalloc.get_traced_memory()[1] / (1024 * 1024) if tracemalloc.is_tracing() else None,
+        "error": error,
+    }
+    return result, step
+
+
+def _peak_rss_mib() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def make_results(steps: list[dict], args: argparse.Namespace) -> dict:
+    return {
+        "commit": get_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "genieutils": get_genieutils_version(),
+        "platform": platform.platform(),
+        "tracemalloc": args.tracemalloc,
+        "compression_level": args.compression_level,
+        "steps": steps,
+    }
+
+
+# The commit the benchmark ran on, marked as dirty if there are uncommitted changes
+def get_commit() -> str | None:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short=12", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+
+def load_results(results_file: Path) -> dict:
+    return json.loads(Path(results_file).read_text())
+
+
+def print_results(results: dict, previous: dict | None = None):
+    previous_steps = {step["name"]: step for step in previous["steps"]} if previous else {}
+    if previous:
+        print(f"Compared against {previous['commit']} (ran {previous['created']})")
+    print(f"{'step':<20} {'wall s':>9} {'cpu s':>9} {'peak RSS MiB':>13} {'blocks':>11} {'gc runs':>8}{'   vs before' if previous else ''}")
+    for step in results["steps"]:
+        peak_rss = "-" if step["peak_rss_mib"] is None else f"{step['peak_rss_mib']:.1f}"
+        line = f"{step['name']:<20} {step['wall_s']:>9.3f} {step['cpu_s']:>9.3f} {peak_rss:>13} {step['allocated_blocks']:>11} {step['gc_collections']:>8}"
+        previous_step = previous_steps.get(step["name"])
+        if previous_step and previous_step["wall_s"] > 0:
+            line += f"   {step['wall_s'] / previous_step['wall_s'] - 1:+.1%}"
+        if step["error"]:
+            line += f"   failed: {step['error']}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
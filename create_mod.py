@@ -1,63 +1,413 @@
 #! /usr/bin/env python3
 import argparse
+import contextlib
 import hashlib
-import pickle
 from pathlib import Path
+from types import ModuleType
+from typing import Callable
 
 from genieutils.datfile import DatFile
 
 from mods import tech_examples, unit_examples, custom_modifications, age_diplomacy
+from mods.compact import compact_datfile
+from mods.helpers import fast_copy
+from tools import tracking
+from tools.batch import load_manifest, run_batch
+from tools.diff import apply_patch, diff_datfiles, read_patch, write_patch
+from tools.cache import DatCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_CACHE_BYTES, make_cache_key
+from tools.hashing import HashManifest, HASH_ALGORITHMS, MANIFEST_NAME, hash_file, hash_sources
+from tools.lazy import load_lazy
+from tools.parallel import EXECUTORS, apply_per_civ, default_jobs
+from tools.profiling import SORT_KEYS, ModProfiler
+from tools.server import request_build, serve
+from tools.tracking import DatLayout, parse_with_layout
+from tools.warmup import DEFAULT_POLL_SECONDS, file_state, watch
+from tools.validate import ValidationError, ensure_valid
+
+PROJECT_DIR = Path(__file__).resolve().parent
+
+# Each mod is applied as one stage of the pipeline, in the order listed here
+# A stage is the mod module together with the function that applies it
+# If the module has a PER_CIV_MODIFICATIONS list, those functions are applied to every civ after the function, see tools/parallel.py
+MOD_STAGES: list[tuple[ModuleType, Callable[[DatFile], None]]] = [
+    # (tech_examples, tech_examples.run_tech_examples),
+    # (unit_examples, unit_examples.run_unit_examples),
+    # Comment out / remove the previous two lines to run only your modifications
+    (custom_modifications, custom_modifications.run_custom_modifications),
+    (age_diplomacy, age_diplomacy.run_age_diplomacy),  # Add our mod directly
+]
+
 
 # Overall, genieutils works by loading a .dat file into memory and constructing a DatFile object
 # This is done with the DatFile.parse method
 # Once the object has been parsed, you make the modifications you want to the object
 # Once this is complete, you can write the new object to a new file using the DatFile.save method
 def main():
+    args = parse_args()
+    cache = None if args.no_cache else DatCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    # Caching the output of a mod stage would decode every section of a lazily loaded DatFile, so lazy loading skips the stage cache
+    stage_cache = None if args.no_stage_cache or args.lazy else cache
+
+    input_file = Path("datfiles/base_game.dat")
+    if args.watch:
+        if cache is None:
+            raise SystemExit("--watch fills the cache, so it can't be combined with --no-cache")
+        watch(input_file, lambda changed_file: warm_up(changed_file, cache, args), args.watch_interval)
+        return
+
+    if args.serve:
+        try:
+            serve(get_socket_path(args), input_file, lambda: load_base_data(input_file, get_base_key(input_file, cache, args), cache, track_changes=True, lazy=args.lazy, compact=args.compact))
+        except RuntimeError as error:
+            raise SystemExit(str(error))
+        return
+
+    if args.use_server:
+        # Everything is loaded, built and saved by the server, this process only sends the request and prints what the build prints
+        variants = load_manifest(args.batch) if args.batch else [{"output": "datfiles/empires2_x2_p1.dat", "mods": [get_mod_name(module, run) for module, run in MOD_STAGES], "validate": True, "compression_level": tracking.DEFAULT_COMPRESSION_LEVEL}]
+        failed = []
+        for variant in variants:
+            # The server may run in another directory than we do
+            variant["output"] = str(Path(variant["output"]).resolve())
+            variant["validate"] = variant["validate"] and not args.no_validate
+            variant["compression_level"] = get_compression_level(args, variant)
+            try:
+                built = request_build(get_socket_path(args), variant)
+            except RuntimeError as error:
+                raise SystemExit(str(error))
+            if not built:
+                failed.append(variant["output"])
+        if failed:
+            raise SystemExit(f"Failed to build: {', '.join(failed)}")
+        print("Process completed!")
+        return
+
     print("Loading base data...")
-    cache_file = None
-    cache_file, dfBase = load_cache(Path("datfiles/base_game.dat"))
-    if not dfBase:
-        print("Parsing...")
-        dfBase = DatFile.parse("datfiles/base_game.dat")
-        write_cache(dfBase, cache_file)
+    # Taken before the file is hashed, so that tracking notices the file changing while it is loaded, see tracking.DirtyTracker
+    source_state = file_state(input_file)
+    base_key = get_base_key(input_file, cache, args)
+
+    if args.apply_patch:
+        # Applying a patch replaces running the mods, the patch already holds everything they changed
+        dfBase = load_base_data(input_file, base_key, cache, track_changes=True, lazy=args.lazy, compact=args.compact, source_state=source_state)
+        print("Base data loaded")
+        print(f"Applying patch {args.apply_patch}")
+        apply_patch(dfBase, read_patch(args.apply_patch, get_base_file_hash(input_file, args, "sha256")))
+        validate_data(dfBase, args)
+        print("Saving file...")
+        tracking.save(dfBase, "datfiles/empires2_x2_p1.dat", get_compression_level(args))
+        print("Process completed!")
+        return
+
+    if args.batch:
+        dfBase = load_base_data(input_file, base_key, cache, track_changes=True, lazy=args.lazy, compact=args.compact, source_state=source_state)
+        print("Base data loaded")
+        variants = load_manifest(args.batch)
+        for variant in variants:
+            variant["validate"] = variant["validate"] and not args.no_validate
+            variant["compression_level"] = get_compression_level(args, variant)
+        failed = run_batch(dfBase, variants, args.jobs or default_jobs())
+        if failed:
+            raise SystemExit(f"Failed to build: {', '.join(failed)}")
+        print("Process completed!")
+        return
+
+    # If the output of some mod stages is already cached we can start from there instead of from the base data
+    # The keys hash the source of every mod, which is only worth it when the stages are cached
+    stage_keys = get_stage_keys(get_compact_key(base_key) if args.compact else base_key, MOD_STAGES) if stage_cache is not None else [None] * len(MOD_STAGES)
+    first_stage, dfBase = load_stage_cache(stage_keys, stage_cache)
+    if dfBase:
+        track_stage_data(dfBase, input_file, base_key, cache, MOD_STAGES[:first_stage], source_state)
+    else:
+        dfBase = load_base_data(input_file, base_key, cache, track_changes=True, lazy=args.lazy, compact=args.compact, source_state=source_state)
+
+    # Keep an unmodified copy of the base data around to compare against once the mods are applied
+    original = None
+    if args.write_patch:
+        original = fast_copy(dfBase) if first_stage == 0 else load_base_data(input_file, base_key, cache)
 
     print("Base data loaded")
     print("Applying modifications")
-    # tech_examples.run_tech_examples(dfBase)
-    # unit_examples.run_unit_examples(dfBase)
-    # Comment out / remove the previous two lines to run only your modifications
-    custom_modifications.run_custom_modifications(dfBase)
-    age_diplomacy.run_age_diplomacy(dfBase)  # Add our mod directly
+    jobs = args.jobs or default_jobs()
+    profiler = make_profiler(args)
+    for (module, run), stage_key in zip(MOD_STAGES[first_stage:], stage_keys[first_stage:]):
+        tracking.mark_module(dfBase, module)
+        with profiler.stage(dfBase, module, f"{module.__name__}.{run.__name__}") if profiler else contextlib.nullcontext():
+            run(dfBase)
+            apply_per_civ(dfBase, getattr(module, "PER_CIV_MODIFICATIONS", []), jobs, args.executor)
+        # A build running the same mods at the same time may have stored the output of this stage already
+        if stage_cache is not None and not is_cached(stage_cache, stage_key):
+            write_cache(dfBase, stage_key, stage_cache)
     print("Modifications completed")
+    if profiler:
+        report_profile(profiler, args)
+
+    if args.write_patch:
+        print(f"Writing patch {args.write_patch}")
+        write_patch(args.write_patch, diff_datfiles(original, dfBase), get_base_file_hash(input_file, args, "sha256"))
 
     # You can save it as whatever filename.dat you want, but when it is in a mod you will need it to be named empires2_x2_p1.dat
+    # Only the sections the mods changed are encoded again, everything else is copied from the base file, see tools/tracking.py
+    check_sections(dfBase, args)
+    validate_data(dfBase, args)
     print("Saving file...")
-    dfBase.save("datfiles/empires2_x2_p1.dat")
+    tracking.save(dfBase, "datfiles/empires2_x2_p1.dat", get_compression_level(args))
     print("Process completed!")
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Apply the mods in the mods folder to datfiles/base_game.dat")
+    parser.add_argument("--cache-dir", type=Path, default=DEFAULT_CACHE_DIR, help="Directory holding the parse cache (default: %(default)s)")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_CACHE_BYTES // (1024 * 1024), help="Maximum size of the parse cache in MiB (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="Always parse the base dat file and never touch the cache")
+    parser.add_argument("--no-stage-cache", action="store_true", help="Re-apply every mod instead of reusing the cached output of unchanged mod stages")
+    parser.add_argument("--hash", choices=HASH_ALGORITHMS, default="sha256", help="How the base dat file is hashed when it has changed (default: %(default)s)")
+    parser.add_argument("--batch", type=Path, help="Build every variant of this batch manifest from one parse instead of the mods in MOD_STAGES, see tools/batch.py")
+    parser.add_argument("--lazy", action="store_true", help="Only decode the parts of the base data the mods use, see tools/lazy.py. Needs the parse cache")
+    parser.add_argument("--compact", action="store_true", help="Store attacks, armours and effect commands in compact arrays and share identical costs, see mods/compact.py")
+    parser.add_argument("--write-patch", type=Path, help="Also write everything the mods changed as a patch file, see tools/diff.py")
+    parser.add_argument("--apply-patch", type=Path, help="Apply this patch file to the base data instead of running the mods")
+    parser.add_argument("--check-sections", action="store_true", help="Before saving, check that the mods changed nothing outside of their MODIFIED_SECTIONS, including changes deep inside units that saving doesn't notice on its own. Takes about as long as saving everything")
+    parser.add_argument("--no-validate", action="store_true", help="Save the data even if it has errors, see tools/validate.py")
+    parser.add_argument("--compression-level", type=int, choices=tracking.COMPRESSION_LEVELS, metavar="{-1..9}", help="zlib compression level of the saved dat file: 1 saves the fastest, 9 gives the smallest file and 0 doesn't compress at all (default: zlib's default)")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of workers applying per-civ modifications or building batch variants, 0 for one per CPU core (default: %(default)s)")
+    parser.add_argument("--executor", choices=EXECUTORS, default="process", help="How per-civ modifications are run in parallel (default: %(default)s)")
+    parser.add_argument("--watch", action="store_true", help="Instead of building, keep running and fill the cache whenever the base dat file changes, see tools/warmup.py")
+    parser.add_argument("--watch-interval", type=float, default=DEFAULT_POLL_SECONDS, help="How often --watch checks the base dat file, in seconds (default: %(default)s)")
+    parser.add_argument("--serve", action="store_true", help="Instead of building, keep the base data loaded and build whatever --use-server asks for, see tools/server.py")
+    parser.add_argument("--use-server", action="store_true", help="Have the build server started with --serve build the mods in MOD_STAGES, or the variants of --batch")
+    parser.add_argument("--socket", type=Path, help="Socket of the build server (default: build-server.sock in the cache directory)")
+    parser.add_argument("--profile", action="store_true", help="Report how long each mod stage took and how much it allocated, see tools/profiling.py")
+    parser.add_argument("--profile-functions", action="store_true", help="Also time every top-level function of the mods. Implies --profile")
+    parser.add_argument("--profile-touched", action="store_true", help="Also count the units and effects each mod stage changed, which takes a while. Implies --profile")
+    parser.add_argument("--profile-sort", choices=SORT_KEYS, default="wall", help="Column the profile report is sorted by (default: %(default)s)")
+    parser.add_argument("--profile-dump", type=Path, help="Also run the mod stages under cProfile and write its statistics to this file. Implies --profile")
+    args = parser.parse_args()
+    if args.compact and args.lazy:
+        # Compacting goes through the units of every civ, which would decode all of them right away
+        parser.error("--compact can't be combined with --lazy")
+    if args.serve and args.use_server:
+        parser.error("--serve can't be combined with --use-server")
+    return args
+
+
+# --compression-level applies to every variant of a batch as well, otherwise the level of the variant is used
+def get_compression_level(args: argparse.Namespace, variant: dict | None = None) -> int:
+    if args.compression_level is not None:
+        return args.compression_level
+    return tracking.DEFAULT_COMPRESSION_LEVEL if variant is None else variant["compression_level"]
+
+
+def get_socket_path(args: argparse.Namespace) -> Path:
+    return args.socket or args.cache_dir / "build-server.sock"
+
+
+# The build server applies a mod by its module name, calling its run_<NAME> function like a batch variant does, see tools/batch.py
+def get_mod_name(module: ModuleType, run: Callable[[DatFile], None]) -> str:
+    if run.__name__ != f"run_{module.NAME}":
+        raise SystemExit(f"The build server can only apply {module.__name__} through its run_{module.NAME} function, not {run.__name__}")
+    return module.__name__.removeprefix("mods.")
+
+
+# Profiling only covers the mod stages that actually run, stages whose output is reused from the stage cache aren't measured
+def make_profiler(args: argparse.Namespace) -> ModProfiler | None:
+    if not (args.profile or args.profile_functions or args.profile_touched or args.profile_dump):
+        return None
+    return ModProfiler(functions=args.profile_functions, touched=args.profile_touched, cprofile=args.profile_dump is not None)
+
+
+def report_profile(profiler: ModProfiler, args: argparse.Namespace):
+    profiler.print_report(args.profile_sort)
+    if args.profile_dump:
+        profiler.dump(args.profile_dump)
+        print(f"cProfile statistics written to {args.profile_dump}")
+
+
+# A mod whose MODIFIED_SECTIONS leave out something it changes could lose that change when saving, see tools/tracking.py
+def check_sections(df: DatFile, args: argparse.Namespace):
+    if not args.check_sections:
+        return
+    print("Checking MODIFIED_SECTIONS...")
+    undeclared = tracking.find_undeclared_changes(df)
+    if undeclared:
+        raise SystemExit(f"The mods changed {', '.join(undeclared[:10])}{' and more' if len(undeclared) > 10 else ''} without declaring it in MODIFIED_SECTIONS. Nothing was saved")
+
+
+# Catch data that would fail to save or break the game before saving it
+def validate_data(df: DatFile, args: argparse.Namespace):
+    if args.no_validate:
+        return
+    print("Validating...")
+    try:
+        ensure_valid(df)
+    except ValidationError as error:
+        raise SystemExit(f"{error}. Nothing was saved, run with --no-validate to save anyway")
+
+
+def get_base_key(input_file: Path, cache: DatCache | None, args: argparse.Namespace) -> str:
+    # Without a cache there is nothing to look up, so skip hashing the file altogether
+    if cache is None:
+        return ""
+    return make_cache_key(get_base_file_hash(input_file, args, args.hash))
+
+
+def get_base_file_hash(input_file: Path, args: argparse.Namespace, algorithm: str) -> str:
+    manifest = None if args.no_cache else HashManifest(args.cache_dir / MANIFEST_NAME)
+    return get_file_hash(input_file, manifest, algorithm)
+
+
+# With track_changes the DatFile remembers where every section of it came from in the base file, so that saving only has to encode what changed
+# That needs the layout of the base file, which is cached next to the parsed data
+# With lazy the cached layout is used to only decode the sections of the base file that are used, see tools/lazy.py
+# With compact the attacks, armours and effect commands are stored in compact arrays, see mods/compact.py. The compacted data is cached separately
+# source_state is the state of the base file before base_key was hashed from it, see tracking.DirtyTracker
+def load_base_data(input_file: Path, base_key: str, cache: DatCache | None, track_changes: bool = False, lazy: bool = False, compact: bool = False, source_state: tuple[int, int, int] | None = None) -> DatFile:
+    if lazy:
+        layout = load_cache(get_layout_key(base_key), cache)
+        if layout:
+            dfBase = load_lazy(input_file, layout, get_scratch_dir(cache))
+            if track_changes:
+                tracking.track(dfBase, input_file, layout, get_scratch_dir(cache), source_state)
+            return dfBase
+        print("The layout of the base data isn't cached yet, so all of it is parsed this time")
+
+    dfBase = load_cache(get_compact_key(base_key), cache) if compact else None
+    compacted = dfBase is not None
+    if not compacted:
+        dfBase = load_cache(base_key, cache)
+    layout = load_cache(get_layout_key(base_key), cache) if dfBase and track_changes else None
+    if not dfBase or (track_changes and not layout):
+        dfBase, layout = parse_base_data(input_file, base_key, cache)
+        compacted = False
+    if compact and not compacted:
+        # Another build may be compacting the same data, in which case we wait for it and load its result instead
+        dfBase = make_compact(dfBase) if cache is None else cache.load_or_create(get_compact_key(base_key), lambda: make_compact(dfBase))
+    if track_changes:
+        tracking.track(dfBase, input_file, layout, get_scratch_dir(cache), source_state)
+    return dfBase
+
+
+# Only one process parses a base file at a time, whether it is a build or the warm-up of --watch
+# Everyone else waits for it to finish and loads what it cached instead of parsing the same file again
+def parse_base_data(input_file: Path, base_key: str, cache: DatCache | None) -> tuple[DatFile, DatLayout]:
+    if cache is None:
+        print("Parsing...")
+        return parse_with_layout(input_file)
+    # The layout is made by the same parse, so the lock of the base data covers both of them
+    with cache.locked(base_key):
+        if is_cached(cache, base_key, get_layout_key(base_key)):
+            dfBase = load_cache(base_key, cache)
+            layout = load_cache(get_layout_key(base_key), cache)
+            if dfBase and layout:
+                return dfBase, layout
+        print("Parsing...")
+        dfBase, layout = parse_with_layout(input_file, get_scratch_dir(cache))
+        write_cache(dfBase, base_key, cache)
+        write_cache(layout, get_layout_key(base_key), cache)
+        return dfBase, layout
+
+
+def is_cached(cache: DatCache | None, *cache_keys: str) -> bool:
+    return cache is not None and all(cache.entry_path(cache_key).is_file() for cache_key in cache_keys)
+
+
+# Parse and cache the base data the way a build loads it, without building anything, see tools/warmup.py
+# Loading it also records the hash of the file, and with --compact the compacted data is cached as well
+def warm_up(input_file: Path, cache: DatCache, args: argparse.Namespace):
+    base_key = get_base_key(input_file, cache, args)
+    if is_cached(cache, base_key, get_layout_key(base_key), *([get_compact_key(base_key)] if args.compact else [])):
+        print("Already cached")
+        return
+    load_base_data(input_file, base_key, cache, track_changes=True, compact=args.compact)
+
+
+def make_compact(df: DatFile) -> DatFile:
+    compact_datfile(df)
+    return df
+
+
+def get_layout_key(base_key: str) -> str:
+    return f"{base_key}-layout"
+
+
+def get_compact_key(base_key: str) -> str:
+    return f"{base_key}-compact"
+
+
+# The uncompressed base file is memory-mapped from a scratch file next to the cache, see tools/mapped.py
+# Without a cache nothing is written to disk and it is read into memory instead
+def get_scratch_dir(cache: DatCache | None) -> Path | None:
+    if cache is None:
+        return None
+    return cache.cache_dir / "uncompressed"
+
+
+# Output of a cached mod stage was changed by the stages before it, which aren't tracked, so mark everything they declared as changed
+# Which units they changed isn't known anymore either, so all civs are encoded again
+def track_stage_data(data: DatFile, input_file: Path, base_key: str, cache: DatCache | None, previous_stages: list[tuple[ModuleType, Callable[[DatFile], None]]], source_state: tuple[int, int, int] | None = None):
+    layout = load_cache(get_layout_key(base_key), cache)
+    if not layout:
+        return
+    tracker = tracking.track(data, input_file, layout, get_scratch_dir(cache), source_state)
+    tracker.mark_sections("civs")
+    for module, _ in previous_stages:
+        tracking.mark_module(data, module)
+
+
 # Since there is a lot of overhead accomplished by the parsing and saving, it may take a while
 # To speed this up, genieutils-py allows for the option of caching this parsing
-# However, this is completely optional and you can remove the load_cache and write_cache functions if they don't work correctly
-def load_cache(input_file: Path) -> tuple[Path, DatFile | None]:
-    file_hash = get_file_hash(input_file)
-    cache_file = Path("/tmp/aoe2") / f"{file_hash}.pickle"
-    data = None
-    if cache_file.is_file():
-        data = pickle.loads(cache_file.read_bytes())
-    else:
-        print("Cache file does not exist")
-    return cache_file, data
+# However, this is completely optional and you can run with --no-cache if the cache doesn't work correctly
+# Cache entries are keyed on the dat file hash, the genieutils-py version and the cache schema version, see tools/cache.py
+def load_cache(cache_key: str, cache: DatCache | None) -> DatFile | DatLayout | None:
+    if cache is None:
+        return None
+    return cache.load(cache_key)
+
+
+def write_cache(data: DatFile | DatLayout, cache_key: str, cache: DatCache | None):
+    if cache is None:
+        return
+    cache.store(cache_key, data)
+
+
+# Hashing the whole base dat file takes a noticeable amount of time, so the manifest remembers the hash
+# and only re-hashes the file when its size, modification time or inode changed
+def get_file_hash(input_file: Path, manifest: HashManifest | None = None, algorithm: str = "sha256") -> str:
+    if manifest is None:
+        return hash_file(input_file, algorithm)
+    return manifest.get_hash(input_file, algorithm)
+
+
+# The output of a mod stage only depends on its input and on the code that runs it:
+# the mod and everything of this project it imports (the helpers, the constants, the rules, ...), and tools/parallel.py which applies its per-civ modifications
+def get_module_hash(module: ModuleType) -> str:
+    return hash_sources([module.__name__, "tools.parallel"], PROJECT_DIR)
 
 
-def write_cache(data: DatFile, cache_file: Path):
-    cache_file.parent.mkdir(exist_ok=True, parents=True)
-    cache_file.write_bytes(pickle.dumps(data))
+# Chain the keys of the stages together, so that changing one mod invalidates its own output and that of every later mod
+# but keeps the cached output of all of the mods before it
+def get_stage_keys(base_key: str, stages: list[tuple[ModuleType, Callable[[DatFile], None]]]) -> list[str]:
+    stage_keys = []
+    previous_key = base_key
+    for module, run in stages:
+        stage_hash = hashlib.sha256(f"{previous_key}:{module.__name__}.{run.__name__}:{get_module_hash(module)}".encode()).hexdigest()
+        previous_key = f"stage-{stage_hash}"
+        stage_keys.append(previous_key)
+    return stage_keys
 
 
-def get_file_hash(input_file: Path) -> str:
-    with input_file.open("rb") as f:
-        return hashlib.file_digest(f, "sha256").hexdigest()
+# Find the last stage whose output is cached, and return the index of the first stage that still has to run together with that output
+def load_stage_cache(stage_keys: list[str], cache: DatCache | None) -> tuple[int, DatFile | None]:
+    if cache is None:
+        return 0, None
+    for stage_index in reversed(range(len(stage_keys))):
+        if not cache.entry_path(stage_keys[stage_index]).is_file():
+            continue
+        data = cache.load(stage_keys[stage_index])
+        if data:
+            print(f"Reusing cached output of the first {stage_index + 1} mod stage(s)")
+            return stage_index + 1, data
+    return 0, None
 
 
 if __name__ == "__main__":
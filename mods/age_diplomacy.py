@@ -1,232 +1,174 @@
 import copy
 
+from genieutils.civ import Civ
 from genieutils.datfile import DatFile
 from genieutils.unit import Unit, ResourceCost, ResourceStorage, Task
 from constants import *
 from mods import helpers
+from mods.rules import Rule, apply_rules, scale
 
 NAME = "age_diplomacy"
 
-def run_age_diplomacy(df: DatFile):
+# The DatFile sections this mod changes, see tools/tracking.py
+# Units are only changed through the rules (which use the unit index) and PER_CIV_MODIFICATIONS, which return the units they changed
+MODIFIED_SECTIONS = ["techs"]
+
+# research_multiplier can be changed per variant in a batch manifest, see tools/batch.py
+def run_age_diplomacy(df: DatFile, research_multiplier: float = 1.2):
     # Modification Overview
     # 1. Triple health of all buildings
     # 2. Double build time of all buildings
     # 3. Make SPEARMAN and HALBERDIER train twice as fast
 
     # Adjust age-research times
-    RESEARCH_MULTIPLIER = 1.2
+    RESEARCH_MULTIPLIER = research_multiplier
     print("TEST: Making Age research take longer")
     df.techs[techs.FEUDAL_AGE].research_time = int(df.techs[techs.FEUDAL_AGE].research_time * RESEARCH_MULTIPLIER)
     df.techs[techs.CASTLE_AGE].research_time = int(df.techs[techs.CASTLE_AGE].research_time * RESEARCH_MULTIPLIER)
     df.techs[techs.IMPERIAL_AGE].research_time = int(df.techs[techs.IMPERIAL_AGE].research_time * RESEARCH_MULTIPLIER)
 
     # Apply modifications
-    disable_additional_town_centers(df)
-    slower_villager_training_time(df)
-    slower_tradecart_training_time(df)
-    triple_building_health(df)       
-    double_building_build_time(df)   
-    accelerate_spearman_halberdier_train_time(df)  
-    disable_additional_markets(df) 
-    better_siege_towers(df)
-
-def slower_villager_training_time(df: DatFile):
-    print("Making villagers take longer to train")
-    for civ in df.civs:
-        for unit in civ.units:
-            if unit is not None and unit.class_ == unit_classes.CIVILIAN:
-                if hasattr(unit, 'creatable') and unit.creatable is not None:
-                    original_train_time = unit.creatable.train_time
-                    if original_train_time >= 0:
-                        unit.creatable.train_time = int(original_train_time * 1.2)  # Longer training time
-                        print(f"Unit ID {unit.id}: Train time increased from {original_train_time} to {unit.creatable.train_time}")
-                    else:
-                        print(f"Unit ID {unit.id}: Train time not modified (original Train Time: {original_train_time})")
-
-def slower_tradecart_training_time(df: DatFile):
-    print("Making tradecarts take longer")
-    for civ in df.civs:
-        for unit in civ.units:
-            if unit is not None and unit.class_ in [unit_classes.TRADE_CART, unit_classes.TRADE_BOAT]:
-                if hasattr(unit, 'creatable') and unit.creatable is not None:
-                    original_train_time = unit.creatable.train_time
-                    if original_train_time >= 0:
-                        unit.creatable.train_time = int(original_train_time * 2)  # Double the training time
-                        print(f"Unit ID {unit.id}: Train time increased from {original_train_time} to {unit.creatable.train_time}")
-                    else:
-                        print(f"Unit ID {unit.id}: Train time not modified (original Train Time: {original_train_time})")
-
-
-def disable_additional_town_centers(df: DatFile):
+    # disable_additional_town_centers and disable_additional_markets only change one civ at a time
+    # They are listed in PER_CIV_MODIFICATIONS below, which create_mod.py applies to every civ after this function, in parallel if asked to
     print("You can only have one standing town_center at a time")
+    print("You can only have one standing market at a time")
+    # The unit changes are listed as rules in UNIT_RULES below and applied in a single pass over the units, see mods/rules.py
+    apply_rules(df, UNIT_RULES)
+
 
+# Returns the IDs of the units it changed, see tools/parallel.py
+def disable_additional_town_centers(civ_index: int, civ: Civ) -> list[int]:
     TOWN_CENTER_RESOURCE = 120
 
     # Skip civ 0 (GAIA). Start at civ 1 for actual playable civs.
-    for civ_index in range(1, len(df.civs)):
-        civ = df.civs[civ_index]
-
-        # Give them 1 'Town Center Resource' so they can build exactly 1
-        civ.resources[TOWN_CENTER_RESOURCE] = 1
-
-        # Overwrite the cost/storage on every variant of the Town Center
-        for tc_id in units.TOWN_CENTER_ALL:
-            tc_stone_cost = ResourceCost(resources.STONE, 100, 1)
-            tc_wood_cost = ResourceCost(resources.WOOD, 200, 1)
-            tc_resource_cost = ResourceCost(TOWN_CENTER_RESOURCE, 1, 0)
-            civ.units[tc_id].creatable.resource_costs = (
-                tc_stone_cost,
-                tc_wood_cost,
-                tc_resource_cost
+    if civ_index == 0:
+        return []
+
+    # Give them 1 'Town Center Resource' so they can build exactly 1
+    civ.resources[TOWN_CENTER_RESOURCE] = 1
+
+    # Overwrite the cost/storage on every variant of the Town Center
+    for tc_id in units.TOWN_CENTER_ALL:
+        tc_stone_cost = ResourceCost(resources.STONE, 100, 1)
+        tc_wood_cost = ResourceCost(resources.WOOD, 200, 1)
+        tc_resource_cost = ResourceCost(TOWN_CENTER_RESOURCE, 1, 0)
+        civ.units[tc_id].creatable.resource_costs = (
+            tc_stone_cost,
+            tc_wood_cost,
+            tc_resource_cost
+        )
+
+        # Provide pop space to this player only
+        # Deduct TOWN_CENTER_RESOURCE upon completion
+        # Return TOWN_CENTER_RESOURCE on death
+        tc_headroom_storage = ResourceStorage(resources.POPULATION_HEADROOM, 5, 4)
+        tc_resource_storage = ResourceStorage(TOWN_CENTER_RESOURCE, -1, 2)
+        empty_storage = ResourceStorage(-1, 0, 0)
+
+        civ.units[tc_id].resource_storages = (
+            tc_headroom_storage,
+            tc_resource_storage,
+            empty_storage,
+        )
+
+    return list(units.TOWN_CENTER_ALL)
+
+
+def disable_additional_markets(civ_index: int, civ: Civ) -> list[int]:
+    MARKET_RESOURCE = 61
+
+    # (Optionally skip civ 0 so that GAIA doesn't also get a "market resource")
+    if civ_index == 0:
+        return []
+
+    # Give each civ exactly 1 'MARKET_RESOURCE'
+    civ.resources[MARKET_RESOURCE] = 1
+
+    # For each Market variant, overwrite cost and storages
+    changed_unit_ids = []
+    for market_id in units.MARKET_ALL:
+        market_unit = civ.units[market_id]
+        if market_unit is not None and market_unit.creatable is not None:
+            market_stone_cost = ResourceCost(resources.STONE, 0, 1)
+            market_wood_cost  = ResourceCost(resources.WOOD, 175, 1)
+            market_resource_cost = ResourceCost(MARKET_RESOURCE, 1, 0)
+
+            market_unit.creatable.resource_costs = (
+                market_stone_cost,
+                market_wood_cost,
+                market_resource_cost,
             )
 
-            # Provide pop space to this player only
-            # Deduct TOWN_CENTER_RESOURCE upon completion
-            # Return TOWN_CENTER_RESOURCE on death
-            tc_headroom_storage = ResourceStorage(resources.POPULATION_HEADROOM, 5, 4)
-            tc_resource_storage = ResourceStorage(TOWN_CENTER_RESOURCE, -1, 2)
-            empty_storage = ResourceStorage(-1, 0, 0)
+            # Deduct the MARKET_RESOURCE on completion, return it on destruction
+            market_headroom_storage = ResourceStorage(resources.POPULATION_HEADROOM, 0, 4)
+            market_resource_storage = ResourceStorage(MARKET_RESOURCE, -1, 2)
+            empty_storage           = ResourceStorage(-1, 0, 0)
 
-            civ.units[tc_id].resource_storages = (
-                tc_headroom_storage,
-                tc_resource_storage,
+            market_unit.resource_storages = (
+                market_headroom_storage,
+                market_resource_storage,
                 empty_storage,
             )
-
-
-def disable_additional_markets(df: DatFile):
-    print("You can only have one standing market at a time")
-    MARKET_RESOURCE = 61
-
-    # (Optionally skip civ 0 so that GAIA doesn't also get a "market resource")
-    for civ_index in range(1, len(df.civs)):
-        civ = df.civs[civ_index]
-
-        # Give each civ exactly 1 'MARKET_RESOURCE'
-        civ.resources[MARKET_RESOURCE] = 1
-
-        # For each Market variant, overwrite cost and storages
-        for market_id in units.MARKET_ALL:
-            market_unit = civ.units[market_id]
-            if market_unit is not None and market_unit.creatable is not None:
-                market_stone_cost = ResourceCost(resources.STONE, 0, 1)
-                market_wood_cost  = ResourceCost(resources.WOOD, 175, 1)
-                market_resource_cost = ResourceCost(MARKET_RESOURCE, 1, 0)
-
-                market_unit.creatable.resource_costs = (
-                    market_stone_cost,
-                    market_wood_cost,
-                    market_resource_cost,
-                )
-
-                # Deduct the MARKET_RESOURCE on completion, return it on destruction
-                market_headroom_storage = ResourceStorage(resources.POPULATION_HEADROOM, 0, 4)
-                market_resource_storage = ResourceStorage(MARKET_RESOURCE, -1, 2)
-                empty_storage           = ResourceStorage(-1, 0, 0)
-
-                market_unit.resource_storages = (
-                    market_headroom_storage,
-                    market_resource_storage,
-                    empty_storage,
-                )
-
-
-
-def triple_building_health(df: DatFile):
-    print("Tripling health of all buildings")
-    MAX_HP = 32767  # Maximum value for int16
-    for civ in df.civs:
-        for unit in civ.units:
-            if unit is not None and unit.class_ in [unit_classes.BUILDING, unit_classes.WALL]:
-                original_hp = unit.hit_points
-                if original_hp >= 0:
-                    
-                    new_hp = original_hp
-                    if (
-                        unit.id in [units.CASTLE, units.TOWN_CENTER, units.DONJON] 
-                        or unit.id in units.TOWN_CENTER_ALL
-                        or unit.class_ == unit_classes.WALL
-                        or unit.class_ == unit_classes.TOWER
-                    ):
-                        new_hp = original_hp * 3
-                    else:
-                        new_hp = original_hp * 2
-
-                    if new_hp > MAX_HP:
-                        new_hp = MAX_HP
-                        print(f"Unit ID {unit.id} ({unit.name}): HP tripled from {original_hp} to {new_hp} (capped to {MAX_HP})")
-                    else:
-                        print(f"Unit ID {unit.id} ({unit.name}): HP tripled from {original_hp} to {new_hp}")
-                    unit.hit_points = new_hp
-                else:
-                    print(f"Unit ID {unit.id} ({unit.name}): HP not modified (original HP: {original_hp})")
-
-
-def double_building_build_time(df: DatFile):
-    print("Doubling build times of all buildings")
-    MAX_BUILD_TIME = 32767  # Maximum value for int16
-    for civ in df.civs:
-        for unit in civ.units:
-            if unit is not None and unit.class_ == unit_classes.BUILDING:
-                if hasattr(unit, 'creatable') and unit.creatable is not None:
-                    original_train_time = unit.creatable.train_time
-                    if original_train_time >= 0:
-                        new_train_time = original_train_time 
-
-                        # slower build time for castles, donjons, walls, and towers to avoid forward castle cheese when castles are stronger
-                        if (
-                            unit.id in [units.CASTLE, units.DONJON] 
-                            or unit.class_ == unit_classes.WALL
-                            or unit.class_ == unit_classes.TOWER
-                        ):
-                            new_train_time = int(original_train_time * 2)
-                        else:
-                            new_train_time = int(original_train_time * 1.6)
-
-                        if new_train_time > MAX_BUILD_TIME:
-                            new_train_time = MAX_BUILD_TIME
-                            print(f"Unit ID {unit.id} ({unit.name}): Build time doubled from {original_train_time} to {new_train_time} (capped to {MAX_BUILD_TIME})")
-                        else:
-                            print(f"Unit ID {unit.id} ({unit.name}): Build time doubled from {original_train_time} to {new_train_time}")
-                        unit.creatable.train_time = new_train_time
-                    else:
-                        print(f"Unit ID {unit.id} ({unit.name}): Build time not modified (original Build Time: {original_train_time})")
-
-
-def accelerate_spearman_halberdier_train_time(df: DatFile):
-    print("Doubling training speed for SPEARMAN and HALBERDIER")
-    target_units = [units.SPEARMAN, units.PIKEMAN, units.HEAVY_PIKEMAN, units.PIKEMAN_DONJON, units.SPEARMAN_DONJON, units.HALBERDIER, units.HALBERDIER_DONJON, units.SKIRMISHER, units.ELITE_SKIRMISHER, units.IMPERIAL_SKIRMISHER]
-    
-    for civ in df.civs:
-        for unit in civ.units:
-            if unit is not None and unit.id in target_units:
-                if hasattr(unit, 'creatable') and unit.creatable is not None:
-                    original_train_time = unit.creatable.train_time
-                    if original_train_time > 0:
-                        new_train_time = max(int(original_train_time / 2), 1)  # Halve the train time, minimum 1
-                        unit.creatable.train_time = new_train_time
-                        print(f"Unit ID {unit.id} ({unit.name}): Train time halved from {original_train_time} to {unit.creatable.train_time}")
-                    else:
-                        print(f"Unit ID {unit.id} ({unit.name}): Train time not modified (original Train Time: {original_train_time})")
-
-
-def better_siege_towers(df: DatFile):
-    print("Modifying Siege Towers to only cost 100 wood and have double hit points")
-    for civ in df.civs:
-        for unit in civ.units:
-            if unit is not None and unit.id == units.SIEGE_TOWER:
-                # Make siege towers slower
-                unit.speed = int(unit.speed * 0.5)
-                print(f"Siege Tower ID {units.SIEGE_TOWER}: speed halved from to {unit.speed}")
-                
-                # Ensure the unit has a 'creatable' attribute
-                if unit.creatable is not None:
-                    # Set resource costs to only 100 wood, others to 0
-                    unit.creatable.resource_costs = (
-                        ResourceCost(resources.GOLD, 50, 1),    # Stone cost set to 0
-                        ResourceCost(resources.WOOD, 200, 1),    # Wood cost set to 100
-                        ResourceCost(-1, 0, 0),                  # No third resource cost
-                    )
-                    print(f"Siege Tower ID {units.SIEGE_TOWER}: Resource costs set to 100 wood, 50 gold, 0 other resources")
-                else:
-                    print(f"Siege Tower ID {units.SIEGE_TOWER} has no creatable data; skipping resource cost modification")
+            changed_unit_ids.append(market_id)
+
+    return changed_unit_ids
+
+
+# Applied to every civ by create_mod.py after run_age_diplomacy
+PER_CIV_MODIFICATIONS = [disable_additional_town_centers, disable_additional_markets]
+
+
+MAX_INT16 = 32767  # Maximum value for int16 fields like hit points and train times
+
+
+# Castles, town centers, donjons and walls get triple health, other buildings double health
+def triple_building_health(hit_points: int, unit: Unit) -> int:
+    if hit_points < 0:
+        return hit_points
+    if (
+        unit.id in [units.CASTLE, units.TOWN_CENTER, units.DONJON]
+        or unit.id in units.TOWN_CENTER_ALL
+        or unit.class_ == unit_classes.WALL
+        or unit.class_ == unit_classes.TOWER
+    ):
+        return min(hit_points * 3, MAX_INT16)
+    return min(hit_points * 2, MAX_INT16)
+
+
+# Slower build time for castles, donjons, walls, and towers to avoid forward castle cheese when castles are stronger
+def double_building_build_time(train_time: int, unit: Unit) -> int:
+    if train_time < 0:
+        return train_time
+    if (
+        unit.id in [units.CASTLE, units.DONJON]
+        or unit.class_ == unit_classes.WALL
+        or unit.class_ == unit_classes.TOWER
+    ):
+        return min(int(train_time * 2), MAX_INT16)
+    return min(int(train_time * 1.6), MAX_INT16)
+
+
+# Siege towers only cost 200 wood and 50 gold
+def siege_tower_costs(resource_costs: tuple[ResourceCost, ResourceCost, ResourceCost], unit: Unit) -> tuple[ResourceCost, ResourceCost, ResourceCost]:
+    return (
+        ResourceCost(resources.GOLD, 50, 1),
+        ResourceCost(resources.WOOD, 200, 1),
+        ResourceCost(-1, 0, 0),  # No third resource cost
+    )
+
+
+# Applied in this order by run_age_diplomacy
+UNIT_RULES = [
+    Rule("Making villagers take longer to train", "creatable.train_time", scale(1.2), classes=[unit_classes.CIVILIAN]),
+    Rule("Making tradecarts take longer", "creatable.train_time", scale(2), classes=[unit_classes.TRADE_CART, unit_classes.TRADE_BOAT]),
+    Rule("Tripling health of all buildings", "hit_points", triple_building_health, classes=[unit_classes.BUILDING, unit_classes.WALL]),
+    Rule("Doubling build times of all buildings", "creatable.train_time", double_building_build_time, classes=[unit_classes.BUILDING]),
+    Rule(
+        "Doubling training speed for SPEARMAN and HALBERDIER",
+        "creatable.train_time",
+        scale(0.5, minimum=1),
+        unit_ids=[units.SPEARMAN, units.PIKEMAN, units.HEAVY_PIKEMAN, units.PIKEMAN_DONJON, units.SPEARMAN_DONJON, units.HALBERDIER, units.HALBERDIER_DONJON, units.SKIRMISHER, units.ELITE_SKIRMISHER, units.IMPERIAL_SKIRMISHER],
+    ),
+    Rule("Making siege towers slower", "speed", lambda speed, unit: int(speed * 0.5), unit_ids=[units.SIEGE_TOWER]),
+    Rule("Making siege towers cost 200 wood and 50 gold", "creatable.resource_costs", siege_tower_costs, unit_ids=[units.SIEGE_TOWER]),
+]
@@ -0,0 +1,95 @@
+import numpy as np
+from genieutils.datfile import DatFile
+
+from tools import tracking
+
+NAME = "columns"
+
+# Fields that are commonly edited in bulk. Nested fields are written as a dotted path from the unit
+DEFAULT_FIELDS = [
+    "id",
+    "base_id",
+    "class_",
+    "hit_points",
+    "speed",
+    "line_of_sight",
+    "creatable.train_time",
+    "type_50.displayed_attack",
+    "type_50.displayed_melee_armour",
+    "creatable.displayed_pierce_armor",
+]
+
+
+# A column-oriented view of unit stats across every civ
+# Every field becomes a NumPy masked array of shape [civ, unit], where unit is the index into civ.units
+# Cells are masked where the civ has no unit at that index or where the unit doesn't have the field (e.g. a unit without creatable)
+#
+# Edit the arrays with vectorized expressions and call write_back() once to copy the changes into the Unit objects:
+#     columns = UnitColumns(df, ["class_", "speed"])
+#     villagers = columns["class_"] == unit_classes.CIVILIAN
+#     columns["speed"] = np.ma.where(villagers, columns["speed"] * 0.5, columns["speed"])
+#     columns.write_back()
+class UnitColumns:
+    def __init__(self, df: DatFile, fields: list[str] = DEFAULT_FIELDS):
+        self.df = df
+        self.fields = list(fields)
+        self.shape = (len(df.civs), max((len(civ.units) for civ in df.civs), default=0))
+        self.columns: dict[str, np.ma.MaskedArray] = {}
+        self._original: dict[str, np.ndarray] = {}
+        self._is_int: dict[str, bool] = {}
+        for field in self.fields:
+            self._load(field)
+
+    def __getitem__(self, field: str) -> np.ma.MaskedArray:
+        return self.columns[field]
+
+    # Replace a column. Cells that are masked in the original column stay untouched on write back, whatever the new value is
+    def __setitem__(self, field: str, values):
+        if field not in self.columns:
+            raise KeyError(f"{field} is not part of this view, add it to the fields when creating the UnitColumns")
+        new_column = np.ma.masked_array(np.broadcast_to(np.ma.getdata(values), self.shape).copy(), mask=self.columns[field].mask.copy())
+        self.columns[field] = new_column
+
+    # Copy every changed, unmasked cell back into its Unit and return how many values were written
+    # Integer fields are rounded towards zero like int() would, so they keep the type genieutils expects
+    def write_back(self) -> int:
+        written = 0
+        for field in self.fields:
+            column = self.columns[field]
+            data = np.ma.getdata(column)
+            changed = (data != self._original[field]) & ~np.ma.getmaskarray(column)
+            path = field.split(".")
+            for civ_id, unit_id in zip(*np.nonzero(changed)):
+                owner = self.df.civs[civ_id].units[unit_id]
+                tracking.mark_units(self.df, [owner])
+                for part in path[:-1]:
+                    owner = getattr(owner, part)
+                value = data[civ_id, unit_id]
+                setattr(owner, path[-1], int(value) if self._is_int[field] else float(value))
+                written += 1
+            self._original[field] = data.copy()
+        return written
+
+    def _load(self, field: str):
+        path = field.split(".")
+        values = np.zeros(self.shape, dtype=np.float64)
+        mask = np.ones(self.shape, dtype=bool)
+        is_int = True
+        for civ_id, civ in enumerate(self.df.civs):
+            for unit_id, unit in enumerate(civ.units):
+                value = unit
+                for part in path:
+                    if value is None:
+                        break
+                    value = getattr(value, part)
+                if value is None:
+                    continue
+                if isinstance(value, float):
+                    is_int = False
+                values[civ_id, unit_id] = value
+                mask[civ_id, unit_id] = False
+        if is_int:
+            values = values.astype(np.int64)
+        self._is_int[field] = is_int
+        self._original[field] = values.copy()
+        self.columns[field] = np.ma.masked_array(values, mask=mask)
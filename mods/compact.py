@@ -0,0 +1,289 @@
+import weakref
+from array import array
+from collections.abc import MutableSequence
+
+from genieutils.common import GenieClass
+from genieutils.datfile import DatFile
+from genieutils.effect import EffectCommand
+from genieutils.tech import ResearchResourceCost
+from genieutils.unit import AttackOrArmor, ResourceCost, ResourceStorage
+
+NAME = "compact"
+
+# A DatFile holds hundreds of thousands of tiny objects: the attacks and armours of every unit, every EffectCommand,
+# and three costs and three resource storages for every unit of every civ, most of them identical across civs
+# This module offers two ways of storing them in less memory, which also makes the cached DatFiles a lot smaller:
+#
+# 1. Compact arrays keep the attacks and armours of a unit, or the commands of an effect, in one array per field instead of one object per entry
+#    They behave like the lists they replace: entries are AttackOrArmor / EffectCommand objects that write through to the arrays,
+#    so `for attack in type_50.attacks: attack.amount += 1` and `effect.effect_commands.append(EffectCommand(...))` work as before
+#    An entry object keeps pointing at its entry while the array changes around it, just like the object in a list would
+#    Unlike a list, appending or inserting an object copies its values into the array, so keep changing it through `array[-1]` instead
+#
+# 2. Interning replaces identical cost and resource storage tuples by one shared tuple
+#    The costs in an interned tuple can't be changed, since that would change them for every unit sharing the tuple
+#    Assign a new tuple instead, like the mods in this repository already do: `unit.creatable.resource_costs = (ResourceCost(...), ...)`
+#
+# compact_datfile() applies both to a whole DatFile
+
+
+class CompactArray(MutableSequence):
+    item_class: type[GenieClass]
+    fields: tuple[str, ...]
+    typecodes: tuple[str, ...]
+    __slots__ = ("columns", "_views")
+
+    def __init__(self, items=()):
+        self.columns = tuple(array(typecode) for typecode in self.typecodes)
+        # Entry objects handed out so far, by index. Weak, so that entries nobody holds on to don't take up any memory
+        self._views: weakref.WeakValueDictionary | None = None
+        for item in items:
+            for column, field in zip(self.columns, self.fields):
+                column.append(getattr(item, field))
+
+    def __len__(self) -> int:
+        return len(self.columns[0])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[item_index] for item_index in range(*index.indices(len(self)))]
+        index = self._index(index)
+        if self._views is None:
+            self._views = weakref.WeakValueDictionary()
+        view = self._views.get(index)
+        if view is None:
+            view = self.view_class.__new__(self.view_class)
+            view._owner = self
+            view._index = index
+            self._views[index] = view
+        return view
+
+    def __setitem__(self, index, item):
+        if isinstance(index, slice):
+            raise TypeError(f"{type(self).__name__} doesn't support slice assignment, assign a list instead")
+        index = self._index(index)
+        for column, field in zip(self.columns, self.fields):
+            column[index] = getattr(item, field)
+
+    def __delitem__(self, index):
+        indexes = range(*index.indices(len(self))) if isinstance(index, slice) else [self._index(index)]
+        for removed_index in sorted(indexes, reverse=True):
+            self._shift_views(removed_index, -1)
+            for column in self.columns:
+                del column[removed_index]
+
+    def insert(self, index: int, item):
+        index = min(max(index + len(self) if index < 0 else index, 0), len(self))
+        self._shift_views(index, 1)
+        for column, field in zip(self.columns, self.fields):
+            column.insert(index, getattr(item, field))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, (list, tuple, CompactArray)):
+            return NotImplemented
+        return len(self) == len(other) and all(item == other_item for item, other_item in zip(self, other))
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({list(self)!r})"
+
+    def __reduce__(self):
+        return _from_columns, (type(self), self.columns)
+
+    def __copy__(self):
+        return _from_columns(type(self), tuple(array(column.typecode, column) for column in self.columns))
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
+    # The regular genieutils objects, e.g. to hand the entries to code that needs a real list
+    def to_list(self) -> list:
+        return [self.item_class(*values) for values in zip(*self.columns)]
+
+    def _index(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"{type(self).__name__} index out of range")
+        return index
+
+    # Keep the handed out entry objects pointing at their entries when an entry is inserted or removed before them
+    # The entry object of a removed entry keeps its values but isn't part of the array anymore
+    def _shift_views(self, index: int, offset: int):
+        if not self._views:
+            return
+        views = dict(self._views)
+        self._views = weakref.WeakValueDictionary()
+        for view_index, view in views.items():
+            if offset < 0 and view_index == index:
+                view._values = [column[index] for column in self.columns]
+                view._owner = None
+                continue
+            if view_index >= index:
+                view._index = view_index + offset
+            self._views[view._index] = view
+
+
+def _from_columns(cls: type[CompactArray], columns: tuple[array, ...]) -> CompactArray:
+    compact_array = cls.__new__(cls)
+    compact_array.columns = columns
+    compact_array._views = None
+    return compact_array
+
+
+# The entry objects of a compact array are subclasses of the genieutils class whose fields read from and write to the array
+def _view_class(item_class: type[GenieClass], fields: tuple[str, ...]) -> type:
+    def make_field(field_index: int) -> property:
+        def get(self):
+            if self._owner is None:
+                return self._values[field_index]
+            return self._owner.columns[field_index][self._index]
+
+        def set(self, value):
+            if self._owner is None:
+                self._values[field_index] = value
+            else:
+                self._owner.columns[field_index][self._index] = value
+
+        return property(get, set)
+
+    namespace = {
+        "__slots__": ("_owner", "_index", "_values"),
+        # Equal to a regular genieutils object with the same values, and pickled or copied as one
+        "__eq__": lambda self, other: _equal_fields(self, other, item_class, fields),
+        "__reduce__": lambda self: (item_class, tuple(getattr(self, field) for field in fields)),
+    }
+    for field_index, field in enumerate(fields):
+        namespace[field] = make_field(field_index)
+    return type(f"Compact{item_class.__name__}", (item_class,), namespace)
+
+
+class AttackOrArmorArray(CompactArray):
+    __slots__ = ()
+    item_class = AttackOrArmor
+    fields = ("class_", "amount")
+    typecodes = ("h", "h")
+    view_class = _view_class(AttackOrArmor, fields)
+
+
+class EffectCommandArray(CompactArray):
+    __slots__ = ()
+    item_class = EffectCommand
+    fields = ("type", "a", "b", "c", "d")
+    # D is stored as a double rather than as the 32-bit float of the dat file, so it reads back exactly as it was set
+    typecodes = ("B", "h", "h", "h", "d")
+    view_class = _view_class(EffectCommand, fields)
+
+
+# Interned costs and resource storages refuse to be changed, see the top of this file
+class _Interned:
+    __slots__ = ()
+    base_class: type[GenieClass]
+    fields: tuple[str, ...]
+
+    def __setattr__(self, name: str, value):
+        raise TypeError(f"Interned {self.base_class.__name__}s are shared between units, assign a new tuple instead of changing one of them")
+
+    def __eq__(self, other) -> bool:
+        return _equal_fields(self, other, self.base_class, self.fields)
+
+    def __reduce__(self):
+        return _intern_item, (self.base_class, tuple(getattr(self, field) for field in self.fields))
+
+
+class InternedResourceCost(_Interned, ResourceCost):
+    __slots__ = ()
+    base_class = ResourceCost
+    fields = ("type", "amount", "flag")
+
+
+class InternedResourceStorage(_Interned, ResourceStorage):
+    __slots__ = ()
+    base_class = ResourceStorage
+    fields = ("type", "amount", "flag")
+
+
+class InternedResearchResourceCost(_Interned, ResearchResourceCost):
+    __slots__ = ()
+    base_class = ResearchResourceCost
+    fields = ("type", "amount", "flag")
+
+
+INTERNED_CLASSES = {
+    ResourceCost: InternedResourceCost,
+    ResourceStorage: InternedResourceStorage,
+    ResearchResourceCost: InternedResearchResourceCost,
+}
+
+_interned_items: dict[tuple, _Interned] = {}
+_interned_tuples: dict[tuple, tuple] = {}
+
+
+# Return the shared, interned tuple with the same costs or resource storages
+# Anything that isn't a tuple of ResourceCost, ResourceStorage or ResearchResourceCost is returned as is
+def intern_costs(costs: tuple) -> tuple:
+    key = tuple(_item_key(cost) for cost in costs)
+    if None in key:
+        return costs
+    interned = _interned_tuples.get(key)
+    if interned is None:
+        interned = _interned_tuples[key] = tuple(_intern_item(cost_key[0], cost_key[1:]) for cost_key in key)
+    return interned
+
+
+def _item_key(cost) -> tuple | None:
+    cost_class = getattr(cost, "base_class", type(cost))
+    if cost_class not in INTERNED_CLASSES:
+        return None
+    return (cost_class, *(getattr(cost, field) for field in INTERNED_CLASSES[cost_class].fields))
+
+
+def _intern_item(cost_class: type[GenieClass], values: tuple) -> _Interned:
+    key = (cost_class, *values)
+    interned = _interned_items.get(key)
+    if interned is None:
+        interned_class = INTERNED_CLASSES[cost_class]
+        interned = interned_class.__new__(interned_class)
+        for field, value in zip(interned_class.fields, values):
+            object.__setattr__(interned, field, value)
+        _interned_items[key] = interned
+    return interned
+
+
+# Convert the attacks, armours and effect commands of a DatFile to compact arrays and intern all of its costs and resource storages
+def compact_datfile(df: DatFile):
+    for effect in df.effects:
+        if not isinstance(effect.effect_commands, EffectCommandArray):
+            effect.effect_commands = EffectCommandArray(effect.effect_commands)
+    for tech in df.techs:
+        tech.resource_costs = intern_costs(tech.resource_costs)
+    for civ in df.civs:
+        for unit in civ.units:
+            if unit is None:
+                continue
+            unit.resource_storages = intern_costs(unit.resource_storages)
+            if unit.type_50 is not None:
+                if not isinstance(unit.type_50.attacks, AttackOrArmorArray):
+                    unit.type_50.attacks = AttackOrArmorArray(unit.type_50.attacks)
+                if not isinstance(unit.type_50.armours, AttackOrArmorArray):
+                    unit.type_50.armours = AttackOrArmorArray(unit.type_50.armours)
+            if unit.creatable is not None:
+                unit.creatable.resource_costs = intern_costs(unit.creatable.resource_costs)
+
+
+# The type a value stands in for: list for a compact array, the genieutils class for its entries and for interned costs
+def plain_type(value) -> type:
+    if isinstance(value, CompactArray):
+        return list
+    if isinstance(value, _Interned):
+        return value.base_class
+    return PLAIN_CLASSES.get(type(value), type(value))
+
+
+PLAIN_CLASSES = {array_class.view_class: array_class.item_class for array_class in (AttackOrArmorArray, EffectCommandArray)}
+INTERNED_TYPES = tuple(INTERNED_CLASSES.values())
+
+
+def _equal_fields(value, other, cls: type, fields: tuple[str, ...]) -> bool:
+    if not isinstance(other, cls):
+        return NotImplemented
+    return all(getattr(value, field) == getattr(other, field) for field in fields)
@@ -11,5 +11,10 @@ from mods import helpers
 
 NAME = "custom_modifications"
 
+# The DatFile sections this mod changes, see tools/tracking.py. Add every section your code changes, e.g. ["techs", "effects"]
+# Add "civs" when you change units directly through df.civs, units looked up through mods/indexes.py or changed with mods/rules.py don't need it
+# Saving notices most changes that are missing from the list, run python ./create_mod.py --check-sections to make sure nothing is
+MODIFIED_SECTIONS = []
+
 def run_custom_modifications(df: DatFile):
     print("Your code goes here:")
@@ -1,3 +1,7 @@
+import copy
+import dataclasses
+
+from genieutils.common import GenieClass
 from genieutils.datfile import DatFile
 from genieutils.task import Task
 from genieutils.effect import Effect, EffectCommand
@@ -5,6 +9,7 @@ from genieutils.tech import ResearchResourceCost, Tech
 from genieutils.unit import ResourceCost
 
 from constants import *
+from mods import compact, indexes
 
 NAME = "helpers"
 
@@ -151,3 +156,79 @@ def copy_architecture(df: DatFile, copyFrom: int, copyTo: int):
             elif df.civs[copyFrom].units[unit_id].class_ == unit_classes.MONK:
                 for task_id in range(len(df.civs[copyFrom].units[unit_id].bird.tasks)):
                     df.civs[copyTo].units[unit_id].bird.tasks[task_id].proceeding_graphic_id = df.civs[copyFrom].units[unit_id].bird.tasks[task_id].proceeding_graphic_id
+
+
+_field_names: dict[type, tuple[str, ...]] = {}
+_immutable_types = (int, float, str, bool, type(None), *compact.INTERNED_TYPES)
+
+
+# A faster replacement for copy.deepcopy on genieutils objects (units, techs, effects, ...)
+# genieutils objects only hold numbers, strings, tuples, lists and other genieutils objects, so we can copy them field by field
+# without the bookkeeping deepcopy does for arbitrary objects. Tuples of plain values can't be changed and are shared instead of copied
+# The same goes for interned costs, see mods/compact.py
+def fast_copy(value):
+    value_type = type(value)
+    if value_type in _immutable_types:
+        return value
+    if value_type is list:
+        return [fast_copy(item) for item in value]
+    if value_type is tuple:
+        for item in value:
+            if type(item) not in _immutable_types:
+                return tuple(fast_copy(item) for item in value)
+        return value
+    if isinstance(value, GenieClass):
+        # An entry of a compact array is copied into a regular genieutils object
+        value_type = compact.PLAIN_CLASSES.get(value_type, value_type)
+        field_names = _field_names.get(value_type)
+        if field_names is None:
+            field_names = _field_names[value_type] = tuple(field.name for field in dataclasses.fields(value_type))
+        copied = value_type.__new__(value_type)
+        for field_name in field_names:
+            setattr(copied, field_name, fast_copy(getattr(value, field_name)))
+        return copied
+    return copy.deepcopy(value)
+
+
+# Duplicate one unit, or a whole upgrade line, for every civ and return a dictionary of {original unit ID: new unit ID}
+# The copies get the same new IDs in every civ, appended after the last unit of the civ with the most units
+# Every EffectCommand that targets one of the original units through its A value (attribute modifiers, enabling and upgrading)
+# is duplicated for the copy, so the copies receive the same technology and civ bonuses as the originals
+# Upgrades between units of the line are pointed at the copied units, so the copied line upgrades along itself
+def clone_units(df: DatFile, unit_ids: list[int], copy_effects: bool = True) -> dict[int, int]:
+    first_new_id = max(len(civ.units) for civ in df.civs)
+    new_ids = {unit_id: first_new_id + offset for offset, unit_id in enumerate(unit_ids)}
+
+    for civ in df.civs:
+        # Pad civs with fewer units so that the copies line up across civs
+        civ.units.extend([None] * (first_new_id - len(civ.units)))
+        for unit_id in unit_ids:
+            original = civ.units[unit_id]
+            if original is None:
+                civ.units.append(None)
+                continue
+            unit_copy = fast_copy(original)
+            unit_copy.id = new_ids[unit_id]
+            unit_copy.base_id = new_ids[unit_id]
+            unit_copy.copy_id = new_ids[unit_id]
+            civ.units.append(unit_copy)
+
+    if copy_effects:
+        effect_index = indexes.get_effect_index(df)
+        duplicates = []
+        for unit_id in unit_ids:
+            for effect_id, effect_command in effect_index.query(unit=unit_id):
+                family = indexes.command_family(effect_command.type)
+                # Spawning a unit is not something the copy should do twice
+                if family == command_types.SPAWN_UNIT:
+                    continue
+                duplicated_effect_command = fast_copy(effect_command)
+                duplicated_effect_command.a = new_ids[unit_id]
+                if family == command_types.UPGRADE_UNIT and effect_command.b in new_ids:
+                    duplicated_effect_command.b = new_ids[effect_command.b]
+                duplicates.append((effect_id, duplicated_effect_command))
+        # Append only after all queries are done, so the duplicates are never duplicated themselves
+        for effect_id, duplicated_effect_command in duplicates:
+            effect_index.append(effect_id, duplicated_effect_command)
+
+    return new_ids
@@ -0,0 +1,258 @@
+from genieutils.datfile import DatFile
+from genieutils.effect import EffectCommand
+from genieutils.unit import Unit
+
+from constants import command_types
+from tools import tracking
+
+NAME = "indexes"
+
+
+# Most mods look for units of a certain class, ID or base ID across every civ
+# Looping over every unit of every civ for each of those lookups adds up quickly, so this index groups all units once
+# Every entry is a (civ_id, unit) pair, ordered by civ the same way a loop over df.civs would visit them
+#
+# The index notices when units are appended to (or removed from) a civ's unit list and rebuilds itself on the next lookup
+# If you change the class, ID or base ID of an existing unit or replace a unit in place, call invalidate() yourself
+#
+# Every unit returned by a lookup is marked as changed for tools/tracking.py, since the caller usually looks units up to change them
+# Pass mark=False for lookups that only read the units, e.g. to check or print them, so that saving doesn't encode them again
+class UnitIndex:
+    def __init__(self, df: DatFile):
+        self.df = df
+        self.by_class: dict[int, list[tuple[int, Unit]]] = {}
+        self.by_id: dict[int, list[tuple[int, Unit]]] = {}
+        self.by_base_id: dict[int, list[tuple[int, Unit]]] = {}
+        self._shape: list[tuple[int, int] | None] | None = None
+
+    def invalidate(self):
+        self._shape = None
+
+    # Rebuild the index if it was never built or if any civ's unit list changed length since the last build
+    def refresh(self):
+        if self._shape == self._current_shape():
+            return
+        self.by_class = {}
+        self.by_id = {}
+        self.by_base_id = {}
+        for civ_id, civ in enumerate(self.df.civs):
+            for unit in civ.units:
+                if unit is None:
+                    continue
+                self.by_class.setdefault(unit.class_, []).append((civ_id, unit))
+                self.by_id.setdefault(unit.id, []).append((civ_id, unit))
+                self.by_base_id.setdefault(unit.base_id, []).append((civ_id, unit))
+        self._shape = self._current_shape()
+
+    # All (civ_id, unit) pairs whose unit class is one of the given classes
+    def entries_of_class(self, *classes: int, mark: bool = True) -> list[tuple[int, Unit]]:
+        self.refresh()
+        entries = self._merge(self.by_class, classes)
+        return self._mark(entries) if mark else entries
+
+    # All (civ_id, unit) pairs whose unit.id is one of the given IDs
+    def entries_with_id(self, *unit_ids: int, mark: bool = True) -> list[tuple[int, Unit]]:
+        self.refresh()
+        entries = self._merge(self.by_id, unit_ids)
+        return self._mark(entries) if mark else entries
+
+    # All (civ_id, unit) pairs whose unit.base_id is one of the given IDs
+    def entries_with_base_id(self, *base_ids: int, mark: bool = True) -> list[tuple[int, Unit]]:
+        self.refresh()
+        entries = self._merge(self.by_base_id, base_ids)
+        return self._mark(entries) if mark else entries
+
+    def units_of_class(self, *classes: int, mark: bool = True) -> list[Unit]:
+        return [unit for _, unit in self.entries_of_class(*classes, mark=mark)]
+
+    def units_with_id(self, *unit_ids: int, mark: bool = True) -> list[Unit]:
+        return [unit for _, unit in self.entries_with_id(*unit_ids, mark=mark)]
+
+    def units_with_base_id(self, *base_ids: int, mark: bool = True) -> list[Unit]:
+        return [unit for _, unit in self.entries_with_base_id(*base_ids, mark=mark)]
+
+    # Building the index decodes the units of every lazily loaded civ (see tools/lazy.py), checking whether to build it doesn't
+    def _current_shape(self) -> list[tuple[int, int] | None]:
+        return [(id(civ.units), len(civ.units)) if tracking.is_loaded(civ, "units") else None for civ in self.df.civs]
+
+    def _mark(self, entries: list[tuple[int, Unit]]) -> list[tuple[int, Unit]]:
+        tracking.mark_units(self.df, [unit for _, unit in entries])
+        return entries
+
+    # Combine the entries of several keys, keeping them in civ order like a plain loop over df.civs would
+    def _merge(self, index: dict[int, list[tuple[int, Unit]]], keys: tuple[int, ...]) -> list[tuple[int, Unit]]:
+        if len(keys) == 1:
+            return list(index.get(keys[0], []))
+        entries = []
+        for key in dict.fromkeys(keys):
+            entries.extend(index.get(key, []))
+        entries.sort(key=lambda entry: entry[0])
+        return entries
+
+
+_unit_index: UnitIndex | None = None
+
+
+# Return the unit index of this DatFile, building it on first use
+# Only the index of the most recently used DatFile is kept around
+def get_unit_index(df: DatFile) -> UnitIndex:
+    global _unit_index
+    if _unit_index is None or _unit_index.df is not df:
+        _unit_index = UnitIndex(df)
+    return _unit_index
+
+
+# EffectCommand types below 100 repeat every 10 values for the player, team, enemy, neutral and GAIA versions of the same command
+# Taking the type modulus 10 gives the "family" of the command, which matches the player version in constants/command_types.py
+# Technology commands (101, 102, 103) have no team versions and are their own family
+def command_family(command_type: int) -> int:
+    if command_type < 100:
+        return command_type % 10
+    return command_type
+
+
+ATTRIBUTE_FAMILIES = (command_types.ATTRIBUTE_MODIFIER_SET, command_types.ATTRIBUTE_MODIFIER_ADDITIVE, command_types.ATTRIBUTE_MODIFIER_MULTIPLICATIVE)
+UNIT_FAMILIES = ATTRIBUTE_FAMILIES + (command_types.ENABLE_DISABLE_UNIT, command_types.UPGRADE_UNIT, command_types.SPAWN_UNIT)
+
+
+# The unit, class, attribute and technology an EffectCommand targets, or None if the command has no such target
+# For attribute modifiers A is the unit, B the unit class and C the attribute. Other unit commands only use A for the unit
+# Disabling a technology stores the technology in D, modifying a technology's cost or time stores it in A
+def command_targets(command: EffectCommand) -> tuple[int | None, int | None, int | None, int | None]:
+    family = command_family(command.type)
+    unit = class_ = attribute = tech = None
+    if family in UNIT_FAMILIES and command.a >= 0:
+        unit = command.a
+    if family in ATTRIBUTE_FAMILIES:
+        if command.b >= 0:
+            class_ = command.b
+        attribute = command.c
+    if family == command_types.DISABLE_TECH:
+        tech = int(command.d)
+    elif family in (command_types.MODIFY_TECH, command_types.TECH_COST_MODIFIER_SET_ADDITIVE, command_types.TECH_TIME_MODIFIER_SET_ADDITIVE):
+        tech = command.a
+    return unit, class_, attribute, tech
+
+
+# Looking for the EffectCommands that touch a unit, class or attribute otherwise means walking every command of every effect
+# This index groups all commands by family, unit (A), unit class (B), attribute (C) and technology once
+# Every entry is an (effect_id, effect_command) pair, ordered the same way a loop over df.effects would visit them
+#
+# Add and remove commands through append() and remove() to keep the index up to date without rebuilding it
+# Commands added or removed directly on an effect are noticed by their count changing and cause a rebuild on the next query
+# If you change the type, A, B, C or D of an existing command, call invalidate() yourself
+class EffectIndex:
+    def __init__(self, df: DatFile):
+        self.df = df
+        self.by_family: dict[int, list[tuple[int, EffectCommand]]] = {}
+        self.by_unit: dict[int, list[tuple[int, EffectCommand]]] = {}
+        self.by_class: dict[int, list[tuple[int, EffectCommand]]] = {}
+        self.by_attribute: dict[int, list[tuple[int, EffectCommand]]] = {}
+        self.by_tech: dict[int, list[tuple[int, EffectCommand]]] = {}
+        self._shape: list[tuple[int, int]] | None = None
+
+    def invalidate(self):
+        self._shape = None
+
+    def refresh(self):
+        if self._shape == self._current_shape():
+            return
+        self.by_family = {}
+        self.by_unit = {}
+        self.by_class = {}
+        self.by_attribute = {}
+        self.by_tech = {}
+        for effect_id, effect in enumerate(self.df.effects):
+            for effect_command in effect.effect_commands:
+                self._add(effect_id, effect_command)
+        self._shape = self._current_shape()
+
+    # Return the (effect_id, effect_command) pairs matching every given filter
+    # family may be a single family or a tuple of families, e.g. ATTRIBUTE_FAMILIES
+    def query(self, family: int | tuple[int, ...] | None = None, unit: int | None = None, class_: int | None = None, attribute: int | None = None, tech: int | None = None) -> list[tuple[int, EffectCommand]]:
+        self.refresh()
+        families = (family,) if isinstance(family, int) else family
+        wanted = (unit, class_, attribute, tech)
+
+        # Start from the smallest bucket of the given filters and check the remaining filters on each of its commands
+        candidates = []
+        for index, key in ((self.by_unit, unit), (self.by_class, class_), (self.by_attribute, attribute), (self.by_tech, tech)):
+            if key is not None:
+                candidates.append(index.get(key, []))
+        if families is not None:
+            family_entries = []
+            for command_family_id in dict.fromkeys(families):
+                family_entries.extend(self.by_family.get(command_family_id, []))
+            candidates.append(family_entries)
+        if not candidates:
+            candidates.append([entry for entries in self.by_family.values() for entry in entries])
+
+        matches = []
+        for effect_id, effect_command in min(candidates, key=len):
+            if families is not None and command_family(effect_command.type) not in families:
+                continue
+            targets = command_targets(effect_command)
+            if all(want is None or want == target for want, target in zip(wanted, targets)):
+                matches.append((effect_id, effect_command))
+        # Commands appended through the index end up at the back of their buckets, and commands of several families come from several buckets,
+        # so restore the order of the effects and of the commands within each effect here
+        positions = {}
+        for effect_id in dict.fromkeys(effect_id for effect_id, _ in matches):
+            for position, effect_command in enumerate(self.df.effects[effect_id].effect_commands):
+                positions[id(effect_command)] = position
+        matches.sort(key=lambda entry: (entry[0], positions[id(entry[1])]))
+        return matches
+
+    # Append a command to an effect and to the index
+    def append(self, effect_id: int, effect_command: EffectCommand):
+        self.refresh()
+        effect_commands = self.df.effects[effect_id].effect_commands
+        effect_commands.append(effect_command)
+        # Index the command as stored in the effect, which is a copy of it for compact arrays (see mods/compact.py)
+        self._add(effect_id, effect_commands[-1])
+        self._shape[effect_id] = self._effect_shape(effect_id)
+
+    # Remove this exact command object from an effect and from the index
+    def remove(self, effect_id: int, effect_command: EffectCommand):
+        self.refresh()
+        effect_commands = self.df.effects[effect_id].effect_commands
+        for command_index, existing_command in enumerate(effect_commands):
+            if existing_command is effect_command:
+                effect_commands.pop(command_index)
+                break
+        else:
+            raise ValueError(f"EffectCommand is not part of effect {effect_id}")
+        for index, key in self._buckets(effect_command):
+            index[key] = [entry for entry in index[key] if entry[1] is not effect_command]
+        self._shape[effect_id] = self._effect_shape(effect_id)
+
+    def _add(self, effect_id: int, effect_command: EffectCommand):
+        for index, key in self._buckets(effect_command):
+            index.setdefault(key, []).append((effect_id, effect_command))
+
+    def _buckets(self, effect_command: EffectCommand) -> list[tuple[dict[int, list[tuple[int, EffectCommand]]], int]]:
+        unit, class_, attribute, tech = command_targets(effect_command)
+        buckets = [(self.by_family, command_family(effect_command.type))]
+        for index, key in ((self.by_unit, unit), (self.by_class, class_), (self.by_attribute, attribute), (self.by_tech, tech)):
+            if key is not None:
+                buckets.append((index, key))
+        return buckets
+
+    def _effect_shape(self, effect_id: int) -> tuple[int, int]:
+        effect_commands = self.df.effects[effect_id].effect_commands
+        return id(effect_commands), len(effect_commands)
+
+    def _current_shape(self) -> list[tuple[int, int]]:
+        return [self._effect_shape(effect_id) for effect_id in range(len(self.df.effects))]
+
+
+_effect_index: EffectIndex | None = None
+
+
+# Return the effect index of this DatFile, building it on first use
+# Only the index of the most recently used DatFile is kept around
+def get_effect_index(df: DatFile) -> EffectIndex:
+    global _effect_index
+    if _effect_index is None or _effect_index.df is not df:
+        _effect_index = EffectIndex(df)
+    return _effect_index
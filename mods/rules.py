@@ -0,0 +1,102 @@
+from dataclasses import dataclass, field
+from typing import Callable
+
+from genieutils.datfile import DatFile
+from genieutils.unit import Unit
+
+from mods import indexes
+from tools import tracking
+
+NAME = "rules"
+
+# Most unit changes follow the same pattern: pick units by class, ID or base ID, then change one field of each of them
+# Written as separate functions, every change looks its units up and loops over them on its own
+# Written as rules, a mod lists those changes declaratively and apply_rules() makes a single pass over the selected units,
+# applying every rule that selects a unit before moving on to the next unit
+#
+#   RULES = [
+#       Rule("Making villagers take longer to train", "creatable.train_time", scale(1.2), classes=[unit_classes.CIVILIAN]),
+#       Rule("Halving siege tower speed", "speed", lambda speed, unit: speed * 0.5, unit_ids=[units.SIEGE_TOWER]),
+#   ]
+#   apply_rules(df, RULES)
+#
+# Rules are applied to a unit in the order they are listed, so a rule sees what the rules before it changed on the same unit
+# That gives the same result as running them one after the other, as long as a rule only changes the unit it is given
+
+
+# A unit is selected if its class, ID or base ID is one of the given ones, and `where` (if given) returns True for it
+# The field is an attribute path starting at the unit, e.g. "hit_points" or "creatable.train_time"
+# Units for which any part of the path is None (e.g. units that aren't creatable) are skipped
+# transform receives the current value of the field and the unit, and returns the new value
+# It has to return a new value instead of changing the current one in place: a unit whose values come back equal is left as it is and isn't saved again
+@dataclass
+class Rule:
+    description: str
+    field: str
+    transform: Callable[[object, Unit], object]
+    classes: list[int] = field(default_factory=list)
+    unit_ids: list[int] = field(default_factory=list)
+    base_ids: list[int] = field(default_factory=list)
+    where: Callable[[Unit], bool] | None = None
+
+    def selects(self, unit: Unit) -> bool:
+        if unit.class_ not in self.classes and unit.id not in self.unit_ids and unit.base_id not in self.base_ids:
+            return False
+        return self.where is None or self.where(unit)
+
+
+# Apply all rules in one pass over the units they select and return the number of changed fields
+# With verbose, every change is printed the same way the mods in this repository print them
+def apply_rules(df: DatFile, rules: list[Rule], verbose: bool = True) -> int:
+    for rule in rules:
+        print(rule.description)
+
+    # Look up the units of every rule in the unit index. Only the units a rule actually changes are marked as changed for tools/tracking.py
+    unit_index = indexes.get_unit_index(df)
+    selected: dict[int, tuple[int, Unit]] = {}
+    for rule in rules:
+        for entry in unit_index.entries_of_class(*rule.classes, mark=False) + unit_index.entries_with_id(*rule.unit_ids, mark=False) + unit_index.entries_with_base_id(*rule.base_ids, mark=False):
+            selected.setdefault(id(entry[1]), entry)
+
+    paths = [rule.field.split(".") for rule in rules]
+    changes = 0
+    changed_units = []
+    for _, unit in sorted(selected.values(), key=lambda entry: entry[0]):
+        unit_changes = changes
+        for rule, path in zip(rules, paths):
+            if not rule.selects(unit):
+                continue
+            parent = unit
+            for name in path[:-1]:
+                parent = getattr(parent, name)
+                if parent is None:
+                    break
+            else:
+                original = getattr(parent, path[-1])
+                value = rule.transform(original, unit)
+                if value == original:
+                    continue
+                setattr(parent, path[-1], value)
+                changes += 1
+                if verbose:
+                    print(f"Unit ID {unit.id} ({unit.name}): {rule.field} changed from {original} to {value}")
+        if changes > unit_changes:
+            changed_units.append(unit)
+    tracking.mark_units(df, changed_units)
+    return changes
+
+
+# Transform multiplying a number, rounding down to an int like the mods in this repository do
+# Values of 0 or less usually mean "not used" and are left alone. The result is kept between minimum and maximum if given
+def scale(factor: float, minimum: int | None = None, maximum: int | None = None) -> Callable[[int, Unit], int]:
+    def transform(value: int, unit: Unit) -> int:
+        if value <= 0:
+            return value
+        value = int(value * factor)
+        if minimum is not None:
+            value = max(value, minimum)
+        if maximum is not None:
+            value = min(value, maximum)
+        return value
+
+    return transform
@@ -0,0 +1,124 @@
+from genieutils.datfile import DatFile
+
+from constants import command_types, techs
+
+NAME = "techtree"
+
+# The ages in order. earliest_age() returns an index into this list
+AGES = [techs.DARK_AGE, techs.FEUDAL_AGE, techs.CASTLE_AGE, techs.IMPERIAL_AGE]
+
+# Whether a civ can research a technology depends on all of its prerequisites, their prerequisites and so on, which makes it slow to check by hand
+# This graph links every technology to its prerequisites and works out once per civ which technologies it can research and in which age at the earliest
+#
+# A technology can be researched by a civ if
+#   - its civ is -1 (every civ) or that civ
+#   - the civ's tech tree effect doesn't disable it (EffectCommand 102 with the technology in D)
+#   - at least required_tech_count of its required_techs can be researched
+# Its earliest age is the age the civ is in once the prerequisites it needs at the earliest are researched. Researching an age technology advances to that age
+# Technologies disabled by researching another technology (e.g. two mutually exclusive versions of wheelbarrow) can still be researched, see exclusions()
+#
+# The graph notices technologies appended to df.techs and adds them on the next lookup without starting over
+# If you change the prerequisites or civ of an existing technology or a civ's tech tree effect, call invalidate() yourself, like with the unit index
+class TechGraph:
+    def __init__(self, df: DatFile):
+        self.df = df
+        self.prerequisites: list[list[int]] = []
+        self.dependents: dict[int, list[int]] = {}
+        self._ages: dict[int, list[int | None]] = {}
+        self._disabled: dict[int, set[int]] = {}
+
+    def invalidate(self):
+        self.prerequisites = []
+        self.dependents = {}
+        self._ages = {}
+        self._disabled = {}
+
+    # Add the technologies appended since the last lookup, or build the whole graph if it was never built
+    def refresh(self):
+        known = len(self.prerequisites)
+        if known == len(self.df.techs):
+            return
+        new_tech_ids = range(known, len(self.df.techs))
+        for tech_id in new_tech_ids:
+            prerequisites = [prerequisite for prerequisite in self.df.techs[tech_id].required_techs if prerequisite >= 0]
+            self.prerequisites.append(prerequisites)
+            for prerequisite in prerequisites:
+                self.dependents.setdefault(prerequisite, []).append(tech_id)
+        for civ_id, ages in self._ages.items():
+            ages.extend([None] * len(new_tech_ids))
+            # New technologies can only lower the earliest age of the technologies depending on them, so only those have to be looked at again
+            self._relax(civ_id, ages, new_tech_ids)
+
+    # Whether the civ can research the technology at all
+    def is_reachable(self, civ_id: int, tech_id: int) -> bool:
+        return self.earliest_age(civ_id, tech_id) is not None
+
+    # Index in AGES of the earliest age the civ can research the technology in, or None if it can't research it at all
+    def earliest_age(self, civ_id: int, tech_id: int) -> int | None:
+        return self._civ_ages(civ_id)[tech_id]
+
+    def reachable_techs(self, civ_id: int) -> list[int]:
+        return [tech_id for tech_id, age in enumerate(self._civ_ages(civ_id)) if age is not None]
+
+    # The technologies the civ can research by the given age (an index in AGES)
+    def techs_by_age(self, civ_id: int, age: int) -> list[int]:
+        return [tech_id for tech_id, tech_age in enumerate(self._civ_ages(civ_id)) if tech_age is not None and tech_age <= age]
+
+    # The technologies the civ's tech tree effect disables
+    def disabled_techs(self, civ_id: int) -> set[int]:
+        if civ_id not in self._disabled:
+            self._disabled[civ_id] = set(self._disabled_by_effect(self.df.civs[civ_id].tech_tree_id))
+        return self._disabled[civ_id]
+
+    # The technologies that can't be researched anymore once this technology is researched
+    def exclusions(self, tech_id: int) -> list[int]:
+        return self._disabled_by_effect(self.df.techs[tech_id].effect_id)
+
+    def _disabled_by_effect(self, effect_id: int) -> list[int]:
+        if effect_id < 0:
+            return []
+        return [int(command.d) for command in self.df.effects[effect_id].effect_commands if command.type == command_types.DISABLE_TECH]
+
+    def _civ_ages(self, civ_id: int) -> list[int | None]:
+        self.refresh()
+        if civ_id not in self._ages:
+            ages = self._ages[civ_id] = [None] * len(self.df.techs)
+            self._relax(civ_id, ages, range(len(self.df.techs)))
+        return self._ages[civ_id]
+
+    # Work out the earliest age of the given technologies, then of everything depending on the ones whose age went down, until nothing changes
+    # Ages only ever go down and there are only a few of them, so every technology is looked at a handful of times at most
+    def _relax(self, civ_id: int, ages: list[int | None], tech_ids):
+        disabled = self.disabled_techs(civ_id)
+        pending = list(tech_ids)
+        while pending:
+            tech_id = pending.pop()
+            age = self._earliest_age(civ_id, tech_id, ages, disabled)
+            if age is None or (ages[tech_id] is not None and ages[tech_id] <= age):
+                continue
+            ages[tech_id] = age
+            pending.extend(dependent for dependent in self.dependents.get(tech_id, []) if dependent < len(ages))
+
+    def _earliest_age(self, civ_id: int, tech_id: int, ages: list[int | None], disabled: set[int]) -> int | None:
+        tech = self.df.techs[tech_id]
+        if tech.civ not in (-1, civ_id) or tech_id in disabled:
+            return None
+        prerequisite_ages = sorted(ages[prerequisite] for prerequisite in self.prerequisites[tech_id] if prerequisite < len(ages) and ages[prerequisite] is not None)
+        if tech.required_tech_count > len(prerequisite_ages):
+            return None
+        age = prerequisite_ages[tech.required_tech_count - 1] if tech.required_tech_count > 0 else 0
+        if tech_id in AGES:
+            age = max(age, AGES.index(tech_id))
+        return age
+
+
+_tech_graph: TechGraph | None = None
+
+
+# Return the tech graph of this DatFile, building it on first use
+# Only the graph of the most recently used DatFile is kept around
+def get_tech_graph(df: DatFile) -> TechGraph:
+    global _tech_graph
+    if _tech_graph is None or _tech_graph.df is not df:
+        _tech_graph = TechGraph(df)
+    return _tech_graph
@@ -1,14 +1,18 @@
 import copy
 
+import numpy as np
 from genieutils.datfile import DatFile
 from genieutils.unit import AttackOrArmor, Unit, ResourceCost, ResourceStorage, Task
 from genieutils.effect import EffectCommand, Effect
 
 from constants import *
-from mods import helpers
+from mods import columns, helpers, indexes
 
 NAME = "unit_examples"
 
+# The DatFile sections this mod changes, see tools/tracking.py
+MODIFIED_SECTIONS = ["civs", "techs", "effects"]
+
 
 def run_unit_examples(df: DatFile):
     change_movement_speed(df)
@@ -30,10 +34,12 @@ def change_movement_speed(df: DatFile):
         civ.units[units.MISSIONARY].speed = 2
 
     print("Making all villagers %d%% slower" % 50)
-    for civ in df.civs:
-        for unit in civ.units:
-            if unit is not None and unit.class_ == unit_classes.CIVILIAN:
-                unit.speed *= 0.5
+    # Bulk stat changes can also be done on whole columns of stats at once with NumPy, see mods/columns.py
+    # Every column is an array of shape [civ, unit], so the villager check and the speed change each happen in one step for every civ
+    unit_columns = columns.UnitColumns(df, ["class_", "speed"])
+    is_villager = unit_columns["class_"] == unit_classes.CIVILIAN
+    unit_columns["speed"] = np.ma.where(is_villager, unit_columns["speed"] * 0.5, unit_columns["speed"])
+    unit_columns.write_back()  # Nothing changes in the DatFile until the columns are written back
 
 
 # Change unit and building appearance
@@ -75,20 +81,20 @@ def change_attacks(df: DatFile):
                     attack.amount += 1
 
     print("Give all cavalry archers 1 bonus damage vs. infantry")
-    for civ in df.civs:
-        for unit in civ.units:
-            if unit is not None and unit.class_ == unit_classes.CAVALRY_ARCHER:
-                has_infantry_bonus_damage = False
-                # Check if the unit already has bonus damage against infantry
-                for attack in unit.type_50.attacks:
-                    if attack.class_ == armor_classes.INFANTRY:
-                        # If it does, increase the value by one
-                        attack.amount += 1
-                        has_infantry_bonus_damage = True
-                # If it does not, create a new bonus attack against infantry with a value of one
-                if not has_infantry_bonus_damage:
-                    new_bonus_damage: AttackOrArmor = AttackOrArmor(armor_classes.INFANTRY, 1)
-                    unit.type_50.attacks.append(new_bonus_damage)
+    # Finding every unit of a class would mean looping over every unit of every civ
+    # The unit index in mods/indexes.py groups the units by class, ID and base ID once, so we only visit the units we need
+    for unit in indexes.get_unit_index(df).units_of_class(unit_classes.CAVALRY_ARCHER):
+        has_infantry_bonus_damage = False
+        # Check if the unit already has bonus damage against infantry
+        for attack in unit.type_50.attacks:
+            if attack.class_ == armor_classes.INFANTRY:
+                # If it does, increase the value by one
+                attack.amount += 1
+                has_infantry_bonus_damage = True
+        # If it does not, create a new bonus attack against infantry with a value of one
+        if not has_infantry_bonus_damage:
+            new_bonus_damage: AttackOrArmor = AttackOrArmor(armor_classes.INFANTRY, 1)
+            unit.type_50.attacks.append(new_bonus_damage)
 
     print("Making arson give infantry units bonus vs. siege")
     # Since we are adding this effect to arson, the increase will need to be done through an EffectCommand
@@ -99,18 +105,16 @@ def change_attacks(df: DatFile):
     df.effects[arson_effect_id].effect_commands.append(bonus_vs_siege_effect_command)
     # However, if a unit doesn't already have a bonus of that type, an EffectCommand will do nothing
     # So for the infantry units that have no bonus vs. siege, we need to give them a default bonus vs. siege of 0
-    for civ in df.civs:
-        for unit in civ.units:
-            if unit is not None and unit.class_ == unit_classes.INFANTRY:
-                has_siege_bonus_damage = False
-                # Check if it has bonus vs. siege
-                for attack in unit.type_50.attacks:
-                    if attack.class_ == armor_classes.SIEGE_WEAPON:
-                        has_siege_bonus_damage = True
-                # If it does not, give it a bonus vs. siege of 0
-                if not has_siege_bonus_damage:
-                    new_bonus_damage: AttackOrArmor = AttackOrArmor(armor_classes.SIEGE_WEAPON, 0)
-                    unit.type_50.attacks.append(new_bonus_damage)
+    for unit in indexes.get_unit_index(df).units_of_class(unit_classes.INFANTRY):
+        has_siege_bonus_damage = False
+        # Check if it has bonus vs. siege
+        for attack in unit.type_50.attacks:
+            if attack.class_ == armor_classes.SIEGE_WEAPON:
+                has_siege_bonus_damage = True
+        # If it does not, give it a bonus vs. siege of 0
+        if not has_siege_bonus_damage:
+            new_bonus_damage: AttackOrArmor = AttackOrArmor(armor_classes.SIEGE_WEAPON, 0)
+            unit.type_50.attacks.append(new_bonus_damage)
 
 
 # Change units' armor values and ways it receives bonus damages
@@ -128,24 +132,21 @@ def change_armors(df: DatFile):
 
     print("Making monks immune to pierce attacks")
     # Because of the way attacks and armors interact, removing a unit's armor class will make it immune to that type of damage
-    for civ in df.civs:
-        for unit in civ.units:
-            # Don't forget to check for monks and monks with relics as those are two separate units with separate unit classes
-            # Also warrior priests without relics are categorized as infantry as far as its unit.class_ is concerned
-            if unit is not None and (unit.class_ == unit_classes.MONK or unit.class_ == unit_classes.MONK_WITH_RELIC or unit.base_id == units.WARRIOR_PRIEST):
-                # Remove all armors whose class is pierce
-                unit.type_50.armours = list(filter(lambda armor: armor.class_ != armor_classes.PIERCE, unit.type_50.armours))
-                unit.creatable.displayed_pierce_armor = 999
+    unit_index = indexes.get_unit_index(df)
+    # Don't forget to check for monks and monks with relics as those are two separate units with separate unit classes
+    # Also warrior priests without relics are categorized as infantry as far as its unit.class_ is concerned
+    for unit in unit_index.units_of_class(unit_classes.MONK, unit_classes.MONK_WITH_RELIC) + unit_index.units_with_base_id(units.WARRIOR_PRIEST):
+        # Remove all armors whose class is pierce
+        unit.type_50.armours = list(filter(lambda armor: armor.class_ != armor_classes.PIERCE, unit.type_50.armours))
+        unit.creatable.displayed_pierce_armor = 999
 
     print("Giving war wagons +2 bonus damage vs. villagers")
     # There is no existing "villager" armor class, so we have to create one
     # Armor class of 10 is unused, so let's give all villagers an armor type 10 of value 0
     # This means that any unit with attack type of 10 will do that full damage amount as bonus damage to villagers
-    for civ in df.civs:
-        for unit in civ.units:
-            if unit is not None and unit.class_ == unit_classes.CIVILIAN:
-                new_bonus_weakness: AttackOrArmor = AttackOrArmor(10, 0)
-                unit.type_50.armours.append(new_bonus_weakness)
+    for unit in indexes.get_unit_index(df).units_of_class(unit_classes.CIVILIAN):
+        new_bonus_weakness: AttackOrArmor = AttackOrArmor(10, 0)
+        unit.type_50.armours.append(new_bonus_weakness)
     # Now give war wagons a corresponding attack
     new_bonus_attack: AttackOrArmor = AttackOrArmor(10, 2)
     for civ in df.civs:
@@ -178,10 +179,8 @@ def change_hero_mode(df: DatFile):
     # A hero mode flag of 2 means they cannot be converted, a flag of 4 means they have regen
     # In order to create something with both, simply add up these flags
     # The full list of flags is available on the AoE2DE UGC Guide
-    for civ in df.civs:
-        for unit in civ.units:
-            if unit is not None and unit.class_ == unit_classes.MONK_WITH_RELIC:
-                unit.creatable.hero_mode = 6
+    for unit in indexes.get_unit_index(df).units_of_class(unit_classes.MONK_WITH_RELIC):
+        unit.creatable.hero_mode = 6
 
 
 # Modify the costs required to train units
@@ -205,10 +204,8 @@ def change_unit_storages(df: DatFile):
     current_population: ResourceStorage = ResourceStorage(resources.CURRENT_POPULATION, 2, 2)  # Add 2 to the current population, but give it back after unit death
     total_units: ResourceStorage = ResourceStorage(resources.TOTAL_UNITS_OWNED, 2, 1)  # Add 2 to the total units owned, but keep it after unit death
     empty_storage: ResourceStorage = ResourceStorage(-1, 0, 0)
-    for civ in df.civs:
-        for unit in civ.units:
-            if unit is not None and unit.class_ == unit_classes.CIVILIAN:
-                unit.resource_storages = (population_headroom, current_population, total_units)
+    for unit in indexes.get_unit_index(df).units_of_class(unit_classes.CIVILIAN):
+        unit.resource_storages = (population_headroom, current_population, total_units)
 
     print("Building a krepost gives you 1 gold")
     for civ in df.civs:
@@ -248,32 +245,22 @@ def change_hp(df: DatFile):
 
     print("Making all cavalry archers permanently have 1 HP")
     # First make all cavalry archers start with 1 HP
-    for civ in df.civs:
-        for unit in civ.units:
-            if unit is not None and unit.class_ == unit_classes.CAVALRY_ARCHER:
-                unit.hit_points = 1
+    for unit in indexes.get_unit_index(df).units_of_class(unit_classes.CAVALRY_ARCHER):
+        unit.hit_points = 1
     # Now we need to make all effects in the game unable to change this
-    for effect in df.effects:
-        # Loop through every effect in the game, and then loop through every effect_command of that effect
-        effect_command_index = 0
-        while effect_command_index < len(effect.effect_commands):
-            effect_command: EffectCommand = effect.effect_commands[effect_command_index]
-            # The only effect commands that could change HP would be attribute modifiers
-            # Because of the way command_types are arranged, we can check for attribute_modifier_additive/multiplicative/set by taking modulus 10
-            if effect_command.type < 100 and (effect_command.type % 10 == 0 or effect_command.type % 10 == 4 or effect_command.type % 10 == 5):
-                # For these effect_commands, the C value will always be the attribute field, so make sure it has to do with points
-                if effect_command.c == attributes.HIT_POINTS:
-                    # The B value will always the the unit class, so if it is cavalry archer, simply remove it
-                    if effect_command.b == unit_classes.CAVALRY_ARCHER:
-                        effect.effect_commands.pop(effect_command_index)
-                        effect_command_index -= 1
-                    elif effect_command.a >= 0:
-                        # The A value will be the unit ID, so check if that unit is actually a cavalry archer, and remove it if it is
-                        # Checking the unit class of GAIA's units will suffice
-                        if df.civs[civilizations.GAIA].units[effect_command.a].class_ == unit_classes.CAVALRY_ARCHER:
-                            effect.effect_commands.pop(effect_command_index)
-                            effect_command_index -= 1
-            effect_command_index += 1
+    # The only effect commands that could change HP would be attribute modifiers
+    # Because of the way command_types are arranged, attribute_modifier_additive/multiplicative/set are found by taking the type modulus 10
+    # Rather than looping through every effect_command of every effect, the effect index in mods/indexes.py has already grouped them by that "family" and by attribute
+    effect_index = indexes.get_effect_index(df)
+    for effect_id, effect_command in effect_index.query(family=indexes.ATTRIBUTE_FAMILIES, attribute=attributes.HIT_POINTS):
+        # The B value will always the the unit class, so if it is cavalry archer, simply remove it
+        if effect_command.b == unit_classes.CAVALRY_ARCHER:
+            effect_index.remove(effect_id, effect_command)
+        elif effect_command.a >= 0:
+            # The A value will be the unit ID, so check if that unit is actually a cavalry archer, and remove it if it is
+            # Checking the unit class of GAIA's units will suffice
+            if df.civs[civilizations.GAIA].units[effect_command.a].class_ == unit_classes.CAVALRY_ARCHER:
+                effect_index.remove(effect_id, effect_command)
 
 
 # Change where units are trained
@@ -286,27 +273,14 @@ def change_train_location(df: DatFile):
 
     print("Making missionaries trainable at mining camps")
     # Since each unit can only have one train location, in order for a unit to be trainable at multiple locations there must be multiple copies of that unit
+    # helpers.clone_units copies the missionary for every civ under the same new unit ID, and returns the new ID
+    # It also makes every effect in the game that specifically affects the missionary unit also affect the new missionary copy
+    new_missionary_id = helpers.clone_units(df, [units.MISSIONARY])[units.MISSIONARY]
     for civ in df.civs:
-        missionary_copy: Unit = copy.deepcopy(civ.units[units.MISSIONARY])  # Create a copy of missionary unit
-        civ.units.append(missionary_copy)  # Append it to the civ's units
-        new_missionary_id = len(civ.units) - 1
-        civ.units[new_missionary_id].base_id = new_missionary_id  # Update its id
-        civ.units[new_missionary_id].copy_id = new_missionary_id
         civ.units[new_missionary_id].creatable.train_location_id = units.MINING_CAMP
         civ.units[new_missionary_id].creatable.button_id = 4  # This button change is necessary because otherwise stone mining would get in the way
-    # Make every effect in the game that specifically affects the missionary unit also affect the new missionary copy
     # Note that this process becomes significantly more complex when you are trying to duplicate a unit with upgrades
     # For example if you want to make militia recruitable from mills you would have to duplicate militia, man-at-arms, long-swordsmen, two-handed swordsmen,
     # champions, and legionaries, copy every EffectCommand that affects those units specifically EXCEPT the upgrading EffectCommands -- for those you need each unit
     # to upgrade along its corresponding copied unit's upgrade
-    for effect in df.effects:
-        # Loop through every effect in the game, and then loop through every effect_command of that effect
-        original_effect_command_length = len(effect.effect_commands)
-        for effect_command_index in range(original_effect_command_length):
-            effect_command: EffectCommand = effect.effect_commands[effect_command_index]
-            # Check attribute modifiers or enabling effect_commands
-            if effect_command.type < 100 and (effect_command.type % 10 == 0 or effect_command.type % 10 == 4 or effect_command.type % 10 == 5 or effect_command.type % 10 == 2):
-                if effect_command.a == units.MISSIONARY:
-                    duplicated_effect_command: EffectCommand = copy.deepcopy(effect_command)
-                    duplicated_effect_command.a = new_missionary_id
-                    effect.effect_commands.append(duplicated_effect_command)
+    # helpers.clone_units does all of this when you give it the whole upgrade line at once, e.g. helpers.clone_units(df, [units.MILITIA, units.MAN_AT_ARMS, ...])
@@ -0,0 +1,38 @@
+from pathlib import Path
+
+import pytest
+from genieutils.datfile import DatFile
+
+from tools import synthetic, tracking
+
+# The tests run against a small synthetic dat file (see tools/synthetic.py), so they don't need the game files
+SYNTHETIC_COUNTS = {"civs": 3, "units_per_civ": 300, "techs": 60, "effects": 60, "seed": 0}
+
+
+@pytest.fixture(scope="session")
+def dat_file(tmp_path_factory) -> Path:
+    dat_file = tmp_path_factory.mktemp("datfiles") / "base_game.dat"
+    synthetic.write_datfile(dat_file, **SYNTHETIC_COUNTS, named_ids=False)
+    return dat_file
+
+
+# The example mods need every civ, unit and technology named in constants/, which makes the dat file a lot bigger, so only the tests running them use it
+@pytest.fixture(scope="session")
+def mods_dat_file(tmp_path_factory) -> Path:
+    dat_file = tmp_path_factory.mktemp("datfiles") / "base_game.dat"
+    synthetic.write_datfile(dat_file, **SYNTHETIC_COUNTS)
+    return dat_file
+
+
+@pytest.fixture
+def df(dat_file) -> DatFile:
+    return DatFile.parse(dat_file)
+
+
+# Only the most recently tracked DatFile is tracked, make sure no test sees the tracker of another one
+@pytest.fixture(autouse=True)
+def reset_tracker():
+    tracking._tracker = None
+    yield
+    tracking._tracker = None
+
@@ -0,0 +1,81 @@
+import json
+import shutil
+import sys
+from types import ModuleType
+
+import pytest
+from genieutils.datfile import DatFile
+
+from tools import batch, tracking
+from tools.tracking import parse_with_layout
+
+
+def run_batch_mod(df, name="Changed", fail=False):
+    if fail:
+        raise ValueError("The mod failed")
+    df.techs[0].name = name
+
+
+@pytest.fixture
+def batch_mod(monkeypatch):
+    module = ModuleType("mods.batch_mod")
+    module.NAME = "batch_mod"
+    module.MODIFIED_SECTIONS = ["techs"]
+    module.run_batch_mod = run_batch_mod
+    monkeypatch.setitem(sys.modules, "mods.batch_mod", module)
+    return module
+
+
+@pytest.fixture
+def tracked(dat_file, tmp_path):
+    base_file = tmp_path / "base_game.dat"
+    shutil.copy(dat_file, base_file)
+    df, layout = parse_with_layout(base_file)
+    tracking.track(df, base_file, layout)
+    return df
+
+
+def expected_output(dat_file, tmp_path, name: str) -> bytes:
+    df = DatFile.parse(dat_file)
+    run_batch_mod(df, name)
+    df.save(tmp_path / f"expected-{name}.dat")
+    return (tmp_path / f"expected-{name}.dat").read_bytes()
+
+
+def test_manifest_defaults(tmp_path):
+    manifest_file = tmp_path / "variants.json"
+    manifest_file.write_text(json.dumps({"variants": [{"output": "a.dat", "mods": ["batch_mod", {"module": "other", "params": {"x": 1}}]}]}))
+    assert batch.load_manifest(manifest_file) == [
+        {
+            "output": "a.dat",
+            "mods": [{"module": "batch_mod", "params": {}}, {"module": "other", "params": {"x": 1}}],
+            "validate": True,
+            "compression_level": tracking.DEFAULT_COMPRESSION_LEVEL,
+        }
+    ]
+
+
+@pytest.mark.parametrize("variant", [{"mods": []}, {"output": "a.dat", "mods": [], "compression_level": 10}], ids=["no output", "compression level"])
+def test_invalid_variants_are_rejected(variant):
+    with pytest.raises(ValueError):
+        batch.normalize_variant(variant)
+
+
+@pytest.mark.parametrize("start_methods", [None, ["spawn"]], ids=["fork", "without fork"])
+def test_variants_are_built_from_the_same_base(tracked, dat_file, tmp_path, batch_mod, monkeypatch, start_methods):
+    if start_methods:
+        monkeypatch.setattr(batch.multiprocessing, "get_all_start_methods", lambda: start_methods)
+    elif "fork" not in batch.multiprocessing.get_all_start_methods():
+        pytest.skip("Needs fork")
+    base_name = tracked.techs[0].name
+    variants = [
+        batch.normalize_variant({"output": str(tmp_path / name / "out.dat"), "mods": [{"module": "batch_mod", "params": {"name": name}}], "validate": False})
+        for name in ["first", "second"]
+    ]
+    failing = batch.normalize_variant({"output": str(tmp_path / "failing.dat"), "mods": [{"module": "batch_mod", "params": {"fail": True}}]})
+    assert batch.run_batch(tracked, [variants[0], failing, variants[1]], jobs=2) == [failing["output"]]
+    for name in ["first", "second"]:
+        assert (tmp_path / name / "out.dat").read_bytes() == expected_output(dat_file, tmp_path, name)
+    assert not (tmp_path / "failing.dat").exists()
+    # Every variant got its own copy of the base data
+    assert tracked.techs[0].name == base_name
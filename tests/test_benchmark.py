@@ -0,0 +1,32 @@
+import json
+import sys
+
+import pytest
+
+import benchmark
+from mods import tech_examples
+
+
+def run_benchmark(monkeypatch, *args: str):
+    monkeypatch.setattr(sys, "argv", ["benchmark.py", *args])
+    benchmark.main()
+
+
+# The example mods run end to end against the synthetic data, the way the benchmark runs them
+def test_benchmarked_mods_run(mods_dat_file, tmp_path, monkeypatch):
+    run_benchmark(monkeypatch, "--dat", str(mods_dat_file), "--output", str(tmp_path / "results.json"))
+    steps = json.loads((tmp_path / "results.json").read_text())["steps"]
+    assert [step["name"] for step in steps if step["error"]] == []
+    assert {run.__name__ for _, run in benchmark.BENCHMARKED_MODS} <= {step["name"] for step in steps}
+
+
+def test_failing_mod_fails_the_benchmark(dat_file, tmp_path, monkeypatch, capsys):
+    def run_failing_mod(df):
+        raise KeyError(1)
+
+    monkeypatch.setattr(benchmark, "BENCHMARKED_MODS", [(tech_examples, run_failing_mod)])
+    with pytest.raises(SystemExit, match="Failed: run_failing_mod"):
+        run_benchmark(monkeypatch, "--dat", str(dat_file), "--output", str(tmp_path / "results.json"))
+    # The results are still written, with the error of the step
+    steps = json.loads((tmp_path / "results.json").read_text())["steps"]
+    assert [step["name"] for step in steps if step["error"]] == ["run_failing_mod"]
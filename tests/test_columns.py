@@ -0,0 +1,68 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from mods.columns import UnitColumns
+from tools import tracking
+from tools.tracking import parse_with_layout
+
+
+@pytest.fixture
+def tracked(dat_file, tmp_path):
+    base_file = tmp_path / "base_game.dat"
+    shutil.copy(dat_file, base_file)
+    df, layout = parse_with_layout(base_file)
+    tracking.track(df, base_file, layout)
+    return df
+
+
+def test_columns_hold_the_values_of_the_units(df):
+    columns = UnitColumns(df, ["hit_points", "speed", "creatable.train_time"])
+    for civ_id, civ in enumerate(df.civs):
+        for unit_id, unit in enumerate(civ.units):
+            if unit is None:
+                assert columns["hit_points"].mask[civ_id, unit_id]
+                continue
+            assert columns["hit_points"][civ_id, unit_id] == unit.hit_points
+            assert columns["speed"].mask[civ_id, unit_id] == (unit.speed is None)
+            # Units without the field are masked as well
+            assert columns["creatable.train_time"].mask[civ_id, unit_id] == (unit.creatable is None)
+
+
+def test_write_back_only_writes_changed_units(tracked, df, tmp_path):
+    columns = UnitColumns(tracked, ["class_", "hit_points", "speed"])
+    class_ = int(columns["class_"][0].compressed()[0])
+    selected = columns["class_"] == class_
+    columns["hit_points"] = np.ma.where(selected, columns["hit_points"] * 3, columns["hit_points"])
+    columns["speed"] = columns["speed"] + 0.5
+    units = [unit for civ in tracked.civs for unit in civ.units if unit is not None]
+    expected = sum(unit.class_ == class_ and unit.hit_points != 0 for unit in units) + sum(unit.speed is not None for unit in units)
+    assert columns.write_back() == expected
+    for civ_id, civ in enumerate(tracked.civs):
+        for unit, original in zip(civ.units, df.civs[civ_id].units):
+            if unit is None:
+                continue
+            assert unit.hit_points == (original.hit_points * 3 if unit.class_ == class_ else original.hit_points)
+            assert type(unit.hit_points) is int
+            assert unit.speed == (None if original.speed is None else pytest.approx(original.speed + 0.5))
+    # Nothing changed since the last write back
+    assert columns.write_back() == 0
+    assert tracking.find_undeclared_changes(tracked) == []
+    tracking.save(tracked, tmp_path / "tracked.dat")
+    tracked.save(tmp_path / "full.dat")
+    assert (tmp_path / "tracked.dat").read_bytes() == (tmp_path / "full.dat").read_bytes()
+
+
+def test_masked_cells_are_left_alone(df):
+    columns = UnitColumns(df, ["creatable.train_time"])
+    expected = sum(unit is not None and unit.creatable is not None and unit.creatable.train_time != 1 for civ in df.civs for unit in civ.units)
+    columns["creatable.train_time"] = 1
+    assert columns.write_back() == expected
+    assert all(unit.creatable.train_time == 1 for civ in df.civs for unit in civ.units if unit is not None and unit.creatable is not None)
+
+
+def test_fields_have_to_be_part_of_the_view(df):
+    columns = UnitColumns(df, ["hit_points"])
+    with pytest.raises(KeyError):
+        columns["speed"] = 1
@@ -0,0 +1,114 @@
+import copy
+import pickle
+
+import pytest
+from genieutils.datfile import DatFile
+from genieutils.effect import EffectCommand
+from genieutils.unit import AttackOrArmor, ResourceCost
+
+from mods import compact
+from mods.compact import AttackOrArmorArray, EffectCommandArray, compact_datfile, intern_costs
+from mods.helpers import fast_copy
+from tools.diff import apply_patch, diff_datfiles
+
+
+def attacking_unit(df: DatFile, civ_id: int = 0):
+    return next(unit for unit in df.civs[civ_id].units if unit is not None and unit.type_50 is not None and len(unit.type_50.attacks) >= 2)
+
+
+def creatable_unit(df: DatFile, civ_id: int = 0):
+    return next(unit for unit in df.civs[civ_id].units if unit is not None and unit.creatable is not None)
+
+
+# The same changes a mod would make, through the compact arrays or the lists they stand in for
+def modify(df: DatFile):
+    unit = attacking_unit(df)
+    for attack in unit.type_50.attacks:
+        attack.amount += 1
+    unit.type_50.armours.append(AttackOrArmor(10, 0))
+    del unit.type_50.attacks[0]
+    creatable_unit(df, 1).creatable.resource_costs = (ResourceCost(0, 50, 1), ResourceCost(-1, 0, 0), ResourceCost(4, 1, 0))
+    df.effects[0].effect_commands.insert(0, EffectCommand(4, unit.id, -1, 0, 0.1))
+    df.effects[1].effect_commands[0].d = 2.5
+
+
+def test_compact_datfile_saves_the_same(df, dat_file):
+    compact_datfile(df)
+    plain = DatFile.parse(dat_file)
+    assert df == plain
+    assert df.to_bytes() == plain.to_bytes()
+    assert isinstance(df.effects[0].effect_commands, EffectCommandArray)
+    assert isinstance(attacking_unit(df).type_50.attacks, AttackOrArmorArray)
+
+
+def test_changes_through_compact_arrays_save_the_same(df, dat_file):
+    compact_datfile(df)
+    modify(df)
+    plain = DatFile.parse(dat_file)
+    modify(plain)
+    assert df == plain
+    assert df.to_bytes() == plain.to_bytes()
+
+
+@pytest.mark.parametrize("copy_function", [copy.deepcopy, fast_copy, lambda df: pickle.loads(pickle.dumps(df))], ids=["deepcopy", "fast_copy", "pickle"])
+def test_copies_of_compact_datfiles_are_independent(df, copy_function):
+    compact_datfile(df)
+    copied = copy_function(df)
+    assert copied.to_bytes() == df.to_bytes()
+    modify(copied)
+    assert copied.to_bytes() != df.to_bytes()
+    assert type(copied.effects[0].effect_commands) is EffectCommandArray
+
+
+def test_patch_between_compact_and_plain_datfiles(df, dat_file):
+    compact_datfile(df)
+    modify(df)
+    plain = DatFile.parse(dat_file)
+    apply_patch(plain, diff_datfiles(plain, df))
+    assert plain.to_bytes() == df.to_bytes()
+
+
+def test_compact_array_behaves_like_a_list():
+    items = [AttackOrArmor(class_, class_ * 10) for class_ in range(5)]
+    attacks = AttackOrArmorArray(items)
+    assert attacks == items and len(attacks) == 5
+    assert attacks[-1] == items[-1] and attacks[1:3] == items[1:3]
+    assert attacks.to_list() == items and type(attacks.to_list()[0]) is AttackOrArmor
+    with pytest.raises(IndexError):
+        attacks[5]
+    with pytest.raises(TypeError):
+        attacks[0:2] = items[:2]
+
+    attacks.append(AttackOrArmor(9, 90))
+    attacks.insert(0, AttackOrArmor(8, 80))
+    attacks[1] = AttackOrArmor(7, 70)
+    del attacks[2]
+    expected = [AttackOrArmor(8, 80), AttackOrArmor(7, 70), *items[2:], AttackOrArmor(9, 90)]
+    assert attacks == expected
+
+
+def test_entries_keep_pointing_at_their_values():
+    attacks = AttackOrArmorArray(AttackOrArmor(class_, class_ * 10) for class_ in range(5))
+    third, fourth = attacks[2], attacks[3]
+    attacks.insert(0, AttackOrArmor(8, 80))
+    del attacks[0:2]
+    third.amount = 25
+    assert attacks[1] is third and attacks[1] == AttackOrArmor(2, 25)
+    # A removed entry keeps its values but isn't part of the array anymore
+    del attacks[2]
+    assert fourth == AttackOrArmor(3, 30)
+    fourth.amount = 35
+    assert AttackOrArmor(3, 35) not in attacks
+
+
+def test_interned_costs_are_shared_and_read_only():
+    costs = (ResourceCost(0, 50, 1), ResourceCost(-1, 0, 0), ResourceCost(4, 1, 0))
+    interned = intern_costs(costs)
+    assert interned == costs
+    assert intern_costs(tuple(ResourceCost(cost.type, cost.amount, cost.flag) for cost in costs)) is interned
+    assert compact.plain_type(interned[0]) is ResourceCost
+    with pytest.raises(TypeError):
+        interned[0].amount = 60
+    # Anything that isn't a tuple of costs is left alone
+    not_costs = (AttackOrArmor(1, 1),)
+    assert intern_costs(not_costs) is not_costs
@@ -0,0 +1,67 @@
+import pytest
+from genieutils.datfile import DatFile
+from genieutils.effect import EffectCommand
+from genieutils.unit import ResourceCost
+
+from tools.diff import apply_patch, decode, diff_datfiles, read_patch, write_patch
+
+
+def modify(df: DatFile):
+    unit = next(unit for unit in df.civs[0].units if unit is not None and unit.creatable is not None)
+    unit.hit_points += 10
+    unit.creatable.resource_costs = (ResourceCost(type=0, amount=50, flag=1), *unit.creatable.resource_costs[1:])
+    df.civs[1].units[unit.id] = None
+    df.effects[0].effect_commands.append(EffectCommand(type=4, a=unit.id, b=-1, c=0, d=5.0))
+    del df.effects[1].effect_commands[1:]
+    df.techs[0].name = "Patched"
+
+
+def test_patch_roundtrip(dat_file, tmp_path):
+    base = DatFile.parse(dat_file)
+    modified = DatFile.parse(dat_file)
+    modify(modified)
+    operations = diff_datfiles(base, modified)
+    assert operations
+
+    patch_file = tmp_path / "mod.patch.json"
+    write_patch(patch_file, operations, "hash")
+    apply_patch(base, read_patch(patch_file, "hash"))
+
+    assert diff_datfiles(base, modified) == []
+    assert base.to_bytes() == modified.to_bytes()
+
+
+def test_unchanged_datfiles_have_no_differences(dat_file):
+    assert diff_datfiles(DatFile.parse(dat_file), DatFile.parse(dat_file)) == []
+
+
+def test_patch_for_another_base_file_is_rejected(tmp_path):
+    patch_file = tmp_path / "mod.patch.json"
+    write_patch(patch_file, [], "hash")
+    with pytest.raises(ValueError, match="different base file"):
+        read_patch(patch_file, "other hash")
+
+
+def test_only_genieutils_classes_are_created(tmp_path):
+    target = tmp_path / "created.txt"
+    with pytest.raises(ValueError, match="isn't a genieutils class"):
+        decode({"__class__": "subprocess.getoutput", "fields": {"cmd": f"echo created > {target}"}})
+    assert not target.exists()
+
+
+def test_unknown_fields_are_rejected():
+    with pytest.raises(ValueError, match="fields it doesn't have"):
+        decode({"__class__": "genieutils.unit.ResourceCost", "fields": {"__init__": 1}})
+
+
+def test_genieutils_classes_are_decoded():
+    cost = decode({"__class__": "genieutils.unit.ResourceCost", "fields": {"type": 0, "amount": 50, "flag": 1}})
+    assert cost == ResourceCost(type=0, amount=50, flag=1)
+
+
+@pytest.mark.parametrize("path", [["__class__"], ["civs", 0, "__dict__"], ["effects", 0, "to_bytes"]])
+def test_paths_only_go_through_fields(df, path):
+    before = df.to_bytes()
+    with pytest.raises(ValueError, match="isn't a field"):
+        apply_patch(df, [["set", path, 1]])
+    assert df.to_bytes() == before
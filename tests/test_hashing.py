@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from tools import hashing
+from tools.hashing import HashManifest, hash_file
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    data_file = tmp_path / "base_game.dat"
+    data_file.write_bytes(b"base data")
+    return data_file
+
+
+def changed(data_file, content: bytes):
+    stat = data_file.stat()
+    data_file.write_bytes(content)
+    os.utime(data_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_unchanged_file_isnt_hashed_again(data_file, tmp_path, monkeypatch):
+    manifest = HashManifest(tmp_path / "cache" / hashing.MANIFEST_NAME)
+    file_hash = manifest.get_hash(data_file)
+    assert file_hash == hash_file(data_file)
+
+    def hash_file_again(input_file, algorithm="sha256"):
+        raise AssertionError("The file was hashed again")
+
+    monkeypatch.setattr(hashing, "hash_file", hash_file_again)
+    assert manifest.get_hash(data_file) == file_hash
+    # The next build reads the hash from the manifest file
+    assert HashManifest(tmp_path / "cache" / hashing.MANIFEST_NAME).get_hash(data_file) == file_hash
+
+
+def test_changed_file_is_hashed_again(data_file, tmp_path):
+    manifest = HashManifest(tmp_path / hashing.MANIFEST_NAME)
+    file_hash = manifest.get_hash(data_file)
+    changed(data_file, b"other data")
+    assert manifest.get_hash(data_file) == hash_file(data_file) != file_hash
+
+
+def test_algorithms_are_remembered_separately(data_file, tmp_path):
+    manifest = HashManifest(tmp_path / hashing.MANIFEST_NAME)
+    sha256 = manifest.get_hash(data_file)
+    fast = manifest.get_hash(data_file, "fast")
+    assert fast.startswith("fast") and fast != sha256
+    assert fast == hash_file(data_file, "fast")
+    assert manifest.get_hash(data_file) == sha256
+
+
+def test_entries_of_other_builds_are_kept(data_file, tmp_path):
+    other_file = tmp_path / "other.dat"
+    other_file.write_bytes(b"other data")
+    first = HashManifest(tmp_path / hashing.MANIFEST_NAME)
+    second = HashManifest(tmp_path / hashing.MANIFEST_NAME)
+    first.get_hash(data_file)
+    second.get_hash(other_file)
+    assert set(HashManifest(tmp_path / hashing.MANIFEST_NAME).entries) == {str(data_file.resolve()), str(other_file.resolve())}
+
+
+def test_unreadable_manifest_starts_over(data_file, tmp_path, capsys):
+    (tmp_path / hashing.MANIFEST_NAME).write_text("{not json")
+    assert HashManifest(tmp_path / hashing.MANIFEST_NAME).get_hash(data_file) == hash_file(data_file)
+    assert "unreadable" in capsys.readouterr().out
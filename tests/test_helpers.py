@@ -0,0 +1,43 @@
+import copy
+
+from constants import command_types
+from mods import indexes
+from mods.helpers import clone_units, fast_copy
+
+
+def test_fast_copy_is_an_independent_copy(df):
+    unit = next(unit for unit in df.civs[0].units if unit is not None and unit.type_50 is not None and unit.type_50.attacks)
+    copied = fast_copy(unit)
+    assert copied == copy.deepcopy(unit) and type(copied) is type(unit)
+    copied.type_50.attacks[0].amount += 1
+    copied.type_50.attacks.append(copied.type_50.attacks[0])
+    assert copied != unit
+    # Tuples of plain values can't be changed, so they are shared
+    assert copied.standing_graphic is unit.standing_graphic
+
+
+def test_clone_units_copies_an_upgrade_line(df):
+    unit_count = max(len(civ.units) for civ in df.civs)
+    upgrade = next(command for _, command in indexes.get_effect_index(df).query(family=command_types.UPGRADE_UNIT) if command.a != command.b)
+    line = [upgrade.a, upgrade.b]
+    targeting = {unit_id: [(effect_id, command) for effect_id, command in indexes.get_effect_index(df).query(unit=unit_id) if indexes.command_family(command.type) != command_types.SPAWN_UNIT] for unit_id in line}
+    effect_sizes = [len(effect.effect_commands) for effect in df.effects]
+
+    new_ids = clone_units(df, line)
+
+    assert new_ids == {upgrade.a: unit_count, upgrade.b: unit_count + 1}
+    for civ in df.civs:
+        assert len(civ.units) == unit_count + 2
+        for unit_id, new_id in new_ids.items():
+            original, unit_copy = civ.units[unit_id], civ.units[new_id]
+            if original is None:
+                assert unit_copy is None
+                continue
+            assert (unit_copy.id, unit_copy.base_id, unit_copy.copy_id) == (new_id, new_id, new_id)
+            assert unit_copy.hit_points == original.hit_points and unit_copy is not original
+    # Every command targeting the line is duplicated once for the copies, and the copied upgrade goes to the copied unit
+    assert sum(len(effect.effect_commands) for effect in df.effects) == sum(effect_sizes) + sum(map(len, targeting.values()))
+    for unit_id, commands in targeting.items():
+        copies = indexes.get_effect_index(df).query(unit=new_ids[unit_id])
+        assert [(effect_id, command.type) for effect_id, command in copies] == [(effect_id, command.type) for effect_id, command in commands]
+    assert any(command.b == new_ids[upgrade.b] for _, command in indexes.get_effect_index(df).query(family=command_types.UPGRADE_UNIT, unit=new_ids[upgrade.a]))
@@ -0,0 +1,120 @@
+import shutil
+
+import pytest
+from genieutils.effect import EffectCommand
+
+from constants import command_types
+from mods import indexes
+from mods.rules import Rule, apply_rules, scale
+from tools import tracking
+from tools.tracking import parse_with_layout
+
+
+@pytest.fixture
+def tracked(dat_file, tmp_path):
+    base_file = tmp_path / "base_game.dat"
+    shutil.copy(dat_file, base_file)
+    df, layout = parse_with_layout(base_file)
+    tracking.track(df, base_file, layout)
+    return df
+
+
+def marked_units(df) -> set[int]:
+    return tracking.get_tracker(df).dirty_units
+
+
+def most_common_class(df) -> int:
+    classes = [unit.class_ for civ in df.civs for unit in civ.units if unit is not None]
+    return max(set(classes), key=classes.count)
+
+
+def test_lookups_mark_the_units_they_return(tracked):
+    unit_index = indexes.get_unit_index(tracked)
+    class_ = most_common_class(tracked)
+    found = unit_index.units_of_class(class_)
+    assert found and all(unit.class_ == class_ for unit in found)
+    assert marked_units(tracked) == {id(unit) for unit in found}
+
+
+def test_lookups_without_mark_leave_the_units_alone(tracked):
+    unit_index = indexes.get_unit_index(tracked)
+    class_ = most_common_class(tracked)
+    unit = unit_index.units_of_class(class_, mark=False)[0]
+    assert unit_index.entries_of_class(class_, mark=False)
+    assert unit_index.units_with_id(unit.id, mark=False)
+    assert unit_index.units_with_base_id(unit.base_id, mark=False)
+    assert marked_units(tracked) == set()
+    assert tracking.get_tracker(tracked).unchanged_units(0) == {unit_id for unit_id, unit in enumerate(tracked.civs[0].units) if unit is not None}
+
+
+def test_rules_only_mark_the_units_they_change(tracked, tmp_path):
+    class_ = most_common_class(tracked)
+    selected = indexes.get_unit_index(tracked).units_of_class(class_, mark=False)
+    # Half of the selected units are filtered out by where, and setting a value to itself changes nothing
+    changed = selected[::2]
+    changed_ids = {id(unit) for unit in changed}
+    rules = [
+        Rule("Doubling hit points", "hit_points", scale(2), classes=[class_], where=lambda unit: id(unit) in changed_ids),
+        Rule("Keeping the names", "name", lambda name, unit: name, classes=[class_]),
+    ]
+    assert apply_rules(tracked, rules, verbose=False) == sum(unit.hit_points > 0 for unit in changed)
+    assert marked_units(tracked) == {id(unit) for unit in changed if unit.hit_points > 0}
+    assert tracking.find_undeclared_changes(tracked) == []
+    tracking.save(tracked, tmp_path / "tracked.dat")
+    tracked.save(tmp_path / "full.dat")
+    assert (tmp_path / "tracked.dat").read_bytes() == (tmp_path / "full.dat").read_bytes()
+
+
+# The same query the slow way, walking every command of every effect
+def scan_effects(df, family=None, unit=None, class_=None, attribute=None, tech=None) -> list[tuple[int, EffectCommand]]:
+    families = (family,) if isinstance(family, int) else family
+    return [
+        (effect_id, effect_command)
+        for effect_id, effect in enumerate(df.effects)
+        for effect_command in effect.effect_commands
+        if (families is None or indexes.command_family(effect_command.type) in families)
+        and all(want is None or want == target for want, target in zip((unit, class_, attribute, tech), indexes.command_targets(effect_command)))
+    ]
+
+
+def assert_same_entries(found, expected):
+    assert [(effect_id, id(effect_command)) for effect_id, effect_command in found] == [(effect_id, id(effect_command)) for effect_id, effect_command in expected]
+
+
+def test_effect_queries_find_the_same_commands_as_a_scan(df):
+    effect_index = indexes.get_effect_index(df)
+    attribute_command = next(command for _, command in scan_effects(df, indexes.ATTRIBUTE_FAMILIES) if command.a >= 0)
+    queries = [
+        {},
+        {"family": command_types.ENABLE_DISABLE_UNIT},
+        {"family": indexes.ATTRIBUTE_FAMILIES, "attribute": attribute_command.c},
+        {"unit": attribute_command.a},
+        {"family": command_types.ATTRIBUTE_MODIFIER_ADDITIVE, "unit": attribute_command.a, "attribute": attribute_command.c},
+        {"class_": next(command.b for _, command in scan_effects(df, indexes.ATTRIBUTE_FAMILIES) if command.b >= 0)},
+        {"tech": next(indexes.command_targets(command)[3] for _, command in scan_effects(df) if indexes.command_targets(command)[3] is not None)},
+    ]
+    for query in queries:
+        expected = scan_effects(df, **query)
+        assert expected, query
+        assert_same_entries(effect_index.query(**query), expected)
+
+
+def test_team_commands_are_in_the_family_of_the_player_command():
+    assert indexes.command_family(command_types.TEAM_ATTRIBUTE_MODIFIER_SET) == command_types.ATTRIBUTE_MODIFIER_SET
+    assert indexes.command_family(command_types.ENEMY_UPGRADE_UNIT) == command_types.UPGRADE_UNIT
+    assert indexes.command_family(101) == 101
+
+
+def test_effect_index_follows_appended_and_removed_commands(df):
+    effect_index = indexes.get_effect_index(df)
+    unit_id = next(unit.id for unit in df.civs[0].units if unit is not None)
+    effect_index.append(1, EffectCommand(command_types.ATTRIBUTE_MODIFIER_ADDITIVE, unit_id, -1, 0, 10))
+    added = df.effects[1].effect_commands[-1]
+    assert (1, added) in effect_index.query(unit=unit_id)
+    effect_index.remove(1, added)
+    assert added not in df.effects[1].effect_commands
+    assert_same_entries(effect_index.query(unit=unit_id), scan_effects(df, unit=unit_id))
+    # Commands changed without going through the index are found once their count changes
+    df.effects[0].effect_commands.append(EffectCommand(command_types.ENABLE_DISABLE_UNIT, unit_id, 1, -1, 0))
+    assert_same_entries(effect_index.query(unit=unit_id), scan_effects(df, unit=unit_id))
+    assert (0, df.effects[0].effect_commands[-1]) in effect_index.query(unit=unit_id)
@@ -0,0 +1,84 @@
+import pickle
+import shutil
+from types import ModuleType
+
+import pytest
+from genieutils.datfile import DatFile
+
+from mods import indexes
+from tools import lazy, tracking
+from tools.tracking import parse_with_layout
+from tools.validate import validate
+
+
+@pytest.fixture
+def lazy_df(dat_file, tmp_path):
+    base_file = tmp_path / "base_game.dat"
+    shutil.copy(dat_file, base_file)
+    _, layout = parse_with_layout(base_file)
+    df = lazy.load_lazy(base_file, layout)
+    tracking.track(df, base_file, layout)
+    return df
+
+
+def loaded_civs(df) -> list[int]:
+    return [civ_id for civ_id, civ in enumerate(df.civs) if civ.is_loaded("units")]
+
+
+def loaded_sections(df) -> list[str]:
+    return [section for section in lazy.LAZY_SECTIONS if any(df.is_loaded(field) for field in tracking.SECTIONS[section])]
+
+
+def test_sections_are_decoded_when_they_are_used(lazy_df, df):
+    assert loaded_sections(lazy_df) == [] and loaded_civs(lazy_df) == []
+    assert lazy_df.graphics == df.graphics
+    assert loaded_sections(lazy_df) == ["graphics"]
+    assert lazy_df.civs[2].units == df.civs[2].units
+    assert loaded_civs(lazy_df) == [2]
+
+
+def test_unused_sections_are_saved_without_decoding_them(lazy_df, df, tmp_path):
+    module = ModuleType("mods.test_mod")
+    module.MODIFIED_SECTIONS = ["terrain_block"]
+    tracking.mark_module(lazy_df, module)
+    lazy_df.terrain_block.terrains[0].name = "Changed"
+    df.terrain_block.terrains[0].name = "Changed"
+    unit = next(unit for unit in lazy_df.civs[1].units if unit is not None)
+    unit.hit_points += 1
+    df.civs[1].units[unit.id].hit_points += 1
+    tracking.mark_units(lazy_df, [unit])
+    tracking.save(lazy_df, tmp_path / "lazy.dat")
+    df.save(tmp_path / "full.dat")
+    assert (tmp_path / "lazy.dat").read_bytes() == (tmp_path / "full.dat").read_bytes()
+    assert loaded_sections(lazy_df) == ["terrain_block"] and loaded_civs(lazy_df) == [1]
+
+
+def test_copies_are_plain_datfiles(lazy_df, df):
+    copied = pickle.loads(pickle.dumps(lazy_df))
+    assert type(copied) is DatFile and type(copied.civs[0]) is not lazy.LazyCiv
+    assert copied == df and lazy_df == df
+
+
+def test_validating_only_decodes_nothing(lazy_df, df):
+    assert validate(lazy_df) == []
+    assert loaded_civs(lazy_df) == []
+    assert lazy_df.civs[0].units_size() == len(df.civs[0].units)
+
+
+def test_validating_checks_the_decoded_civs(lazy_df):
+    unit, other = [unit for unit in lazy_df.civs[1].units if unit is not None and unit.creatable is not None and unit.building is None][:2]
+    for shared in (unit, other):
+        shared.enabled = 1
+        shared.creatable.train_location_id = 0
+        shared.creatable.button_id = 120
+    assert [issue.location for issue in validate(lazy_df) if issue.message.startswith("Uses button 120")] == [f"civs[1].units[{other.id}].creatable.button_id"]
+    assert loaded_civs(lazy_df) == [1]
+
+
+def test_unit_index_decodes_the_units_when_it_is_built(lazy_df):
+    unit_index = indexes.get_unit_index(lazy_df)
+    unit_index.invalidate()
+    assert unit_index._current_shape() == [None] * len(lazy_df.civs)
+    assert loaded_civs(lazy_df) == []
+    assert unit_index.units_with_id(0, mark=False)
+    assert loaded_civs(lazy_df) == list(range(len(lazy_df.civs)))
@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from tools import locking
+from tools.cache import DatCache
+from tools.locking import FileLock
+
+needs_fork = pytest.mark.skipif(not hasattr(os, "fork"), reason="Needs fork")
+
+
+def hold_lock(lock_file, locked, release):
+    with FileLock(lock_file):
+        locked.set()
+        release.wait(10)
+
+
+@needs_fork
+def test_lock_is_exclusive_between_processes_and_released_on_exit(tmp_path):
+    context = multiprocessing.get_context("fork")
+    locked, release = context.Event(), context.Event()
+    process = context.Process(target=hold_lock, args=(tmp_path / "cache.lock", locked, release))
+    process.start()
+    assert locked.wait(10)
+    lock = FileLock(tmp_path / "cache.lock")
+    assert not lock.acquire(blocking=False) and not lock.locked
+    release.set()
+    process.join(10)
+    assert lock.acquire(blocking=False)
+    with pytest.raises(RuntimeError):
+        lock.acquire()
+    lock.release()
+    assert (tmp_path / "cache.lock").exists()
+
+
+# msvcrt.locking for tests on other systems: a byte locked through one descriptor can't be locked through another
+class FakeMsvcrt:
+    LK_NBLCK = 2
+    LK_UNLCK = 0
+
+    def __init__(self):
+        self.locked: dict[int, int] = {}
+
+    def locking(self, fd: int, mode: int, size: int):
+        inode = os.fstat(fd).st_ino
+        if mode == self.LK_UNLCK:
+            del self.locked[inode]
+        elif self.locked.setdefault(inode, fd) != fd:
+            raise OSError("Locked by another descriptor")
+
+
+def test_lock_without_fcntl_retries_until_it_is_released(tmp_path, monkeypatch):
+    monkeypatch.setattr(locking, "fcntl", None)
+    monkeypatch.setattr(locking, "msvcrt", FakeMsvcrt(), raising=False)
+    holder = FileLock(tmp_path / "cache.lock")
+    assert holder.acquire()
+    waiter = FileLock(tmp_path / "cache.lock")
+    assert not waiter.acquire(blocking=False)
+    retries = []
+
+    def sleep(seconds):
+        assert seconds == locking.WINDOWS_RETRY_SECONDS
+        retries.append(seconds)
+        if len(retries) == 3:
+            holder.release()
+
+    monkeypatch.setattr(locking.time, "sleep", sleep)
+    assert waiter.acquire()
+    assert len(retries) == 3 and waiter.locked
+    waiter.release()
+
+
+def create_entry(cache_dir, created_file):
+    def create():
+        with open(created_file, "a") as f:
+            f.write(f"{os.getpid()}\n")
+        # Long enough for the other processes to find the entry missing and wait for the lock
+        time.sleep(0.5)
+        return ["parsed", 1]
+
+    assert DatCache(cache_dir).load_or_create("key", create) == ["parsed", 1]
+
+
+@needs_fork
+def test_only_one_process_creates_a_missing_entry(tmp_path):
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=create_entry, args=(tmp_path / "cache", tmp_path / "created.txt")) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+    assert [process.exitcode for process in processes] == [0] * 4
+    assert len((tmp_path / "created.txt").read_text().splitlines()) == 1
+
+
+def test_damaged_entry_is_created_again(tmp_path, capsys):
+    cache = DatCache(tmp_path / "cache")
+    cache.store("key", ["parsed", 1])
+    entry = cache.entry_path("key")
+    entry.write_bytes(entry.read_bytes()[:-1] + b"x")
+    assert cache.load_or_create("key", lambda: ["parsed", 2]) == ["parsed", 2]
+    assert "checksum mismatch" in capsys.readouterr().out
+    assert cache.load("key") == ["parsed", 2]
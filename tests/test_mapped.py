@@ -0,0 +1,68 @@
+import os
+import shutil
+from pathlib import Path
+
+from tools import mapped
+from tools.mapped import SCRATCH_PREFIX, map_uncompressed, open_uncompressed
+
+
+def scratch_files(scratch_dir):
+    return sorted(scratch_dir.glob(f"{SCRATCH_PREFIX}*.dat"))
+
+
+def changed_base_file(base_file):
+    base_file.write_bytes(base_file.read_bytes())
+    stat = base_file.stat()
+    os.utime(base_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_mapped_content_is_the_uncompressed_file(dat_file, tmp_path):
+    assert bytes(open_uncompressed(dat_file, tmp_path / "scratch")) == bytes(open_uncompressed(dat_file))
+
+
+def test_scratch_file_is_reused(dat_file, tmp_path, monkeypatch):
+    base_file = tmp_path / "base_game.dat"
+    shutil.copy(dat_file, base_file)
+    scratch_dir = tmp_path / "scratch"
+    first = map_uncompressed(base_file, scratch_dir)
+
+    def decompress_again(input_file):
+        raise AssertionError("The base file was decompressed again")
+
+    monkeypatch.setattr(mapped, "decompress_chunks", decompress_again)
+    second = map_uncompressed(base_file, scratch_dir)
+    assert bytes(second) == bytes(first)
+    assert len(scratch_files(scratch_dir)) == 1
+
+
+def test_scratch_file_of_a_changed_base_file_replaces_the_old_one(dat_file, tmp_path):
+    base_file = tmp_path / "base_game.dat"
+    shutil.copy(dat_file, base_file)
+    scratch_dir = tmp_path / "scratch"
+    old_data = map_uncompressed(base_file, scratch_dir)
+    [old_scratch_file] = scratch_files(scratch_dir)
+    changed_base_file(base_file)
+    map_uncompressed(base_file, scratch_dir)
+    assert scratch_files(scratch_dir) != [old_scratch_file] and len(scratch_files(scratch_dir)) == 1
+    # A build still using the old mapping keeps reading it
+    assert bytes(old_data[:16]) == bytes(open_uncompressed(base_file)[:16])
+
+
+def test_scratch_file_in_use_is_skipped(dat_file, tmp_path, monkeypatch):
+    base_file = tmp_path / "base_game.dat"
+    shutil.copy(dat_file, base_file)
+    scratch_dir = tmp_path / "scratch"
+    map_uncompressed(base_file, scratch_dir)
+    [in_use] = scratch_files(scratch_dir)
+    unlink = Path.unlink
+
+    def unlink_unless_in_use(path, missing_ok=False):
+        if path == in_use:
+            raise PermissionError(f"{path} is in use")
+        unlink(path, missing_ok=missing_ok)
+
+    monkeypatch.setattr(Path, "unlink", unlink_unless_in_use)
+    changed_base_file(base_file)
+    data = map_uncompressed(base_file, scratch_dir)
+    assert len(scratch_files(scratch_dir)) == 2 and in_use.is_file()
+    assert bytes(data) == b"".join(mapped.decompress_chunks(base_file))
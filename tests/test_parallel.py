@@ -0,0 +1,97 @@
+import shutil
+
+import pytest
+from genieutils.datfile import DatFile
+
+from mods import indexes
+from tools import tracking
+from tools.parallel import EXECUTORS, _apply_in_worker, apply_per_civ
+from tools.tracking import parse_with_layout
+
+
+# Per-civ modifications have to be module-level functions, so that worker processes can find them
+def boost_first_units(civ_id, civ):
+    unit_ids = [unit_id for unit_id, unit in enumerate(civ.units) if unit is not None][:2]
+    for unit_id in unit_ids:
+        civ.units[unit_id].hit_points += civ_id + 1
+    return unit_ids
+
+
+def give_resource(civ_id, civ):
+    civ.resources[0] += 1
+    return []
+
+
+# Returns nothing, so any unit of the civ may have changed
+def rename_every_unit(civ_id, civ):
+    for unit in civ.units:
+        if unit is not None:
+            unit.name = f"Civ {civ_id}"
+
+
+@pytest.fixture
+def tracked(dat_file, tmp_path):
+    base_file = tmp_path / "base_game.dat"
+    shutil.copy(dat_file, base_file)
+    df, layout = parse_with_layout(base_file)
+    tracking.track(df, base_file, layout)
+    return df
+
+
+def assert_saved_like_datfile(df, tmp_path):
+    assert tracking.find_undeclared_changes(df) == []
+    tracking.save(df, tmp_path / "tracked.dat")
+    df.save(tmp_path / "full.dat")
+    assert (tmp_path / "tracked.dat").read_bytes() == (tmp_path / "full.dat").read_bytes()
+
+
+@pytest.mark.parametrize("executor", EXECUTORS)
+def test_only_returned_units_are_encoded_again(tracked, df, executor, tmp_path):
+    apply_per_civ(tracked, [boost_first_units, give_resource], jobs=2, executor=executor)
+    tracker = tracking.get_tracker(tracked)
+    assert tracker.dirty_civs == set()
+    for civ_id, civ in enumerate(tracked.civs):
+        unit_ids = [unit_id for unit_id, unit in enumerate(civ.units) if unit is not None]
+        assert tracker.unchanged_units(civ_id) == set(unit_ids[2:])
+        assert civ.units[unit_ids[0]].hit_points == df.civs[civ_id].units[unit_ids[0]].hit_points + civ_id + 1
+        assert civ.resources[0] == df.civs[civ_id].resources[0] + 1
+    assert_saved_like_datfile(tracked, tmp_path)
+
+
+@pytest.mark.parametrize("executor", EXECUTORS)
+def test_modification_returning_nothing_encodes_the_whole_civ(tracked, executor, tmp_path):
+    apply_per_civ(tracked, [boost_first_units, rename_every_unit], jobs=2, executor=executor)
+    tracker = tracking.get_tracker(tracked)
+    assert tracker.dirty_civs == set(range(len(tracked.civs)))
+    assert all(unit.name == f"Civ {civ_id}" for civ_id, civ in enumerate(tracked.civs) for unit in civ.units if unit is not None)
+    assert_saved_like_datfile(tracked, tmp_path)
+
+
+@pytest.mark.parametrize("executor", EXECUTORS)
+def test_executors_give_the_same_result(dat_file, executor):
+    modifications = [boost_first_units, give_resource, rename_every_unit]
+    serial = DatFile.parse(dat_file)
+    apply_per_civ(serial, modifications, executor="serial")
+    parallel = DatFile.parse(dat_file)
+    apply_per_civ(parallel, modifications, jobs=2, executor=executor)
+    assert parallel.to_bytes() == serial.to_bytes()
+
+
+def test_workers_only_send_back_changed_units(df):
+    civ = df.civs[1]
+    header, changed_units = _apply_in_worker([boost_first_units, give_resource], 1, civ)
+    unit_ids = [unit_id for unit_id, unit in enumerate(civ.units) if unit is not None][:2]
+    assert changed_units == {unit_id: civ.units[unit_id] for unit_id in unit_ids}
+    assert "units" not in header
+    assert header["resources"] == civ.resources
+    _, changed_units = _apply_in_worker([rename_every_unit], 1, civ)
+    assert changed_units is civ.units
+
+
+@pytest.mark.parametrize("executor", EXECUTORS)
+def test_unit_index_finds_the_changed_units(df, executor):
+    unit_index = indexes.get_unit_index(df)
+    unit_id = next(unit.id for unit in df.civs[0].units if unit is not None)
+    unit_index.units_with_id(unit_id, mark=False)
+    apply_per_civ(df, [boost_first_units], jobs=2, executor=executor)
+    assert all(unit is civ.units[unit_id] for unit, civ in zip(unit_index.units_with_id(unit_id, mark=False), df.civs))
@@ -0,0 +1,56 @@
+from genieutils.datfile import DatFile
+
+from mods.rules import Rule, apply_rules, scale
+
+
+def most_common_class(df) -> int:
+    classes = [unit.class_ for civ in df.civs for unit in civ.units if unit is not None]
+    return max(set(classes), key=classes.count)
+
+
+# The same rules the slow way: every rule loops over every unit on its own, one rule after the other
+def apply_one_by_one(df: DatFile, rules: list[Rule]):
+    for rule in rules:
+        for civ in df.civs:
+            for unit in civ.units:
+                if unit is None or not rule.selects(unit):
+                    continue
+                *parents, name = rule.field.split(".")
+                parent = unit
+                for parent_name in parents:
+                    parent = getattr(parent, parent_name)
+                    if parent is None:
+                        break
+                else:
+                    setattr(parent, name, rule.transform(getattr(parent, name), unit))
+
+
+def test_rules_give_the_same_result_as_applying_them_one_by_one(df, dat_file):
+    class_ = most_common_class(df)
+    unit_id = next(unit.id for unit in df.civs[0].units if unit is not None and unit.class_ != class_ and unit.creatable is not None)
+    rules = [
+        Rule("Doubling hit points", "hit_points", scale(2), classes=[class_], unit_ids=[unit_id]),
+        # Sees the doubled hit points of the units selected by both rules
+        Rule("Capping hit points", "hit_points", scale(1, maximum=150), classes=[class_]),
+        Rule("Training faster", "creatable.train_time", scale(0.5, minimum=1), classes=[class_], unit_ids=[unit_id]),
+        Rule("Naming the first units", "name", lambda name, unit: f"{name} (first)", base_ids=[unit_id], where=lambda unit: unit.hit_points > 10),
+    ]
+    expected = DatFile.parse(dat_file)
+    apply_one_by_one(expected, rules)
+    assert apply_rules(df, rules, verbose=False) > 0
+    assert df == expected
+
+
+def test_rules_print_what_they_change(df, capsys):
+    unit = next(unit for unit in df.civs[0].units if unit is not None and unit.hit_points > 0)
+    hit_points = unit.hit_points
+    apply_rules(df, [Rule("Doubling hit points", "hit_points", scale(2), unit_ids=[unit.id])])
+    output = capsys.readouterr().out
+    assert output.startswith("Doubling hit points\n")
+    assert f"Unit ID {unit.id} ({unit.name}): hit_points changed from {hit_points} to {hit_points * 2}" in output
+
+
+def test_scale_leaves_unused_values_alone():
+    double = scale(2, minimum=5, maximum=100)
+    assert [double(value, None) for value in [-1, 0, 1, 30, 60]] == [-1, 0, 5, 60, 100]
+    assert scale(1.5)(3, None) == 4
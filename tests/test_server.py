@@ -0,0 +1,77 @@
+import functools
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+import pytest
+from genieutils.datfile import DatFile
+
+import mods
+from tools import server
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork") or not hasattr(socket, "AF_UNIX"), reason="The build server needs fork and Unix sockets")
+
+
+# A mod in a folder of its own that is part of the mods package, which the server imports again for every build
+@pytest.fixture
+def server_mod(tmp_path, monkeypatch):
+    mod_dir = tmp_path / "extra_mods"
+    mod_dir.mkdir()
+    monkeypatch.setattr(mods, "__path__", [*mods.__path__, str(mod_dir)])
+    return mod_dir / "server_mod.py"
+
+
+def write_server_mod(mod_file, suffix: str):
+    mod_file.write_text(f"import os\n\nNAME = 'server_mod'\n\n\ndef run_server_mod(df):\n    print(f'Built by {{os.getpid()}}')\n    df.techs[0].name += {suffix!r}\n")
+
+
+@pytest.fixture
+def socket_path(dat_file, tmp_path):
+    socket_path = tmp_path / "server.sock"
+    process = multiprocessing.get_context("fork").Process(target=server.serve, args=(socket_path, dat_file, functools.partial(DatFile.parse, dat_file)))
+    process.start()
+    while not server.is_running(socket_path):
+        assert process.is_alive()
+        time.sleep(0.05)
+    yield socket_path
+    os.kill(process.pid, signal.SIGINT)
+    process.join(10)
+    assert process.exitcode == 0
+    assert not socket_path.exists()
+
+
+def test_build_request(socket_path, dat_file, tmp_path):
+    assert server.request_build(socket_path, {"output": str(tmp_path / "built.dat"), "mods": []})
+    DatFile.parse(dat_file).save(tmp_path / "expected.dat")
+    assert (tmp_path / "built.dat").read_bytes() == (tmp_path / "expected.dat").read_bytes()
+
+
+def test_invalid_build_request(socket_path, tmp_path, capsys):
+    assert not server.request_build(socket_path, {"mods": []})
+    assert "Invalid build request" in capsys.readouterr().out
+
+
+def test_client_sending_nothing_doesnt_hold_up_other_builds(socket_path, tmp_path):
+    # The first build waits for the base data to be loaded
+    assert server.request_build(socket_path, {"output": str(tmp_path / "first.dat"), "mods": []})
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as silent:
+        silent.connect(str(socket_path))
+        start_time = time.perf_counter()
+        assert server.request_build(socket_path, {"output": str(tmp_path / "second.dat"), "mods": []})
+        assert time.perf_counter() - start_time < server.REQUEST_TIMEOUT_SECONDS
+
+
+# The server fixture has to start after the mod folder was added, so server_mod comes first
+def test_every_build_starts_from_the_base_data_with_the_current_mods(server_mod, socket_path, dat_file, tmp_path, capsys):
+    write_server_mod(server_mod, "!")
+    assert server.request_build(socket_path, {"output": str(tmp_path / "first.dat"), "mods": ["server_mod"]})
+    assert server.request_build(socket_path, {"output": str(tmp_path / "second.dat"), "mods": ["server_mod"]})
+    write_server_mod(server_mod, " (changed)")
+    assert server.request_build(socket_path, {"output": str(tmp_path / "changed.dat"), "mods": ["server_mod"]})
+    builders = [line for line in capsys.readouterr().out.splitlines() if line.startswith("Built by")]
+    # Every build ran in a process of its own
+    assert len(set(builders)) == 3 and f"Built by {os.getpid()}" not in builders
+    base_name = DatFile.parse(dat_file).techs[0].name
+    assert [DatFile.parse(tmp_path / f"{name}.dat").techs[0].name for name in ["first", "second", "changed"]] == [f"{base_name}!", f"{base_name}!", f"{base_name} (changed)"]
@@ -0,0 +1,145 @@
+import dataclasses
+import json
+import signal
+import struct
+
+import pytest
+from genieutils.datfile import DatFile
+from genieutils.unit import ResourceCost, UnitType
+
+from mods import compact
+from tools import lazy, snapshot
+from tools.tracking import DatLayout, parse_with_layout
+
+
+def roundtrip(value):
+    return snapshot.decode(b"".join(snapshot.encode(value)))
+
+
+# Equal values can still differ in type, e.g. an IntEnum is equal to its value, so compare the types of everything as well
+def assert_same(value, other, location="value"):
+    assert type(other) is type(value), location
+    if dataclasses.is_dataclass(value):
+        for field in dataclasses.fields(value):
+            assert_same(getattr(value, field.name), getattr(other, field.name), f"{location}.{field.name}")
+    elif isinstance(value, (list, tuple, compact.CompactArray)):
+        assert len(other) == len(value), location
+        for index, (item, other_item) in enumerate(zip(value, other)):
+            assert_same(item, other_item, f"{location}[{index}]")
+    elif isinstance(value, dict):
+        assert list(other) == list(value), location
+        for key in value:
+            assert_same(value[key], other[key], f"{location}[{key!r}]")
+    else:
+        assert other == value, location
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        [0, -1, 127],
+        [-(2**15), 2**15 - 1],
+        [2**31, -(2**40)],
+        # Too large for any array
+        [2**70, 1],
+        [0.5, -2.25],
+        # Doesn't fit in a 32-bit float
+        [0.1, 1e300],
+        [True, False],
+        ["a", "b", "a", ""],
+        [None, None],
+        [UnitType.Flag, UnitType.Trees],
+        [(1, 2), (), (3,)],
+        [{"a": 1, 2: "b"}, {}],
+        [[1, "a"], [None, 2.5, True, UnitType.Flag, (1,), {"x": [2**70]}]],
+        {"nested": {"list": [[[]]], "tuple": ((),)}},
+    ],
+)
+def test_values_roundtrip(value):
+    assert_same(value, roundtrip(value))
+
+
+def test_datfile_roundtrip(df):
+    decoded = roundtrip(df)
+    assert_same(df, decoded, "df")
+    assert decoded.to_bytes() == df.to_bytes()
+
+
+def test_compact_datfile_roundtrip(df):
+    compact.compact_datfile(df)
+    decoded = roundtrip(df)
+    assert_same(df, decoded, "df")
+    assert decoded.to_bytes() == df.to_bytes()
+    unit = next(unit for unit in decoded.civs[0].units if unit is not None and unit.creatable is not None)
+    # Interned costs are interned again, so they are shared with the units of every other DatFile holding the same costs
+    assert unit.creatable.resource_costs is compact.intern_costs(unit.creatable.resource_costs)
+
+
+def test_lazy_datfile_is_stored_as_plain_datfile(dat_file, df):
+    _, layout = parse_with_layout(dat_file)
+    lazy_df = lazy.load_lazy(dat_file, layout)
+    # Decodes some of the lazily loaded sections, but not all of them
+    assert lazy_df.sounds == df.sounds
+    decoded = roundtrip(lazy_df)
+    assert type(decoded) is DatFile
+    assert_same(df, decoded, "df")
+
+
+def test_layout_roundtrip(dat_file):
+    _, layout = parse_with_layout(dat_file)
+    decoded = roundtrip(layout)
+    assert type(decoded) is DatLayout
+    assert (decoded.sections, decoded.unit_ranges) == (layout.sections, layout.unit_ranges)
+
+
+def test_shared_objects_stay_shared():
+    cost = ResourceCost(1, 2, 3)
+    decoded = roundtrip({"first": [cost], "second": (cost, ResourceCost(1, 2, 3))})
+    assert decoded["first"][0] is decoded["second"][0]
+    assert decoded["second"][1] is not decoded["second"][0]
+
+
+def test_other_data_is_rejected():
+    chunks = snapshot.encode([1])
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.decode(b"".join(chunks).replace(snapshot.SNAPSHOT_FORMAT.encode(), b"x" * len(snapshot.SNAPSHOT_FORMAT)))
+
+
+# Decode the snapshot after changing its manifest, keeping the blobs as they are
+def decode_changed(value, change):
+    encoded = b"".join(snapshot.encode(value))
+    (manifest_size,) = struct.unpack_from("<Q", encoded)
+    manifest = json.loads(encoded[8 : 8 + manifest_size])
+    blobs = encoded[(8 + manifest_size + 7) // 8 * 8 :]
+    change(manifest)
+    changed_manifest = json.dumps(manifest).encode()
+    header = struct.pack("<Q", len(changed_manifest)) + changed_manifest
+    return snapshot.decode(header + bytes(-len(header) % 8) + blobs)
+
+
+def test_only_known_classes_are_created():
+    value = [ResourceCost(1, 2, 3), UnitType.Flag]
+    assert_same(value, decode_changed(value, lambda manifest: None))
+
+    def change_table_class(manifest):
+        manifest["tables"][0]["class"] = "subprocess.Popen"
+
+    with pytest.raises(snapshot.SnapshotError, match="subprocess.Popen"):
+        decode_changed(value, change_table_class)
+
+    def change_enum_class(manifest):
+        manifest["root"]["items"]["columns"][1]["class"] = "signal.Signals"
+
+    with pytest.raises(snapshot.SnapshotError, match="signal.Signals"):
+        decode_changed(value, change_enum_class)
+
+
+class Unknown:
+    def __init__(self):
+        self.value = 1
+
+
+@pytest.mark.parametrize("value", [Unknown(), signal.Signals.SIGINT], ids=["object", "enum"])
+def test_unknown_classes_are_not_stored(value):
+    with pytest.raises(snapshot.SnapshotError, match="can't store"):
+        snapshot.encode([value])
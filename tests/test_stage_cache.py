@@ -0,0 +1,65 @@
+import importlib
+import sys
+from types import ModuleType
+
+import pytest
+
+import create_mod
+from tools.hashing import get_source_files, hash_sources
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    package = tmp_path / "stage_mods"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "mod.py").write_text("from stage_mods import shared\nfrom . import relative\n\n\ndef run(df):\n    import stage_mods.late\n")
+    for name in ["shared", "relative", "late", "unrelated"]:
+        (package / f"{name}.py").write_text("VALUE = 1\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    importlib.invalidate_caches()
+    yield tmp_path
+    # Every test has its own project, which mustn't find the package of the previous one
+    for module_name in [module_name for module_name in sys.modules if module_name.partition(".")[0] == "stage_mods"]:
+        del sys.modules[module_name]
+
+
+def test_source_files_follow_imports(project):
+    source_files = [source_file.relative_to(project.resolve()).as_posix() for source_file in get_source_files(["stage_mods.mod"], project)]
+    assert source_files == ["stage_mods/late.py", "stage_mods/mod.py", "stage_mods/relative.py", "stage_mods/shared.py"]
+
+
+@pytest.mark.parametrize("dependency", ["mod", "shared", "relative", "late"])
+def test_changing_a_dependency_changes_the_hash(project, dependency):
+    before = hash_sources(["stage_mods.mod"], project)
+    source_file = project / "stage_mods" / f"{dependency}.py"
+    source_file.write_text(source_file.read_text() + "# changed\n")
+    assert hash_sources(["stage_mods.mod"], project) != before
+
+
+def test_changing_an_unrelated_module_keeps_the_hash(project):
+    before = hash_sources(["stage_mods.mod"], project)
+    (project / "stage_mods" / "unrelated.py").write_text("VALUE = 2\n")
+    assert hash_sources(["stage_mods.mod"], project) == before
+
+
+def test_stage_hash_covers_the_modules_a_mod_uses():
+    source_files = {source_file.relative_to(create_mod.PROJECT_DIR).as_posix() for source_file in get_source_files(["mods.age_diplomacy", "tools.parallel"], create_mod.PROJECT_DIR)}
+    assert {"mods/age_diplomacy.py", "mods/rules.py", "mods/helpers.py", "mods/indexes.py", "constants/units.py", "tools/parallel.py"} <= source_files
+    assert "mods/custom_modifications.py" not in source_files
+
+
+def test_stage_keys_only_change_from_the_changed_stage_on(monkeypatch):
+    first, second = ModuleType("mods.first"), ModuleType("mods.second")
+    stages = [(first, lambda df: None), (second, lambda df: None)]
+    hashes = {first: "a", second: "b"}
+    monkeypatch.setattr(create_mod, "get_module_hash", lambda module: hashes[module])
+    before = create_mod.get_stage_keys("base", stages)
+
+    hashes[second] = "changed"
+    after_second = create_mod.get_stage_keys("base", stages)
+    assert after_second[0] == before[0] and after_second[1] != before[1]
+
+    hashes[first] = "changed"
+    after_first = create_mod.get_stage_keys("base", stages)
+    assert after_first[0] != before[0] and after_first[1] != after_second[1]
@@ -0,0 +1,76 @@
+import pytest
+from genieutils.effect import EffectCommand
+
+from constants import command_types, techs
+from mods import helpers
+from mods.techtree import AGES, get_tech_graph
+from tools import synthetic
+
+
+# Enough technologies for the ages to be part of them
+@pytest.fixture
+def tech_df():
+    return synthetic.make_datfile(civs=3, units_per_civ=10, techs=120, effects=120, named_ids=False)
+
+
+# The earliest ages the slow way: go over every technology again and again until no age goes down anymore
+def earliest_ages(df, civ_id: int) -> list[int | None]:
+    disabled = {int(command.d) for command in df.effects[df.civs[civ_id].tech_tree_id].effect_commands if command.type == command_types.DISABLE_TECH}
+    ages = [None] * len(df.techs)
+    changed = True
+    while changed:
+        changed = False
+        for tech_id, tech in enumerate(df.techs):
+            if tech.civ not in (-1, civ_id) or tech_id in disabled:
+                continue
+            prerequisite_ages = sorted(ages[prerequisite] for prerequisite in tech.required_techs if prerequisite >= 0 and ages[prerequisite] is not None)
+            if tech.required_tech_count > len(prerequisite_ages):
+                continue
+            age = prerequisite_ages[tech.required_tech_count - 1] if tech.required_tech_count > 0 else 0
+            if tech_id in AGES:
+                age = max(age, AGES.index(tech_id))
+            if ages[tech_id] is None or age < ages[tech_id]:
+                ages[tech_id] = age
+                changed = True
+    return ages
+
+
+def add_tech(df, required_techs: list[int], required_tech_count: int, civ: int = -1) -> int:
+    tech = helpers.create_empty_tech()
+    tech.required_techs = tuple(required_techs + [-1] * (6 - len(required_techs)))
+    tech.required_tech_count = required_tech_count
+    tech.civ = civ
+    df.techs.append(tech)
+    return len(df.techs) - 1
+
+
+def test_earliest_ages_match_working_them_out_again_and_again(tech_df):
+    tech_graph = get_tech_graph(tech_df)
+    for civ_id in range(len(tech_df.civs)):
+        ages = earliest_ages(tech_df, civ_id)
+        assert {age for age in ages if age is not None} == set(range(len(AGES)))
+        assert [tech_graph.earliest_age(civ_id, tech_id) for tech_id in range(len(tech_df.techs))] == ages
+        assert tech_graph.techs_by_age(civ_id, 1) == [tech_id for tech_id, age in enumerate(ages) if age is not None and age <= 1]
+
+
+def test_appended_techs_are_added_to_the_graph(tech_df):
+    tech_graph = get_tech_graph(tech_df)
+    tech_graph.reachable_techs(0)
+    either = add_tech(tech_df, [techs.IMPERIAL_AGE, techs.FEUDAL_AGE], 1)
+    both = add_tech(tech_df, [techs.CASTLE_AGE, either], 2)
+    only_civ_1 = add_tech(tech_df, [], 0, civ=1)
+    assert [tech_graph.earliest_age(0, tech_id) for tech_id in [either, both, only_civ_1]] == [1, 2, None]
+    assert tech_graph.is_reachable(1, only_civ_1)
+    assert [tech_graph.earliest_age(0, tech_id) for tech_id in range(len(tech_df.techs))] == earliest_ages(tech_df, 0)
+
+
+def test_techs_disabled_by_the_tech_tree_are_unreachable_with_their_dependents(tech_df):
+    tech_graph = get_tech_graph(tech_df)
+    tech_id = add_tech(tech_df, [techs.FEUDAL_AGE], 1)
+    dependent = add_tech(tech_df, [tech_id], 1)
+    assert tech_graph.is_reachable(2, dependent)
+    tech_df.effects[tech_df.civs[2].tech_tree_id].effect_commands.append(EffectCommand(command_types.DISABLE_TECH, -1, -1, -1, tech_id))
+    tech_graph.invalidate()
+    assert tech_id in tech_graph.disabled_techs(2)
+    assert not tech_graph.is_reachable(2, tech_id) and not tech_graph.is_reachable(2, dependent)
+    assert tech_graph.is_reachable(1, dependent)
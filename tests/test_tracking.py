@@ -0,0 +1,158 @@
+import shutil
+import zlib
+from types import ModuleType
+
+import pytest
+from genieutils.effect import Effect
+
+from mods import compact
+
+from tools import synthetic, tracking
+from tools.tracking import parse_with_layout
+from tools.warmup import file_state
+
+
+def mod_module(*modified_sections: str) -> ModuleType:
+    module = ModuleType("mods.test_mod")
+    if modified_sections:
+        module.MODIFIED_SECTIONS = list(modified_sections)
+    return module
+
+
+def first_unit(df, civ_id: int = 0):
+    return next(unit for unit in df.civs[civ_id].units if unit is not None)
+
+
+@pytest.fixture(params=["in memory", "memory-mapped"])
+def tracked(request, dat_file, tmp_path):
+    base_file = tmp_path / "base_game.dat"
+    shutil.copy(dat_file, base_file)
+    scratch_dir = tmp_path / "scratch" if request.param == "memory-mapped" else None
+    df, layout = parse_with_layout(base_file, scratch_dir)
+    tracking.track(df, base_file, layout, scratch_dir)
+    return df, base_file
+
+
+def assert_saved_like_datfile(df, tmp_path):
+    tracking.save(df, tmp_path / "tracked.dat")
+    df.save(tmp_path / "full.dat")
+    assert (tmp_path / "tracked.dat").read_bytes() == (tmp_path / "full.dat").read_bytes()
+
+
+def test_unchanged_save_is_identical(tracked, tmp_path):
+    df, _ = tracked
+    assert tracking.get_tracker(df).changed_sections() == []
+    assert_saved_like_datfile(df, tmp_path)
+
+
+def test_declared_changes_are_saved(tracked, tmp_path):
+    df, _ = tracked
+    tracking.mark_module(df, mod_module("techs"))
+    df.techs[0].name = "Changed"
+    unit = first_unit(df, 1)
+    unit.hit_points += 1
+    tracking.mark_units(df, [unit])
+    # Replaced sections and units, and lists that changed length, are noticed without being declared
+    df.effects.append(Effect(name="Added", effect_commands=[]))
+    df.civs[2].units[first_unit(df, 2).id] = synthetic.make_datfile(civs=1, units_per_civ=1, techs=1, effects=1, named_ids=False).civs[0].units[0]
+    assert_saved_like_datfile(df, tmp_path)
+
+
+def test_mod_without_declaration_is_encoded_again(tracked, tmp_path):
+    df, _ = tracked
+    tracking.mark_module(df, mod_module())
+    first_unit(df).hit_points += 1
+    df.civs[1].resources[0] += 1
+    assert tracking.find_undeclared_changes(df) == []
+    assert_saved_like_datfile(df, tmp_path)
+
+
+def test_undeclared_changes_are_found(tracked):
+    df, _ = tracked
+    tracking.mark_module(df, mod_module("techs"))
+    unit = first_unit(df)
+    unit.hit_points += 1
+    df.effects[0].name = "Changed"
+    assert tracking.find_undeclared_changes(df) == ["effects", f"civs[0].units[{unit.id}]"]
+
+
+def test_save_copies_from_the_base_file_it_was_parsed_from(tracked, tmp_path):
+    df, base_file = tracked
+    synthetic.write_datfile(base_file, civs=3, units_per_civ=300, techs=60, effects=60, seed=1, named_ids=False)
+    tracking.mark_module(df, mod_module("techs"))
+    df.techs[0].name = "Changed"
+    assert_saved_like_datfile(df, tmp_path)
+
+
+def test_tracking_a_changed_base_file_fails(dat_file, tmp_path):
+    base_file = tmp_path / "base_game.dat"
+    shutil.copy(dat_file, base_file)
+    source_state = file_state(base_file)
+    df, layout = parse_with_layout(base_file)
+    synthetic.write_datfile(base_file, civs=3, units_per_civ=300, techs=60, effects=60, seed=1, named_ids=False)
+    with pytest.raises(ValueError, match="changed since it was loaded"):
+        tracking.track(df, base_file, layout, source_state=source_state)
+
+
+# Without a source_state the file is only known to be different if its size doesn't fit the layout
+def test_tracking_a_base_file_of_another_size_fails(dat_file, tmp_path):
+    base_file = tmp_path / "base_game.dat"
+    shutil.copy(dat_file, base_file)
+    df, layout = parse_with_layout(base_file)
+    synthetic.write_datfile(base_file, civs=3, units_per_civ=301, techs=60, effects=60, seed=0, named_ids=False)
+    with pytest.raises(ValueError, match="changed since it was loaded"):
+        tracking.track(df, base_file, layout)
+
+
+def test_undeclared_changes_are_encoded_again_when_saving(tracked, tmp_path, capsys):
+    df, _ = tracked
+    tracking.mark_module(df, mod_module("techs"))
+    unit = first_unit(df)
+    unit.hit_points += 1
+    creatable = next(unit for unit in df.civs[1].units if unit is not None and unit.creatable is not None)
+    creatable.creatable.train_time += 1
+    df.effects[0].name = "Changed"
+    assert_saved_like_datfile(df, tmp_path)
+    assert f"changed effects, civs[0].units[{unit.id}], civs[1].units[{creatable.id}] without declaring it" in capsys.readouterr().out
+
+
+def test_changes_inside_lists_of_units_are_only_found_by_the_check(tracked):
+    df, _ = tracked
+    tracking.mark_module(df, mod_module("techs"))
+    unit = next(unit for unit in df.civs[0].units if unit is not None and unit.type_50 is not None and unit.type_50.attacks)
+    unit.type_50.attacks[0].amount += 1
+    assert tracking.get_tracker(df).mark_changed_values() == []
+    assert tracking.find_undeclared_changes(df) == [f"civs[0].units[{unit.id}]"]
+
+
+@pytest.mark.parametrize("compact_data", [False, True], ids=["plain", "compact"])
+def test_encoded_chunks_are_the_bytes_of_the_datfile(df, compact_data):
+    if compact_data:
+        compact.compact_datfile(df)
+    assert b"".join(tracking.encode_chunks(df)) == df.to_bytes()
+
+
+@pytest.mark.parametrize("compression_level", [-1, 1, 9])
+def test_untracked_save_streams_the_same_file(df, tmp_path, compression_level):
+    tracking.save(df, tmp_path / "streamed.dat", compression_level)
+    saved = (tmp_path / "streamed.dat").read_bytes()
+    assert zlib.decompress(saved, wbits=-15) == df.to_bytes()
+    if compression_level == -1:
+        df.save(tmp_path / "full.dat")
+        assert saved == (tmp_path / "full.dat").read_bytes()
+    # The compressed file is written a block at a time instead of all at once
+    assert len(list(tracking._compress(tracking.encode_chunks(df), compression_level))) > 1
+
+
+def test_failed_save_leaves_the_old_file_alone(df, tmp_path):
+    target_file = tmp_path / "saved.dat"
+    target_file.write_bytes(b"old")
+
+    def failing_chunks():
+        yield from tracking.encode_chunks(df)
+        raise ValueError("Encoding failed")
+
+    with pytest.raises(ValueError):
+        tracking.write_compressed(target_file, failing_chunks())
+    assert target_file.read_bytes() == b"old"
+    assert list(tmp_path.iterdir()) == [target_file]
@@ -0,0 +1,167 @@
+import pytest
+from genieutils.effect import Effect, EffectCommand
+from genieutils.tech import ResearchResourceCost
+from genieutils.unit import ResourceCost
+
+from constants import command_types, resources
+from tools.validate import ERROR, WARNING, ValidationError, ensure_valid, validate
+
+# The synthetic dat file is made to be valid, every test breaks one thing and checks what is reported for it
+
+
+def creatable_units(df, civ_id: int = 0, count: int = 2):
+    return [unit for unit in df.civs[civ_id].units if unit is not None and unit.creatable is not None and unit.building is None][:count]
+
+
+def reported(df, location: str) -> list[tuple[str, str]]:
+    return [(issue.severity, issue.message) for issue in validate(df) if issue.location == location]
+
+
+def unit_id(df, unit, civ_id: int = 0) -> int:
+    return next(unit_id for unit_id, other in enumerate(df.civs[civ_id].units) if other is unit)
+
+
+def unit_location(df, unit, civ_id: int = 0) -> str:
+    return f"civs[{civ_id}].units[{unit_id(df, unit, civ_id)}]"
+
+
+def test_unchanged_data_is_valid(df):
+    assert validate(df) == []
+    ensure_valid(df)
+
+
+@pytest.mark.parametrize(
+    "field, value, message",
+    [
+        ("hit_points", 40000, "40000 doesn't fit in an int16 field (-32768 to 32767)"),
+        ("hit_points", 10.5, "10.5 is not an integer, round it with int()"),
+        ("speed", "fast", "'fast' is not a number"),
+        ("enabled", 200, "200 doesn't fit in an int8 field (-128 to 127)"),
+    ],
+)
+def test_values_that_cant_be_saved_are_errors(df, field, value, message):
+    unit = creatable_units(df)[0]
+    setattr(unit, field, value)
+    assert reported(df, f"{unit_location(df, unit)}.{field}") == [(ERROR, message)]
+    with pytest.raises(ValidationError):
+        ensure_valid(df)
+
+
+def test_nested_values_are_checked(df):
+    unit = creatable_units(df)[0]
+    unit.creatable.train_time = 1.5
+    assert reported(df, f"{unit_location(df, unit)}.creatable.train_time") == [(ERROR, "1.5 is not an integer, round it with int()")]
+
+
+def test_attacks_that_cant_be_saved_are_errors(df):
+    unit = next(unit for unit in df.civs[0].units if unit is not None and unit.type_50 is not None and unit.type_50.attacks)
+    unit.type_50.attacks[0].amount = 70000
+    assert reported(df, f"{unit_location(df, unit)}.type_50.attacks[0].amount") == [(ERROR, "70000 doesn't fit in an int16 field (-32768 to 32767)")]
+
+
+def test_costs_with_the_wrong_number_of_slots_are_errors(df):
+    unit = creatable_units(df)[0]
+    unit.creatable.resource_costs = unit.creatable.resource_costs[:2]
+    assert reported(df, f"{unit_location(df, unit)}.creatable.resource_costs") == [(ERROR, "Has 2 slots instead of 3")]
+
+
+def test_required_techs_with_the_wrong_number_of_slots_are_errors(df):
+    df.techs[5].required_techs = (-1, -1)
+    assert reported(df, "techs[5].required_techs") == [(ERROR, "Has 2 entries instead of 6")]
+
+
+def test_missing_ids_are_warnings(df):
+    unit_count = max(len(civ.units) for civ in df.civs)
+    unit = creatable_units(df)[0]
+    unit.dead_unit_id = unit_count
+    unit.creatable.train_location_id = unit_count + 1
+    df.techs[5].effect_id = len(df.effects)
+    df.techs[5].research_location = unit_count
+    df.techs[6].required_techs = (len(df.techs), -1, -1, -1, -1, -1)
+    df.civs[1].tech_tree_id = len(df.effects) + 1
+    df.effects[0].effect_commands.append(EffectCommand(command_types.ENABLE_DISABLE_UNIT, unit_count + 2, -1, -1, 0))
+    df.effects[0].effect_commands.append(EffectCommand(command_types.DISABLE_TECH, -1, -1, -1, len(df.techs) + 3))
+    command_index = len(df.effects[0].effect_commands) - 2
+    location = unit_location(df, unit)
+    assert reported(df, f"{location}.dead_unit_id") == [(WARNING, f"There is no unit {unit_count}")]
+    assert reported(df, f"{location}.creatable.train_location_id") == [(WARNING, f"There is no unit {unit_count + 1}")]
+    assert reported(df, "techs[5].effect_id") == [(WARNING, f"There is no effect {len(df.effects)}")]
+    assert reported(df, "techs[5].research_location") == [(WARNING, f"There is no unit {unit_count}")]
+    assert reported(df, "techs[6].required_techs[0]") == [(WARNING, f"There is no technology {len(df.techs)}")]
+    assert reported(df, "civs[1].tech_tree_id") == [(WARNING, f"There is no effect {len(df.effects) + 1}")]
+    assert reported(df, f"effects[0].effect_commands[{command_index}].a") == [(WARNING, f"There is no unit {unit_count + 2}")]
+    assert reported(df, f"effects[0].effect_commands[{command_index + 1}].d") == [(WARNING, f"There is no technology {len(df.techs) + 3}")]
+    ensure_valid(df)
+
+
+def test_negative_costs_are_warnings(df):
+    unit = creatable_units(df)[0]
+    unit.creatable.resource_costs = (ResourceCost(resources.WOOD, -10, 1), ResourceCost(resources.NULL, -1, 0), ResourceCost(resources.POPULATION_HEADROOM, 1, 0))
+    df.techs[5].resource_costs = (ResearchResourceCost(resources.FOOD, -5, 1), ResearchResourceCost(-1, 0, 0), ResearchResourceCost(-1, 0, 0))
+    # A negative amount of no resource is how empty slots are often filled
+    assert reported(df, f"{unit_location(df, unit)}.creatable.resource_costs[0].amount") == [(WARNING, "Costs a negative amount (-10)")]
+    assert reported(df, f"{unit_location(df, unit)}.creatable.resource_costs[1].amount") == []
+    assert reported(df, "techs[5].resource_costs[0].amount") == [(WARNING, "Costs a negative amount (-5)")]
+    ensure_valid(df)
+
+
+def test_units_costing_three_resources_are_warnings(df):
+    unit = creatable_units(df)[0]
+    unit.creatable.resource_costs = (ResourceCost(resources.FOOD, 10, 1), ResourceCost(resources.WOOD, 10, 1), ResourceCost(resources.GOLD, 10, 1))
+    assert reported(df, f"{unit_location(df, unit)}.creatable.resource_costs") == [(WARNING, "Only buildings can cost more than two resources")]
+
+
+def test_unresearchable_techs_are_warnings(df):
+    df.techs[5].required_techs = (1, -1, -1, -1, -1, -1)
+    df.techs[5].required_tech_count = 2
+    assert reported(df, "techs[5].required_tech_count") == [(WARNING, "Needs 2 of only 1 required technologies, so it can never be researched")]
+
+
+# Two technologies of every civ in the same building on a button nothing else uses
+def share_button(df, tech_id: int, other_id: int, button: int = 200):
+    for tech in (df.techs[tech_id], df.techs[other_id]):
+        tech.research_location = 0
+        tech.button_id = button
+        tech.civ = -1
+        tech.required_techs = (-1, -1, -1, -1, -1, -1)
+        tech.required_tech_count = 0
+
+
+def test_techs_sharing_a_button_are_warnings(df):
+    share_button(df, 5, 6)
+    assert reported(df, "techs[6].button_id") == [(WARNING, "Uses button 200 in building 0, like technology 5")]
+    assert reported(df, "techs[5].button_id") == []
+
+
+def test_techs_requiring_each_other_can_share_a_button(df):
+    share_button(df, 5, 6)
+    df.techs[7].required_techs = (5, -1, -1, -1, -1, -1)
+    df.techs[6].required_techs = (7, -1, -1, -1, -1, -1)
+    df.techs[6].required_tech_count = 1
+    assert reported(df, "techs[6].button_id") == []
+
+
+def test_techs_of_different_civs_can_share_a_button(df):
+    share_button(df, 5, 6)
+    df.techs[5].civ = 1
+    df.techs[6].civ = 2
+    assert reported(df, "techs[6].button_id") == []
+
+
+def test_techs_excluding_each_other_can_share_a_button(df):
+    share_button(df, 5, 6)
+    df.effects.append(Effect(name="Disable the other", effect_commands=[EffectCommand(command_types.DISABLE_TECH, -1, -1, -1, 6)]))
+    df.techs[5].effect_id = len(df.effects) - 1
+    assert reported(df, "techs[6].button_id") == []
+
+
+def test_units_sharing_a_button_are_warnings(df):
+    unit, other = creatable_units(df)
+    for shared in (unit, other):
+        shared.enabled = 1
+        shared.creatable.train_location_id = 0
+        shared.creatable.button_id = 120
+    assert reported(df, f"{unit_location(df, other)}.creatable.button_id") == [(WARNING, f"Uses button 120 in building 0, like unit {unit_id(df, unit)}")]
+    # Units that aren't available from the start are usually enabled by a technology that disables the other one
+    other.enabled = 0
+    assert reported(df, f"{unit_location(df, other)}.creatable.button_id") == []
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from tools import warmup
+
+
+def change(base_file, content: bytes):
+    mtime_ns = base_file.stat().st_mtime_ns if base_file.exists() else 0
+    base_file.write_bytes(content)
+    os.utime(base_file, ns=(mtime_ns + 1_000_000_000, mtime_ns + 1_000_000_000))
+
+
+# Watch the file, doing the next of `steps` to it instead of sleeping between polls, and return the contents it was warmed up with
+def run_watch(base_file, steps, fail: bool = False) -> list[bytes]:
+    warmed = []
+    pending = list(steps)
+
+    def warm(input_file):
+        warmed.append(input_file.read_bytes())
+        if fail:
+            raise ValueError("Warming up failed")
+
+    def sleep(seconds):
+        assert seconds == 0.5
+        if not pending:
+            raise KeyboardInterrupt
+        step = pending.pop(0)
+        if step is not None:
+            step()
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(warmup.time, "sleep", sleep)
+        warmup.watch(base_file, warm, 0.5)
+    return warmed
+
+
+def test_unchanged_file_is_warmed_up_once(tmp_path, capsys):
+    base_file = tmp_path / "base_game.dat"
+    change(base_file, b"first")
+    assert run_watch(base_file, [None, None, None]) == [b"first"]
+    assert "Stopped watching" in capsys.readouterr().out
+
+
+def test_file_is_warmed_up_once_it_stops_changing(tmp_path):
+    base_file = tmp_path / "base_game.dat"
+    change(base_file, b"first")
+    # Copying the new file takes two polls, it is only warmed up after it stayed the same for a whole poll
+    steps = [lambda: change(base_file, b"sec"), lambda: change(base_file, b"second"), None, None]
+    assert run_watch(base_file, steps) == [b"first", b"second"]
+
+
+def test_file_is_warmed_up_once_it_appears(tmp_path):
+    base_file = tmp_path / "base_game.dat"
+    assert run_watch(base_file, [None, lambda: change(base_file, b"first"), None, None]) == [b"first"]
+
+
+def test_failed_warm_up_is_tried_again_once_the_file_changes(tmp_path, capsys):
+    base_file = tmp_path / "base_game.dat"
+    change(base_file, b"first")
+    assert run_watch(base_file, [None, lambda: change(base_file, b"second"), None, None], fail=True) == [b"first", b"second"]
+    assert "trying again once it changes" in capsys.readouterr().out
@@ -0,0 +1,3 @@
+from . import cache, hashing, parallel, batch, diff, tracking, lazy, mapped, validate, synthetic, profiling, snapshot, locking, warmup, server
+
+__all__ = ["cache", "hashing", "parallel", "batch", "diff", "tracking", "lazy", "mapped", "validate", "synthetic", "profiling", "snapshot", "locking", "warmup", "server"]
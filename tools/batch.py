@@ -0,0 +1,109 @@
+import importlib
+import json
+import multiprocessing
+import traceback
+from multiprocessing.connection import wait
+from pathlib import Path
+
+from genieutils.datfile import DatFile
+
+from mods import helpers
+from tools import tracking, validate
+from tools.parallel import apply_per_civ
+
+NAME = "batch"
+
+# A batch manifest is a JSON file describing every variant to build from the same base data:
+# {
+#     "variants": [
+#         {
+#             "output": "datfiles/variants/slow_ages.dat",
+#             "mods": ["custom_modifications", {"module": "age_diplomacy", "params": {"research_multiplier": 1.5}}]
+#         }
+#     ]
+# }
+# Every mod is a module in the mods folder, applied by calling its run_<NAME> function with the DatFile and the params as keyword arguments
+# followed by its PER_CIV_MODIFICATIONS, just like create_mod.py does
+# A variant with errors isn't saved (see tools/validate.py), unless it has "validate": false
+# "compression_level" sets the zlib compression level of the saved file, e.g. 1 for quick test builds, see tools/tracking.py
+
+
+def load_manifest(manifest_file: Path) -> list[dict]:
+    manifest = json.loads(Path(manifest_file).read_text())
+    return [normalize_variant(variant, f"Variant {variant_index} in {manifest_file}") for variant_index, variant in enumerate(manifest["variants"])]
+
+
+# Fill in the defaults of a variant, which is also the format of a build request to the build server, see tools/server.py
+def normalize_variant(variant: dict, description: str = "The variant") -> dict:
+    if "output" not in variant or "mods" not in variant:
+        raise ValueError(f"{description} needs both an 'output' and a 'mods' entry")
+    variant["mods"] = [{"module": mod, "params": {}} if isinstance(mod, str) else {"params": {}, **mod} for mod in variant["mods"]]
+    variant.setdefault("validate", True)
+    variant.setdefault("compression_level", tracking.DEFAULT_COMPRESSION_LEVEL)
+    if variant["compression_level"] not in tracking.COMPRESSION_LEVELS:
+        raise ValueError(f"{description} has compression level {variant['compression_level']}, expected one of -1 to 9")
+    return variant
+
+
+def apply_mod(df: DatFile, module_name: str, params: dict):
+    module = importlib.import_module(f"mods.{module_name}")
+    run = getattr(module, f"run_{module.NAME}")
+    tracking.mark_module(df, module)
+    run(df, **params)
+    apply_per_civ(df, getattr(module, "PER_CIV_MODIFICATIONS", []))
+
+
+def build_variant(df: DatFile, variant: dict):
+    for mod in variant["mods"]:
+        apply_mod(df, mod["module"], mod["params"])
+    if variant["validate"]:
+        validate.ensure_valid(df)
+    output = Path(variant["output"])
+    output.parent.mkdir(exist_ok=True, parents=True)
+    tracking.save(df, output, variant["compression_level"])
+
+
+# Build every variant from the same parsed base data and return the outputs that failed
+# With fork every variant runs in its own child process, which starts from a copy-on-write copy of the base data,
+# so the base is parsed once and never copied up front. Up to `jobs` variants are built at the same time
+# Without fork the variants are built one after another, each on a copy of the base data
+def run_batch(df: DatFile, variants: list[dict], jobs: int = 1) -> list[str]:
+    failed = []
+    if "fork" not in multiprocessing.get_all_start_methods():
+        for variant in variants:
+            print(f"Building {variant['output']}")
+            try:
+                build_variant(helpers.fast_copy(df), variant)
+            except Exception:
+                traceback.print_exc()
+                failed.append(variant["output"])
+        return failed
+
+    context = multiprocessing.get_context("fork")
+    pending = list(variants)
+    running: list[tuple[multiprocessing.Process, dict]] = []
+    while pending or running:
+        while pending and len(running) < max(jobs, 1):
+            variant = pending.pop(0)
+            print(f"Building {variant['output']}")
+            process = context.Process(target=_build_variant_in_child, args=(df, variant))
+            process.start()
+            running.append((process, variant))
+        # Block until at least one child is done, then collect every finished child
+        wait([process.sentinel for process, _ in running])
+        for process, variant in list(running):
+            if process.is_alive():
+                continue
+            process.join()
+            running.remove((process, variant))
+            if process.exitcode != 0:
+                failed.append(variant["output"])
+    return failed
+
+
+def _build_variant_in_child(df: DatFile, variant: dict):
+    try:
+        build_variant(df, variant)
+    except Exception:
+        traceback.print_exc()
+        raise SystemExit(1)
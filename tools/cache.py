@@ -0,0 +1,200 @@
+import contextlib
+import hashlib
+import os
+import mmap
+import tempfile
+import time
+from importlib import metadata
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable
+
+from genieutils.datfile import DatFile
+
+from tools import snapshot
+from tools.locking import FileLock
+
+NAME = "cache"
+
+# Bump this whenever the layout of what we store in the cache changes, so that old entries are ignored instead of loaded
+CACHE_SCHEMA_VERSION = 4
+
+# The cache directory can be moved with the AOE2_CACHE_DIR environment variable or the --cache-dir option of create_mod.py
+DEFAULT_CACHE_DIR = Path(os.environ.get("AOE2_CACHE_DIR", "/tmp/aoe2"))
+DEFAULT_MAX_CACHE_BYTES = 2 * 1024 * 1024 * 1024  # 2 GiB
+
+# Every cache entry starts with this header followed by the SHA-256 digest of the payload
+# That way a truncated or otherwise damaged file is detected before it is decoded
+# The payload is a snapshot, see tools/snapshot.py, which loads several times faster than a pickle of the same data
+ENTRY_MAGIC = b"AOE2CACHE\x00"
+ENTRY_DIGEST_SIZE = 32
+ENTRY_SUFFIX = ".snapshot"
+# Entries of older versions of the cache, which are evicted like any other entry
+LEGACY_SUFFIXES = [".pickle"]
+# Temporary files of write_atomic older than this were left behind by a process that got killed while writing, eviction removes them
+STALE_TEMP_SECONDS = 60 * 60
+
+
+# Cached objects are only valid for the genieutils-py version that created them
+# A library upgrade can change the classes and fields that were stored, so the version is part of every cache key
+def get_genieutils_version() -> str:
+    try:
+        return metadata.version("genieutils-py")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+# Build the cache key of a parsed dat file out of its content hash, the genieutils-py version and our own schema version
+def make_cache_key(file_hash: str) -> str:
+    return f"{file_hash}-genieutils{get_genieutils_version()}-schema{CACHE_SCHEMA_VERSION}"
+
+
+# Several builds can share a cache directory, e.g. on a CI runner:
+#   - entries are written with write_atomic, so a reader never sees a partially written entry, and a damaged one fails its checksum
+#   - load_or_create lets only one process create a missing entry, the others wait for it and load what it stored, see locked()
+#   - an entry evicted or replaced by another process while it is being read is either still readable (it was memory-mapped) or treated as missing
+
+
+# Write into a temporary file next to the target and rename it into place
+# Readers therefore either see the complete old file, the complete new file or nothing at all
+# The content can also be given as chunks, which are written one after another
+def write_atomic(target: Path, content: bytes | Iterable[bytes | memoryview]):
+    fd, tmp_name = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in [content] if isinstance(content, bytes) else content:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, target)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+class DatCache:
+    def __init__(self, cache_dir: Path = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_CACHE_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}{ENTRY_SUFFIX}"
+
+    # A lock shared by every process using this cache directory, for whoever is about to create the entry for this key
+    def lock(self, key: str) -> FileLock:
+        return FileLock(self.cache_dir / f"{key}.lock")
+
+    # Hold the lock of this key, waiting for the process holding it if there is one
+    @contextlib.contextmanager
+    def locked(self, key: str):
+        lock = self.lock(key)
+        if not lock.acquire(blocking=False):
+            print("Waiting for another process that is creating the same cache entry...")
+            lock.acquire()
+        try:
+            yield
+        finally:
+            lock.release()
+
+    # Return the cached object for this key, creating and storing it first if there is no usable entry
+    # Only one process at a time creates the entry of a key. The others wait for it and load what it stored instead of creating it as well
+    def load_or_create(self, key: str, create: Callable[[], object]):
+        if self.entry_path(key).is_file():
+            data = self.load(key)
+            if data is not None:
+                return data
+        with self.locked(key):
+            # Created by another process while we were waiting for the lock
+            data = self.load(key) if self.entry_path(key).is_file() else None
+            if data is None:
+                data = create()
+                self.store(key, data)
+        return data
+
+    # Return the cached object for this key, or None if there is no usable entry
+    # Corrupt entries are deleted so that the caller re-parses and writes a fresh one
+    def load(self, key: str) -> DatFile | None:
+        entry = self.entry_path(key)
+        try:
+            with open(entry, "rb") as f:
+                try:
+                    data = self._read_entry(f)
+                except Exception as e:
+                    print(f"Cache file {entry} is unusable ({e}), discarding it")
+                    self._discard(entry, os.fstat(f.fileno()))
+                    return None
+            # Refresh the modification time so that eviction treats this entry as recently used
+            os.utime(entry)
+        except FileNotFoundError:
+            # Possibly evicted by another process after it was looked up
+            print("Cache file does not exist")
+            return None
+        return data
+
+    def store(self, key: str, data: DatFile):
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+        entry = self.entry_path(key)
+        payload = snapshot.encode(data)
+        digest = hashlib.sha256()
+        for chunk in payload:
+            digest.update(chunk)
+        write_atomic(entry, [ENTRY_MAGIC, digest.digest(), *payload])
+        self.evict(keep=entry)
+
+    # Remove the least recently used entries until the cache fits into max_bytes
+    # The entry that was just written is never evicted, even if it is larger than the limit on its own
+    def evict(self, keep: Path | None = None):
+        self._remove_stale_temp_files()
+        entries = []
+        for suffix in [ENTRY_SUFFIX, *LEGACY_SUFFIXES]:
+            for entry in self.cache_dir.glob(f"*{suffix}"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            print(f"Evicting old cache file {entry.name}")
+            try:
+                entry.unlink(missing_ok=True)
+            except PermissionError:
+                # On Windows a file another process has open can't be removed, it is evicted next time instead
+                continue
+            total_size -= size
+
+    def _remove_stale_temp_files(self):
+        now = time.time()
+        for temp_file in self.cache_dir.glob(".*.tmp"):
+            try:
+                if now - temp_file.stat().st_mtime > STALE_TEMP_SECONDS:
+                    temp_file.unlink()
+            except OSError:
+                continue
+
+    # Only remove the damaged entry if it is still the file we read, another process may have replaced it with a fresh one in the meantime
+    def _discard(self, entry: Path, read_stat: os.stat_result):
+        try:
+            if os.path.samestat(os.stat(entry), read_stat):
+                entry.unlink()
+        except OSError:
+            pass
+
+    # The entry is memory-mapped instead of read, so the payload is checked and decoded without ever copying it
+    def _read_entry(self, f: BinaryIO):
+        header_size = len(ENTRY_MAGIC) + ENTRY_DIGEST_SIZE
+        if f.seek(0, 2) < header_size:
+            raise ValueError("missing cache header")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content, memoryview(content) as view:
+            if view[: len(ENTRY_MAGIC)] != ENTRY_MAGIC:
+                raise ValueError("missing cache header")
+            payload = view[header_size:]
+            try:
+                if hashlib.sha256(payload).digest() != view[len(ENTRY_MAGIC) : header_size]:
+                    raise ValueError("checksum mismatch")
+                return snapshot.decode(payload)
+            finally:
+                payload.release()
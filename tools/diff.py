@@ -0,0 +1,179 @@
+import dataclasses
+import json
+import math
+from pathlib import Path
+
+from genieutils.common import GenieClass
+from genieutils.datfile import DatFile
+
+from mods.compact import CompactArray, plain_type
+from tools import tracking
+from tools.cache import get_genieutils_version
+
+NAME = "diff"
+
+PATCH_FORMAT = "genieutils-examples-patch"
+PATCH_VERSION = 1
+
+# A patch is a JSON document holding a list of operations, each of them [operation, path, value]
+# The path is a list of attribute names and list indexes starting at the DatFile, e.g. ["civs", 1, "units", 83, "hit_points"]
+#   ["set", path, value]       replaces the value at the path
+#   ["extend", path, values]   appends the values to the list at the path
+#   ["truncate", path, length] shortens the list at the path to the given length
+# genieutils objects are written as {"__class__": "genieutils.unit.AttackOrArmor", "fields": {...}} and tuples as {"__tuple__": [...]}
+#
+# Patches are meant to be shared, so applying one must never do more than changing the DatFile:
+# only genieutils classes can be created (see patch_classes()) and paths may only go through the fields of genieutils objects
+
+
+# Compare two DatFiles and return the operations that turn `base` into `modified`
+# Only the given top-level sections are compared, by default all of them
+def diff_datfiles(base: DatFile, modified: DatFile, sections: list[str] | None = None) -> list[list]:
+    operations = []
+    for section in sections or [field.name for field in dataclasses.fields(DatFile)]:
+        _diff(getattr(base, section), getattr(modified, section), [section], operations)
+    return operations
+
+
+def apply_patch(df: DatFile, operations: list[list]):
+    for operation, path, value in operations:
+        if not path:
+            raise ValueError(f"Patch operation {operation} has an empty path")
+        parent = df
+        for element in path[:-1]:
+            parent = _child(parent, element)
+        last = path[-1]
+        # Checked before marking, which looks the path up as well
+        _child(parent, last)
+        _mark(df, path)
+        if operation == "set":
+            if isinstance(last, int):
+                parent[last] = decode(value)
+            else:
+                setattr(parent, last, decode(value))
+            continue
+        target = _child(parent, last)
+        if operation == "extend":
+            target.extend(decode(item) for item in value)
+        elif operation == "truncate":
+            del target[value:]
+        else:
+            raise ValueError(f"Unknown patch operation {operation}")
+
+
+def write_patch(patch_file: Path, operations: list[list], base_hash: str = ""):
+    patch = {
+        "format": PATCH_FORMAT,
+        "version": PATCH_VERSION,
+        "genieutils": get_genieutils_version(),
+        "base_hash": base_hash,
+        "operations": operations,
+    }
+    Path(patch_file).write_text(json.dumps(patch, separators=(",", ":")))
+
+
+# Read a patch file and return its operations
+# If base_hash is given, the patch must have been made against the same base file
+def read_patch(patch_file: Path, base_hash: str = "") -> list[list]:
+    patch = json.loads(Path(patch_file).read_text())
+    if patch.get("format") != PATCH_FORMAT or patch.get("version") != PATCH_VERSION:
+        raise ValueError(f"{patch_file} is not a version {PATCH_VERSION} patch")
+    if base_hash and patch["base_hash"] and patch["base_hash"] != base_hash:
+        raise ValueError(f"{patch_file} was made for a different base file")
+    return patch["operations"]
+
+
+def encode(value):
+    if isinstance(value, GenieClass):
+        cls = plain_type(value)
+        fields = {field.name: encode(getattr(value, field.name)) for field in dataclasses.fields(cls)}
+        return {"__class__": f"{cls.__module__}.{cls.__qualname__}", "fields": fields}
+    if isinstance(value, tuple):
+        return {"__tuple__": [encode(item) for item in value]}
+    if isinstance(value, (list, CompactArray)):
+        return [encode(item) for item in value]
+    return value
+
+
+def decode(value):
+    if isinstance(value, dict):
+        if "__tuple__" in value:
+            return tuple(decode(item) for item in value["__tuple__"])
+        cls = patch_classes().get(value.get("__class__"))
+        if cls is None:
+            raise ValueError(f"Patch contains {value.get('__class__')!r}, which isn't a genieutils class")
+        fields = value.get("fields", {})
+        unknown = set(fields) - {field.name for field in dataclasses.fields(cls)}
+        if unknown:
+            raise ValueError(f"Patch gives {cls.__name__} fields it doesn't have: {', '.join(sorted(unknown))}")
+        return cls(**{name: decode(field) for name, field in fields.items()})
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+_patch_classes: dict[str, type] = {}
+
+
+# The classes a patch can create by name: every GenieClass defined by genieutils itself
+# They are all imported together with DatFile, so nothing is imported while a patch is read
+def patch_classes() -> dict[str, type]:
+    if not _patch_classes:
+        pending = [GenieClass]
+        while pending:
+            cls = pending.pop()
+            pending.extend(cls.__subclasses__())
+            if cls.__module__.startswith("genieutils.") and dataclasses.is_dataclass(cls):
+                _patch_classes[f"{cls.__module__}.{cls.__qualname__}"] = cls
+    return _patch_classes
+
+
+# The element of a list, or the field of a genieutils object, at one step of a patch path
+def _child(value, element):
+    if isinstance(element, int) and not isinstance(element, bool):
+        return value[element]
+    if not isinstance(element, str) or not dataclasses.is_dataclass(value) or element not in {field.name for field in dataclasses.fields(value)}:
+        raise ValueError(f"Patch path goes through {element!r}, which isn't a field of {type(value).__name__}")
+    return getattr(value, element)
+
+
+# Tell tools/tracking.py which part of the DatFile a patch operation changes, as precisely as the path allows
+def _mark(df: DatFile, path: list):
+    if path[0] != "civs" or len(path) < 2:
+        tracking.mark_sections(df, path[0])
+    elif len(path) >= 4 and path[2] == "units":
+        tracking.mark_units(df, [df.civs[path[1]].units[path[3]]])
+    else:
+        tracking.mark_civ(df, path[1])
+
+
+def _same(old, new) -> bool:
+    if old is new:
+        return True
+    if isinstance(old, float) and isinstance(new, float) and math.isnan(old) and math.isnan(new):
+        return True
+    # genieutils objects are dataclasses, so == compares all of their fields at once
+    # That is a lot cheaper than walking them ourselves, so we only walk into the parts that actually changed
+    # Compact arrays and interned costs (see mods/compact.py) are compared like the lists and objects they stand in for
+    return plain_type(old) is plain_type(new) and old == new
+
+
+def _diff(old, new, path: list, operations: list[list]):
+    if _same(old, new):
+        return
+    if plain_type(old) is not plain_type(new):
+        operations.append(["set", path, encode(new)])
+    elif isinstance(old, GenieClass):
+        for field in dataclasses.fields(old):
+            _diff(getattr(old, field.name), getattr(new, field.name), path + [field.name], operations)
+    elif plain_type(old) is list:
+        for index in range(min(len(old), len(new))):
+            _diff(old[index], new[index], path + [index], operations)
+        if len(new) > len(old):
+            operations.append(["extend", path, [encode(item) for item in new[len(old) :]]])
+        elif len(new) < len(old):
+            operations.append(["truncate", path, len(new)])
+    else:
+        # Tuples are always replaced as a whole. They are short, and the objects inside them are often shared
+        # between several slots (e.g. one empty ResourceCost used three times), so changing them in place could change more than one slot
+        operations.append(["set", path, encode(new)])
@@ -0,0 +1,126 @@
+import ast
+import hashlib
+import importlib.util
+import json
+import zlib
+from pathlib import Path
+
+from tools.cache import write_atomic
+from tools.locking import FileLock
+
+NAME = "hashing"
+
+HASH_ALGORITHMS = ["sha256", "fast"]
+MANIFEST_NAME = "file_hashes.json"
+CHUNK_SIZE = 1024 * 1024
+
+
+# Hash the full content of a file
+# "sha256" is the safe default, "fast" combines CRC-32 and Adler-32 with the file size which is several times quicker but not collision resistant
+def hash_file(input_file: Path, algorithm: str = "sha256") -> str:
+    if algorithm == "sha256":
+        with input_file.open("rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+    if algorithm == "fast":
+        crc = 0
+        adler = 1
+        size = 0
+        with input_file.open("rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                crc = zlib.crc32(chunk, crc)
+                adler = zlib.adler32(chunk, adler)
+                size += len(chunk)
+        # Prefix the algorithm so that a fast hash can never be mistaken for a sha256 one in the cache
+        return f"fast{crc:08x}{adler:08x}{size:x}"
+    raise ValueError(f"Unknown hash algorithm {algorithm}")
+
+
+# Remembers the hash of every file we have seen together with its size, modification time and inode
+# As long as none of those changed, the file is assumed to be unchanged and its hash is returned without reading it again
+class HashManifest:
+    def __init__(self, manifest_file: Path):
+        self.manifest_file = Path(manifest_file)
+        self.entries: dict[str, dict] = self._read()
+
+    def get_hash(self, input_file: Path, algorithm: str = "sha256") -> str:
+        path = str(Path(input_file).resolve())
+        stat = input_file.stat()
+        fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino, "algorithm": algorithm}
+        entry = self.entries.get(path)
+        if entry is not None and all(entry.get(field) == value for field, value in fingerprint.items()):
+            return entry["hash"]
+
+        file_hash = hash_file(input_file, algorithm)
+        self.entries[path] = {**fingerprint, "hash": file_hash}
+        self.save()
+        return file_hash
+
+    # Builds sharing the cache directory may have hashed other files since we read the manifest, so their entries are merged in rather than overwritten
+    def save(self):
+        self.manifest_file.parent.mkdir(exist_ok=True, parents=True)
+        with FileLock(self.manifest_file.with_name(f"{self.manifest_file.name}.lock")):
+            self.entries = {**self._read(), **self.entries}
+            write_atomic(self.manifest_file, json.dumps(self.entries, indent=2).encode())
+
+    def _read(self) -> dict[str, dict]:
+        if not self.manifest_file.is_file():
+            return {}
+        try:
+            return json.loads(self.manifest_file.read_text())
+        except ValueError:
+            print(f"Hash manifest {self.manifest_file} is unreadable, starting a new one")
+            return {}
+
+
+# Hash the source of the given modules and of every module of the project under root they import, directly or through other modules
+# Imports are read from the source, so imports inside functions count as well. Modules outside of root, like genieutils, are left out
+def hash_sources(module_names: list[str], root: Path) -> str:
+    digest = hashlib.sha256()
+    root = Path(root).resolve()
+    for source_file in get_source_files(module_names, root):
+        digest.update(source_file.relative_to(root).as_posix().encode())
+        digest.update(source_file.read_bytes())
+    return digest.hexdigest()
+
+
+def get_source_files(module_names: list[str], root: Path) -> list[Path]:
+    root = Path(root).resolve()
+    source_files = {}
+    pending = list(module_names)
+    while pending:
+        module_name = pending.pop()
+        if module_name in source_files:
+            continue
+        spec = _find_spec(module_name)
+        source_file = Path(spec.origin).resolve() if spec is not None and spec.has_location and spec.origin.endswith(".py") else None
+        if source_file is None or not source_file.is_relative_to(root):
+            source_files[module_name] = None
+            continue
+        source_files[module_name] = source_file
+        pending.extend(_imported_modules(source_file, module_name, spec.submodule_search_locations is not None))
+    return sorted({source_file for source_file in source_files.values() if source_file is not None})
+
+
+# The modules a source file imports
+# `from package import name` imports the submodule package.name if there is one, otherwise only the package itself
+def _imported_modules(source_file: Path, module_name: str, is_package: bool) -> list[str]:
+    package = module_name if is_package else module_name.rpartition(".")[0]
+    imported = []
+    for node in ast.walk(ast.parse(source_file.read_bytes(), str(source_file))):
+        if isinstance(node, ast.Import):
+            imported.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                parent = package.rsplit(".", node.level - 1)[0] if node.level > 1 else package
+                base = f"{parent}.{base}" if base else parent
+            for alias in node.names:
+                imported.append(f"{base}.{alias.name}" if alias.name != "*" and _find_spec(f"{base}.{alias.name}") is not None else base)
+    return imported
+
+
+def _find_spec(module_name: str):
+    try:
+        return importlib.util.find_spec(module_name)
+    except (ImportError, ValueError):
+        return None
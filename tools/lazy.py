@@ -0,0 +1,167 @@
+from os import PathLike
+from pathlib import Path
+
+from genieutils.civ import Civ
+from genieutils.common import ByteHandler
+from genieutils.datfile import DatFile
+from genieutils.unit import Unit
+from genieutils.versions import Version
+
+from tools.mapped import open_uncompressed
+from tools.tracking import SECTIONS, DatLayout, get_values, read_civ_header, read_civ_units, read_section
+
+NAME = "lazy"
+
+# Most mods never look at the graphics, sounds or terrains, yet parsing decodes all of them and keeps them in memory
+# A lazily loaded DatFile only decodes a section the first time it is used, and the units of a civ the first time civ.units is used
+# Together with tools/tracking.py, sections that were never used are copied from the base file when saving without ever being decoded
+#
+# Finding the sections without decoding everything before them needs the layout of the base file, see tracking.parse_with_layout
+# The effects, techs and civs (apart from their units) are small and used by nearly every mod, so they are decoded right away
+LAZY_SECTIONS = ["terrain_restrictions", "player_colours", "sounds", "graphics", "terrain_block", "random_maps", "unit_headers", "tech_tree"]
+
+
+# Load the base file lazily, using a layout made by tracking.parse_with_layout for the same file
+# With a scratch_dir the sections are decoded from a memory-mapped copy of the uncompressed file, see tools/mapped.py
+def load_lazy(input_file: Path | PathLike | str, layout: DatLayout, scratch_dir: Path | None = None) -> DatFile:
+    data = open_uncompressed(input_file, scratch_dir)
+    df = LazyDatFile.__new__(LazyDatFile)
+    df._data = data
+    df._layout = layout
+    df._originals = {}
+    df._original_values = {}
+    content = ByteHandler(data)
+    for section in SECTIONS:
+        if section in LAZY_SECTIONS:
+            continue
+        content.offset = layout.sections[section][0]
+        if section == "civs":
+            df.civs = [_read_lazy_civ(content, data, layout.unit_ranges[civ_id]) for civ_id in range(content.read_int_16())]
+            continue
+        for field, value in read_section(content, section).items():
+            setattr(df, field, value)
+    return df
+
+
+class LazyDatFile(DatFile):
+    __slots__ = ("_data", "_layout", "_originals", "_original_values")
+
+    def is_loaded(self, field: str) -> bool:
+        try:
+            DatFile.__dict__[field].__get__(self, DatFile)
+        except AttributeError:
+            return False
+        return True
+
+    # The value of a lazily loaded field right after it was decoded, together with its length if it is a list
+    def original_shape(self, field: str) -> tuple[object, int]:
+        return self._originals[field]
+
+    # The values of a lazily loaded field right after it was decoded, see tracking.get_values
+    def original_values(self, field: str):
+        return self._original_values[field]
+
+    # Copies and pickles are plain DatFiles, which decodes every section that wasn't decoded yet
+    def __reduce__(self):
+        return DatFile, tuple(getattr(self, field) for field in DatFile.__dataclass_fields__)
+
+    # Equal to a regular DatFile with the same values, which the dataclass == doesn't allow for because the classes differ
+    def __eq__(self, other):
+        return _equal_fields(self, other, DatFile)
+
+    def _load(self, section: str):
+        content = ByteHandler(self._data)
+        content.version = Version(self.version)
+        content.offset = self._layout.sections[section][0]
+        for field, value in read_section(content, section).items():
+            DatFile.__dict__[field].__set__(self, value)
+            self._originals[field] = (value, len(value) if isinstance(value, list) else -1)
+            self._original_values[field] = get_values(value)
+
+
+class LazyCiv(Civ):
+    __slots__ = ("_data", "_units_range", "_units_size", "_version", "_original_units", "_original_values")
+
+    def is_loaded(self, field: str) -> bool:
+        try:
+            Civ.__dict__[field].__get__(self, Civ)
+        except AttributeError:
+            return False
+        return True
+
+    # The units of this civ right after they were decoded
+    def original_units(self) -> list[Unit | None]:
+        return self._original_units
+
+    # The values of the units of this civ right after they were decoded, see tracking.get_values
+    def original_values(self) -> list[tuple | None]:
+        return self._original_values
+
+    # The number of unit slots of this civ, without decoding its units
+    def units_size(self) -> int:
+        return len(self.units) if self.is_loaded("units") else self._units_size
+
+    # The encoded units of this civ, starting with their count and pointers
+    def raw_units(self) -> memoryview:
+        start, end = self._units_range
+        return self._data[start:end]
+
+    def __reduce__(self):
+        return Civ, tuple(getattr(self, field) for field in Civ.__dataclass_fields__)
+
+    def __eq__(self, other):
+        return _equal_fields(self, other, Civ)
+
+    def _load(self, section: str):
+        content = ByteHandler(self._data)
+        content.version = self._version
+        content.offset = self._units_range[0]
+        units, _ = read_civ_units(content)
+        Civ.__dict__["units"].__set__(self, units)
+        self._original_units = list(units)
+        self._original_values = get_values(units)
+
+
+# A property that decodes its section on first use. Setting it works the same as for a regular DatFile or Civ
+def _lazy_field(cls: type, field: str, section: str) -> property:
+    slot = cls.__dict__[field]
+
+    def get(self):
+        try:
+            return slot.__get__(self, cls)
+        except AttributeError:
+            self._load(section)
+            return slot.__get__(self, cls)
+
+    def set(self, value):
+        slot.__set__(self, value)
+
+    return property(get, set)
+
+
+for _section in LAZY_SECTIONS:
+    for _field in SECTIONS[_section]:
+        setattr(LazyDatFile, _field, _lazy_field(DatFile, _field, _section))
+LazyCiv.units = _lazy_field(Civ, "units", "units")
+
+
+def _equal_fields(value, other, cls: type) -> bool:
+    if not isinstance(other, cls):
+        return NotImplemented
+    return all(getattr(value, field) == getattr(other, field) for field in cls.__dataclass_fields__)
+
+
+def _read_lazy_civ(content: ByteHandler, data: memoryview, unit_ranges: list[tuple[int, int] | None]) -> LazyCiv:
+    civ = LazyCiv.__new__(LazyCiv)
+    for field, value in read_civ_header(content).items():
+        setattr(civ, field, value)
+    units_start = content.offset
+    units_size = content.read_int_16()
+    # The units end where the last unit ends, or right after the pointers if the civ has no units at all
+    units_end = max((unit_range[1] for unit_range in unit_ranges if unit_range), default=units_start + 2 + 4 * units_size)
+    content.offset = units_end
+    civ._data = data
+    civ._units_range = (units_start, units_end)
+    civ._units_size = units_size
+    civ._version = content.version
+    return civ
@@ -0,0 +1,85 @@
+import os
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl, msvcrt locks a byte of the file instead
+    fcntl = None
+    import msvcrt
+
+NAME = "locking"
+
+# How often a blocking lock is retried on Windows, where locking can't wait by itself
+WINDOWS_RETRY_SECONDS = 0.1
+
+
+# An exclusive lock on a file, shared by all processes on the same host
+# The operating system releases it when the process holding it exits, so a build that crashed never leaves a stale lock behind
+# The lock file itself is kept around, removing it while another process waits for it would let a third one lock a new file with the same name
+class FileLock:
+    def __init__(self, lock_file: Path):
+        self.lock_file = Path(lock_file)
+        self._fd: int | None = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if self._fd is not None:
+            raise RuntimeError(f"{self.lock_file} is already locked by this process")
+        self.lock_file.parent.mkdir(exist_ok=True, parents=True)
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            locked = _lock(fd, blocking)
+        except BaseException:
+            os.close(fd)
+            raise
+        if not locked:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            _unlock(self._fd)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    @property
+    def locked(self) -> bool:
+        return self._fd is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def _lock(fd: int, blocking: bool) -> bool:
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+    while True:
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(WINDOWS_RETRY_SECONDS)
+
+
+def _unlock(fd: int):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
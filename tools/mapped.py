@@ -0,0 +1,65 @@
+import hashlib
+import mmap
+import zlib
+from os import PathLike
+from pathlib import Path
+
+from tools.cache import write_atomic
+
+NAME = "mapped"
+
+SCRATCH_PREFIX = "uncompressed-"
+CHUNK_SIZE = 1024 * 1024
+
+# Decompressing the base dat file into a bytes object gives every build its own copy of the whole uncompressed file
+# Instead, it is decompressed once into a scratch file which is then memory-mapped
+# Every build reading the same base file shares the pages of that mapping, and only the parts that are actually read get loaded at all
+# Slices of the returned memoryview don't copy anything either, so unchanged sections go from the mapping straight into the compressor when saving
+
+
+# Return the uncompressed content of a dat file, memory-mapped from a scratch file in scratch_dir if given
+def open_uncompressed(input_file: Path | PathLike | str, scratch_dir: Path | None = None) -> memoryview:
+    if scratch_dir is None:
+        return memoryview(zlib.decompress(Path(input_file).read_bytes(), wbits=-15))
+    return map_uncompressed(input_file, scratch_dir)
+
+
+def map_uncompressed(input_file: Path | PathLike | str, scratch_dir: Path) -> memoryview:
+    input_file = Path(input_file)
+    scratch_file = Path(scratch_dir) / f"{SCRATCH_PREFIX}{get_scratch_key(input_file)}.dat"
+    if not scratch_file.is_file():
+        scratch_file.parent.mkdir(exist_ok=True, parents=True)
+        write_atomic(scratch_file, decompress_chunks(input_file))
+        # Only the scratch file of the current base file is kept. Builds still using an older one keep their mapping until they are done
+        for old_scratch_file in scratch_file.parent.glob(f"{SCRATCH_PREFIX}*.dat"):
+            if old_scratch_file == scratch_file:
+                continue
+            try:
+                old_scratch_file.unlink(missing_ok=True)
+            except PermissionError:
+                # On Windows a file another build still has mapped can't be removed, it is removed by the next base file instead
+                continue
+    return map_file(scratch_file)
+
+
+# The scratch file belongs to one version of the base file, recognized the same way as in tools/hashing.py without hashing its content
+def get_scratch_key(input_file: Path) -> str:
+    stat = input_file.stat()
+    return hashlib.sha256(f"{input_file.resolve()}:{stat.st_size}:{stat.st_mtime_ns}:{stat.st_ino}".encode()).hexdigest()
+
+
+# Decompress a dat file a chunk at a time, so that neither the compressed nor the uncompressed file is ever in memory as a whole
+def decompress_chunks(input_file: Path):
+    decompressor = zlib.decompressobj(wbits=-15)
+    with open(input_file, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+# Map a whole file read-only. The mapping stays open for as long as the memoryview (or a slice of it) is used
+def map_file(path: Path) -> memoryview:
+    with open(path, "rb") as f:
+        if f.seek(0, 2) == 0:
+            return memoryview(b"")
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
@@ -0,0 +1,116 @@
+import dataclasses
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable
+
+from genieutils.civ import Civ
+from genieutils.datfile import DatFile
+from genieutils.unit import Unit
+
+from mods import indexes
+from tools import tracking
+
+NAME = "parallel"
+
+EXECUTORS = ["serial", "thread", "process"]
+
+# A per-civ modification receives the civ ID and the civ, changes the civ in place and returns the IDs of the units it changed
+# Only those units are encoded again when saving, see tools/tracking.py. Returning None means that any unit of the civ may have changed,
+# e.g. because units were added or removed, and the whole civ is encoded again
+# It may only touch that one civ, because every civ can be modified by a different process at the same time
+# It has to be a module-level function so that worker processes can find it
+PerCivModification = Callable[[int, Civ], list[int] | None]
+
+# Worker processes started with fork inherit the DatFile from the parent, so only civ IDs have to be sent to them
+_shared_df: DatFile | None = None
+
+
+# Apply every per-civ modification to every civ of the DatFile, in order, using up to `jobs` workers
+# "process" gives real parallelism but has to send the changed units of each civ back to the main process
+# "thread" avoids that copy but only helps when the modifications release the GIL
+# Either way the changes are put back in civ order, so the result is the same as applying them serially
+def apply_per_civ(df: DatFile, modifications: list[PerCivModification], jobs: int = 1, executor: str = "process"):
+    if not modifications:
+        return
+    civ_ids = list(range(len(df.civs)))
+    if jobs <= 1 or executor == "serial" or len(civ_ids) <= 1:
+        for civ_id in civ_ids:
+            _mark(df, civ_id, _apply(modifications, civ_id, df.civs[civ_id]))
+        return
+
+    if executor == "thread":
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            changed_unit_ids = list(pool.map(_apply, [modifications] * len(civ_ids), civ_ids, [df.civs[civ_id] for civ_id in civ_ids]))
+        for civ_id, unit_ids in zip(civ_ids, changed_unit_ids):
+            _mark(df, civ_id, unit_ids)
+        return
+
+    if executor != "process":
+        raise ValueError(f"Unknown executor {executor}, expected one of {EXECUTORS}")
+
+    chunksize = max(1, len(civ_ids) // (jobs * 4))
+    if "fork" in multiprocessing.get_all_start_methods():
+        global _shared_df
+        _shared_df = df
+        try:
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("fork")) as pool:
+                changes = list(pool.map(_apply_shared, [modifications] * len(civ_ids), civ_ids, chunksize=chunksize))
+        finally:
+            _shared_df = None
+    else:
+        # Without fork (e.g. on Windows) every civ has to be sent to the worker as well
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            changes = list(pool.map(_apply_in_worker, [modifications] * len(civ_ids), civ_ids, [df.civs[civ_id] for civ_id in civ_ids], chunksize=chunksize))
+
+    for civ_id, (header, changed_units) in zip(civ_ids, changes):
+        civ = df.civs[civ_id]
+        for field, value in header.items():
+            setattr(civ, field, value)
+        if isinstance(changed_units, list):
+            civ.units = changed_units
+            tracking.mark_civ(df, civ_id)
+            continue
+        for unit_id, unit in changed_units.items():
+            civ.units[unit_id] = unit
+        tracking.mark_units(df, [unit for unit in changed_units.values() if unit is not None])
+    # The changed units are copies sent back by the workers, which replace the units the unit index still refers to
+    indexes.get_unit_index(df).invalidate()
+
+
+def default_jobs() -> int:
+    return os.cpu_count() or 1
+
+
+# The IDs of the units changed by the modifications, None if any unit may have changed
+def _apply(modifications: list[PerCivModification], civ_id: int, civ: Civ) -> list[int] | None:
+    changed_unit_ids: set[int] | None = set()
+    for modification in modifications:
+        unit_ids = modification(civ_id, civ)
+        if unit_ids is None:
+            changed_unit_ids = None
+        elif changed_unit_ids is not None:
+            changed_unit_ids.update(unit_ids)
+    return None if changed_unit_ids is None else sorted(changed_unit_ids)
+
+
+def _mark(df: DatFile, civ_id: int, changed_unit_ids: list[int] | None):
+    if changed_unit_ids is None:
+        tracking.mark_civ(df, civ_id)
+    else:
+        units = df.civs[civ_id].units
+        tracking.mark_units(df, [units[unit_id] for unit_id in changed_unit_ids if units[unit_id] is not None])
+
+
+# Runs in a worker process and returns what the main process needs to repeat the changes: the fields of the civ besides its units
+# (they are small) and the changed units by ID, or all units of the civ if any of them may have changed
+def _apply_in_worker(modifications: list[PerCivModification], civ_id: int, civ: Civ) -> tuple[dict, dict[int, Unit | None] | list[Unit | None]]:
+    changed_unit_ids = _apply(modifications, civ_id, civ)
+    header = {field.name: getattr(civ, field.name) for field in dataclasses.fields(Civ) if field.name != "units"}
+    if changed_unit_ids is None:
+        return header, civ.units
+    return header, {unit_id: civ.units[unit_id] for unit_id in changed_unit_ids}
+
+
+def _apply_shared(modifications: list[PerCivModification], civ_id: int) -> tuple[dict, dict[int, Unit | None] | list[Unit | None]]:
+    return _apply_in_worker(modifications, civ_id, _shared_df.civs[civ_id])
@@ -0,0 +1,202 @@
+import cProfile
+import contextlib
+import dataclasses
+import functools
+import gc
+import inspect
+import operator
+import sys
+import time
+from pathlib import Path
+from types import ModuleType
+
+from genieutils.datfile import DatFile
+
+from mods.compact import CompactArray
+
+NAME = "profiling"
+
+# The columns the report can be sorted by, and the measurement each of them sorts on
+SORT_KEYS = {
+    "wall": "wall_s",
+    "cpu": "cpu_s",
+    "blocks": "allocated_blocks",
+    "gc": "gc_collections",
+    "calls": "calls",
+    "units": "units_touched",
+    "effects": "effects_touched",
+    "name": "name",
+}
+
+# Measures every mod stage create_mod.py applies, to find out which mod (and which function of it) makes a build slow
+# For every stage it records
+#   - wall_s and cpu_s, how long the stage took
+#   - allocated_blocks, the number of memory blocks Python allocated during the stage minus those it freed again
+#   - gc_collections, how often the garbage collector ran, which goes up with the number of objects the stage created
+#   - with touched, units_touched and effects_touched: the number of unit IDs changed in any civ and the number of effects changed, added or removed
+# With functions every function defined at the top level of the mod module is timed as well, see wrap_functions()
+# With cprofile the stages are also run under cProfile, see dump()
+#
+# Counting what a stage touched compares every unit and effect against a fingerprint taken before the stage
+# That takes a while on large DatFiles, but it happens outside of the measured time
+class ModProfiler:
+    def __init__(self, functions: bool = False, touched: bool = False, cprofile: bool = False):
+        self.functions = functions
+        self.touched = touched
+        self.stages: list[dict] = []
+        self.function_stats: dict[str, dict] = {}
+        self.profile = cProfile.Profile() if cprofile else None
+        # Functions currently running, so that recursive calls are only counted once
+        self._running: set[str] = set()
+
+    @contextlib.contextmanager
+    def stage(self, df: DatFile, module: ModuleType, name: str):
+        fingerprints = take_fingerprints(df) if self.touched else None
+        originals = wrap_functions(module, self._wrap) if self.functions else {}
+        gc.collect()
+        collections = gc_collections()
+        blocks = sys.getallocatedblocks()
+        start_time = time.perf_counter()
+        start_cpu_time = time.process_time()
+        if self.profile is not None:
+            self.profile.enable()
+        try:
+            yield
+        finally:
+            if self.profile is not None:
+                self.profile.disable()
+            record = {
+                "name": name,
+                "wall_s": time.perf_counter() - start_time,
+                "cpu_s": time.process_time() - start_cpu_time,
+                "allocated_blocks": sys.getallocatedblocks() - blocks,
+                "gc_collections": gc_collections() - collections,
+                "units_touched": None,
+                "effects_touched": None,
+            }
+            unwrap_functions(module, originals)
+            if fingerprints is not None:
+                record["units_touched"], record["effects_touched"] = count_touched(df, fingerprints)
+            self.stages.append(record)
+
+    def print_report(self, sort: str = "wall"):
+        print("Mod stages:")
+        _print_table(self.stages, sort, ["wall_s", "cpu_s", "allocated_blocks", "gc_collections", "units_touched", "effects_touched"])
+        if self.function_stats:
+            print("Functions (including the functions they call):")
+            _print_table(list(self.function_stats.values()), sort, ["calls", "wall_s", "cpu_s", "allocated_blocks"])
+
+    # Write the cProfile statistics, which can be read with pstats or viewed as a flame graph with tools like snakeviz or flameprof
+    def dump(self, output_file: Path):
+        if self.profile is None:
+            raise ValueError("The profiler wasn't created with cprofile=True")
+        self.profile.dump_stats(output_file)
+
+    def _wrap(self, name: str, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if name in self._running:
+                return function(*args, **kwargs)
+            self._running.add(name)
+            blocks = sys.getallocatedblocks()
+            start_time = time.perf_counter()
+            start_cpu_time = time.process_time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._running.discard(name)
+                stats = self.function_stats.setdefault(name, {"name": name, "calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "allocated_blocks": 0})
+                stats["calls"] += 1
+                stats["wall_s"] += time.perf_counter() - start_time
+                stats["cpu_s"] += time.process_time() - start_cpu_time
+                stats["allocated_blocks"] += sys.getallocatedblocks() - blocks
+
+        return wrapper
+
+
+def gc_collections() -> int:
+    return sum(generation["collections"] for generation in gc.get_stats())
+
+
+# Replace every function defined at the top level of the module with wrap(name, function), and return the originals to put back afterwards
+# Only calls that go through the module's globals are seen, which covers the mod calling its own functions and PER_CIV_MODIFICATIONS
+# Per-civ modifications run in worker processes with --jobs aren't seen, the stage still includes their time
+def wrap_functions(module: ModuleType, wrap) -> dict[str, object]:
+    originals = {}
+    for function_name, function in inspect.getmembers(module, inspect.isfunction):
+        if function.__module__ != module.__name__:
+            continue
+        originals[function_name] = function
+        setattr(module, function_name, wrap(f"{module.__name__}.{function_name}", function))
+    per_civ = getattr(module, "PER_CIV_MODIFICATIONS", None)
+    if per_civ is not None:
+        originals["PER_CIV_MODIFICATIONS"] = per_civ
+        module.PER_CIV_MODIFICATIONS = [getattr(module, function.__name__) if originals.get(function.__name__) is function else function for function in per_civ]
+    return originals
+
+
+def unwrap_functions(module: ModuleType, originals: dict[str, object]):
+    for name, original in originals.items():
+        setattr(module, name, original)
+
+
+# A hash of the values of every unit and effect, to notice which of them a stage changed
+def take_fingerprints(df: DatFile) -> dict[str, list]:
+    return {
+        "units": [[None if unit is None else hash(fingerprint(unit)) for unit in civ.units] for civ in df.civs],
+        "effects": [hash(fingerprint(effect)) for effect in df.effects],
+    }
+
+
+# The number of unit IDs changed, added or removed in any civ and the number of effects changed, added or removed since take_fingerprints()
+def count_touched(df: DatFile, fingerprints: dict[str, list]) -> tuple[int, int]:
+    unit_ids = set()
+    for civ_id in range(max(len(df.civs), len(fingerprints["units"]))):
+        units = df.civs[civ_id].units if civ_id < len(df.civs) else []
+        before = fingerprints["units"][civ_id] if civ_id < len(fingerprints["units"]) else []
+        unit_ids.update(range(min(len(units), len(before)), max(len(units), len(before))))
+        for unit_id, (unit, unit_before) in enumerate(zip(units, before)):
+            if (None if unit is None else hash(fingerprint(unit))) != unit_before:
+                unit_ids.add(unit_id)
+    before = fingerprints["effects"]
+    effects = abs(len(df.effects) - len(before))
+    effects += sum(1 for effect, effect_before in zip(df.effects, before) if hash(fingerprint(effect)) != effect_before)
+    return len(unit_ids), effects
+
+
+_getters: dict[type, operator.attrgetter | None] = {}
+
+
+# The values of a genieutils object as nested tuples, so that they can be hashed and compared
+def fingerprint(value):
+    value_type = type(value)
+    if value_type is list or value_type is tuple:
+        return tuple([fingerprint(item) for item in value])
+    if isinstance(value, CompactArray):
+        return tuple(column.tobytes() for column in value.columns)
+    getter = _getters.get(value_type, False)
+    if getter is False:
+        getter = _getters[value_type] = operator.attrgetter(*[field.name for field in dataclasses.fields(value_type)]) if dataclasses.is_dataclass(value_type) else None
+    if getter is None:
+        return value
+    return tuple([fingerprint(field_value) for field_value in getter(value)])
+
+
+def _print_table(records: list[dict], sort: str, columns: list[str]):
+    key = SORT_KEYS[sort]
+    if key == "name":
+        records = sorted(records, key=lambda record: record["name"])
+    else:
+        records = sorted(records, key=lambda record: record.get(key) or 0, reverse=True)
+    width = max([len(record["name"]) for record in records] + [20])
+    print(f"  {'name':<{width}}" + "".join(f" {column:>16}" for column in columns))
+    for record in records:
+        print(f"  {record['name']:<{width}}" + "".join(f" {_format(record[column]):>16}" for column in columns))
+
+
+def _format(value) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
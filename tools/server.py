@@ -0,0 +1,246 @@
+import gc
+import json
+import os
+import socket
+import sys
+import time
+import traceback
+from pathlib import Path
+from typing import Callable
+
+from genieutils.datfile import DatFile
+
+from tools import batch
+from tools.validate import ValidationError
+from tools.warmup import file_state
+
+NAME = "server"
+
+# Most of the time of a build goes into starting up: importing genieutils, checking the hash of the base file and loading it from the cache
+# The build server does that once and keeps the base data in memory. Every build request is handled by a child process forked from the server,
+# which starts from a copy-on-write copy of the base data, applies the requested mods, saves the result and exits
+# The base data of the server is never modified, so builds don't influence each other and several of them can run at the same time
+#
+# A build request is one line of JSON in the format of a batch variant (see tools/batch.py), e.g.
+#     {"output": "/home/me/mod/empires2_x2_p1.dat", "mods": ["custom_modifications", "age_diplomacy"]}
+# The server sends back whatever the build prints, followed by STATUS_SEPARATOR and a JSON status {"ok": true, "message": "..."}
+#
+# The mods are imported again in every child, so changes to them are picked up without restarting the server
+# When the base file changes, the server loads it again before the next build
+
+# Packages whose modules are imported again for every build
+RELOADED_PACKAGES = ["mods", "constants"]
+# Modules of those packages that stay loaded: the base data holds instances of the classes of mods/compact.py,
+# and the indexes and the tech graph are shared with tools/validate.py
+KEPT_MODULES = {"mods", "mods.compact", "mods.indexes", "mods.techtree"}
+
+STATUS_SEPARATOR = b"\0"
+# How often the server stops waiting for a connection to clean up after finished builds
+ACCEPT_TIMEOUT_SECONDS = 1.0
+# How long a client may take to send its build request before it is dropped
+REQUEST_TIMEOUT_SECONDS = 10.0
+# Exit code of a child that had nothing to build, e.g. for a connection from is_running() or an invalid build request
+NO_BUILD_EXIT_CODE = 3
+
+
+# Load the base data with load_base() and handle build requests on socket_path until interrupted
+def serve(socket_path: Path, input_file: Path, load_base: Callable[[], DatFile]):
+    if not hasattr(os, "fork") or not hasattr(socket, "AF_UNIX"):
+        raise RuntimeError("The build server needs fork and Unix sockets, which aren't available on this platform")
+    # Clients connecting while the base data is loaded wait until the server is ready
+    server = _listen(socket_path)
+    children: set[int] = set()
+    try:
+        df, state = _load_base(input_file, load_base)
+        print(f"Build server listening on {socket_path}, press Ctrl+C to stop")
+        while True:
+            _reap(children)
+            try:
+                connection, _ = server.accept()
+            except TimeoutError:
+                continue
+            # The request is read by the child, so a client that is slow to send it only holds up its own build
+            with connection:
+                if file_state(input_file) != state:
+                    print(f"{input_file} changed, loading it again")
+                    # Running builds keep their own copy of the old data, the server can let go of it before loading the new one
+                    df = None
+                    gc.unfreeze()
+                    try:
+                        df, state = _load_base(input_file, load_base)
+                    except Exception:
+                        traceback.print_exc()
+                        _send_status(connection, False, f"Loading {input_file} failed, see the output of the build server")
+                        continue
+                # Otherwise whatever the server printed but didn't write yet would be written by the child as well
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if pid == 0:
+                    server.close()
+                    _build_in_child(connection, df)
+                children.add(pid)
+    except KeyboardInterrupt:
+        print("Stopped the build server")
+    finally:
+        server.close()
+        socket_path.unlink(missing_ok=True)
+
+
+# Send a build request to the server on socket_path, print what the build prints and return whether it succeeded
+def request_build(socket_path: Path, variant: dict) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(str(socket_path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise RuntimeError(f"No build server is listening on {socket_path}, start one with python ./create_mod.py --serve")
+        connection.sendall(json.dumps(variant).encode() + b"\n")
+        status = _receive_output(connection)
+    if status is None:
+        print("The build server closed the connection before the build finished")
+        return False
+    print(status["message"])
+    return status["ok"]
+
+
+def is_running(socket_path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(str(socket_path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+    return True
+
+
+def _load_base(input_file: Path, load_base: Callable[[], DatFile]) -> tuple[DatFile, tuple[int, int, int] | None]:
+    start_time = time.perf_counter()
+    # Taken before loading, so that a change while loading is noticed by the next build
+    state = file_state(input_file)
+    df = load_base()
+    # A child running the garbage collector would write to every object of the base data it goes through,
+    # which copies the memory pages holding them. Frozen objects are left alone by the garbage collector
+    gc.collect()
+    gc.freeze()
+    print(f"Base data loaded ({time.perf_counter() - start_time:.1f}s)")
+    return df, state
+
+
+def _listen(socket_path: Path) -> socket.socket:
+    if socket_path.exists():
+        if is_running(socket_path):
+            raise RuntimeError(f"Another build server is already listening on {socket_path}")
+        # Left behind by a server that was killed
+        socket_path.unlink()
+    socket_path.parent.mkdir(exist_ok=True, parents=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Whoever can connect can have files written with the permissions of the server, so only our own user may
+    umask = os.umask(0o177)
+    try:
+        server.bind(str(socket_path))
+    finally:
+        os.umask(umask)
+    server.listen()
+    server.settimeout(ACCEPT_TIMEOUT_SECONDS)
+    return server
+
+
+# None if the client closed the connection without sending anything, e.g. is_running()
+def _read_request(connection: socket.socket) -> dict | None:
+    connection.settimeout(REQUEST_TIMEOUT_SECONDS)
+    with connection.makefile("rb") as f:
+        line = f.readline()
+    connection.settimeout(None)
+    if not line:
+        return None
+    request = json.loads(line)
+    if not isinstance(request, dict):
+        raise ValueError("expected a JSON object")
+    return batch.normalize_variant(request, "The build request")
+
+
+# Runs in the forked child and never returns, the child exits once it read the build request and did the build
+# Everything the build prints goes to the client
+def _build_in_child(connection: socket.socket, df: DatFile):
+    exit_code = 1
+    try:
+        try:
+            variant = _read_request(connection)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring an invalid build request: {e}", flush=True)
+            _send_status(connection, False, f"Invalid build request: {e}")
+            exit_code = NO_BUILD_EXIT_CODE
+            return
+        if variant is None:
+            exit_code = NO_BUILD_EXIT_CODE
+            return
+        print(f"Building {variant['output']} in process {os.getpid()}", flush=True)
+        sys.stderr.flush()
+        os.dup2(connection.fileno(), sys.stdout.fileno())
+        os.dup2(connection.fileno(), sys.stderr.fileno())
+        sys.stdout.reconfigure(line_buffering=True)
+        ok, message = _build(df, variant)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        _send_status(connection, ok, message)
+        exit_code = 0 if ok else 1
+    finally:
+        # Whatever happened, e.g. the client went away, never go back to the loop of the server or run its cleanup, like removing its socket
+        os._exit(exit_code)
+
+
+def _build(df: DatFile, variant: dict) -> tuple[bool, str]:
+    try:
+        _forget_mods()
+        batch.build_variant(df, variant)
+    except ValidationError as error:
+        return False, f"{error}. Nothing was saved"
+    except Exception:
+        traceback.print_exc()
+        return False, "The build failed"
+    return True, f"Saved {variant['output']}"
+
+
+# Remove the mods from the imported modules, so that batch.apply_mod imports their current code
+def _forget_mods():
+    for name in list(sys.modules):
+        if name.partition(".")[0] not in RELOADED_PACKAGES or name in KEPT_MODULES:
+            continue
+        del sys.modules[name]
+        # `from mods import helpers` would still find the old module as an attribute of the package
+        package, _, attribute = name.rpartition(".")
+        if package in sys.modules and hasattr(sys.modules[package], attribute):
+            delattr(sys.modules[package], attribute)
+
+
+def _send_status(connection: socket.socket, ok: bool, message: str):
+    try:
+        connection.sendall(STATUS_SEPARATOR + json.dumps({"ok": ok, "message": message}).encode())
+    except OSError:
+        # The client went away, there is no one to tell
+        pass
+
+
+def _receive_output(connection: socket.socket) -> dict | None:
+    status = None
+    while chunk := connection.recv(65536):
+        if status is not None:
+            status += chunk
+            continue
+        output, separator, rest = chunk.partition(STATUS_SEPARATOR)
+        sys.stdout.buffer.write(output)
+        sys.stdout.flush()
+        if separator:
+            status = rest
+    return None if status is None else json.loads(status)
+
+
+def _reap(children: set[int]):
+    for pid in list(children):
+        finished, status = os.waitpid(pid, os.WNOHANG)
+        if not finished:
+            continue
+        children.discard(pid)
+        exit_code = os.waitstatus_to_exitcode(status)
+        if exit_code == NO_BUILD_EXIT_CODE:
+            continue
+        print(f"Build in process {pid} {'finished' if exit_code == 0 else f'failed with exit code {exit_code}'}")
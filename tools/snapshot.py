@@ -0,0 +1,492 @@
+import contextlib
+import dataclasses
+import enum
+import gc
+import itertools
+import json
+import operator
+import struct
+import sys
+from array import array
+
+from genieutils.common import GenieClass
+
+from mods.compact import INTERNED_TYPES, CompactArray, _from_columns, _intern_item, intern_costs
+
+NAME = "snapshot"
+
+SNAPSHOT_FORMAT = "genieutils-examples-snapshot"
+SNAPSHOT_VERSION = 1
+
+# A snapshot stores a DatFile (or any other tree of genieutils objects, lists, tuples and dicts) as flat tables instead of pickling it object by object
+# Every class gets one table with a column per field, e.g. one table holding the hit points of every unit of every civ
+# A column of numbers is a single array, which loads with one bulk read, and objects are created by calling their class once per row
+#
+# The snapshot starts with the length of its manifest and the manifest itself, a JSON document describing the tables,
+# followed by the columns as raw arrays in native byte order. Every array starts at a multiple of 8 bytes
+# Strings are deduplicated into one list in the manifest and referred to by their index
+#
+# A column is described by a JSON object with one of these kinds:
+#   int, float, bool   an array of numbers with the given typecode in the given blob
+#   str                an array of indexes into the strings
+#   enum               an array of the values of members of an IntEnum, e.g. UnitType
+#   ref                an array of row indexes into another table, -1 for None. The same object is always the same row, so shared objects stay shared
+#   none               only None
+#   json               the values themselves, for numbers too large for an array
+#   list, tuple        the lengths of the sequences and a column of all of their items one after another
+#   dict               the lengths of the dicts, a column of all of their keys and a column of all of their values
+#   compact            compact arrays (see mods/compact.py) of one class, the lengths of the arrays and one column per field
+#   mixed              values of different kinds: the kind of every value and a column for each kind
+#
+# Tables are stored in an order where every table only refers to tables before it, so that they can be loaded one after another
+# Interned costs are interned again when loading, lazily loaded DatFiles and civs are stored as plain ones
+# Only the classes of snapshot_classes() can be stored, so that loading a snapshot never creates or imports anything else
+
+_SCALAR_TYPES = frozenset([int, float, str, bool, type(None)])
+_BLOB_ALIGNMENT = 8
+_MANIFEST_SIZE = struct.Struct("<Q")
+# The smallest signed typecode a column of ints fits into, from small to large
+_INT_TYPECODES = [("b", -(2**7), 2**7 - 1), ("h", -(2**15), 2**15 - 1), ("i", -(2**31), 2**31 - 1), ("q", -(2**63), 2**63 - 1)]
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+# Encode the value into the chunks of a snapshot
+def encode(value) -> list[bytes]:
+    with _gc_paused():
+        return _Encoder().encode(value)
+
+
+# Decode a snapshot from any buffer, e.g. a memory-mapped file
+def decode(buffer) -> object:
+    with memoryview(buffer) as view:
+        (manifest_size,) = _MANIFEST_SIZE.unpack_from(view)
+        manifest = json.loads(bytes(view[_MANIFEST_SIZE.size : _MANIFEST_SIZE.size + manifest_size]))
+        if manifest.get("format") != SNAPSHOT_FORMAT or manifest.get("version") != SNAPSHOT_VERSION:
+            raise SnapshotError(f"not a version {SNAPSHOT_VERSION} snapshot")
+        if manifest["byteorder"] != sys.byteorder:
+            raise SnapshotError(f"snapshot was written on a {manifest['byteorder']} endian machine")
+        blobs_start = _aligned(_MANIFEST_SIZE.size + manifest_size)
+        with _gc_paused():
+            return _Decoder(view[blobs_start:], manifest).decode()
+
+
+# Encoding and decoding create millions of objects without a single reference cycle among them
+# The garbage collector would run again and again while they are created, only to find nothing to collect
+@contextlib.contextmanager
+def _gc_paused():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class _Table:
+    def __init__(self, index: int, spec: tuple):
+        self.index = index
+        self.kind, self.cls, self.fields, _ = spec
+        self.columns: list[list] = [[] for _ in self.fields]
+        # Keep the objects alive, their ids identify them until the snapshot is encoded
+        self.objects: list = []
+        self.depends_on: set[int] = set()
+
+
+class _Encoder:
+    def __init__(self):
+        self.tables: dict[tuple, _Table] = {}
+        self.rows_by_id: dict[int, int] = {}
+        self.strings: dict[str, int] = {}
+        self.blobs: list[bytes] = []
+
+    def encode(self, value) -> list[bytes]:
+        self._collect(value)
+        tables = list(self.tables.values())
+        table_columns = [[self._encode_column(column, table) for column in table.columns] for table in tables]
+        root = self._encode_column([value], None)
+        order = _dependency_order(tables)
+        position = {table.index: position for position, table in enumerate(order)}
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "byteorder": sys.byteorder,
+            "strings": list(self.strings),
+            "tables": [
+                {"kind": table.kind, "class": _class_path(table.cls), "fields": list(table.fields), "rows": len(table.objects), "columns": _renumber(table_columns[table.index], position)}
+                for table in order
+            ],
+            "root": _renumber(root, position),
+            "blobs": [],
+        }
+        # Offsets are counted from the first blob, which starts at the first multiple of 8 after the manifest
+        offset = 0
+        for blob in self.blobs:
+            offset = _aligned(offset)
+            manifest["blobs"].append([offset, len(blob)])
+            offset += len(blob)
+        encoded_manifest = json.dumps(manifest, separators=(",", ":")).encode()
+        chunks = [_MANIFEST_SIZE.pack(len(encoded_manifest)), encoded_manifest]
+        offset = _MANIFEST_SIZE.size + len(encoded_manifest)
+        for blob in self.blobs:
+            padding = _aligned(offset) - offset
+            if padding:
+                chunks.append(bytes(padding))
+            chunks.append(blob)
+            offset += padding + len(blob)
+        return chunks
+
+    # Give every object a row in the table of its class
+    # Objects are collected a column at a time rather than one by one: all units of all civs at once, then all of their attacks and so on
+    def _collect(self, root):
+        pending = [[root]]
+        while pending:
+            values = pending.pop()
+            types = set(map(type, values)) - _SCALAR_TYPES
+            if len(types) > 1:
+                pending.extend([value for value in values if type(value) is value_type] for value_type in types)
+                continue
+            if not types:
+                continue
+            (value_type,) = types
+            if value_type is list or value_type is tuple:
+                pending.append(list(itertools.chain.from_iterable(value for value in values if type(value) is value_type)))
+            elif value_type is dict:
+                dicts = [value for value in values if type(value) is dict]
+                pending.append(list(itertools.chain.from_iterable(map(dict.keys, dicts))))
+                pending.append(list(itertools.chain.from_iterable(map(dict.values, dicts))))
+            elif not issubclass(value_type, (CompactArray, enum.IntEnum)):
+                # The same object can show up more than once, it only gets one row
+                rows_by_id = self.rows_by_id
+                objects = list({id(value): value for value in values if type(value) is value_type and id(value) not in rows_by_id}.values())
+                if not objects:
+                    continue
+                spec = _spec(objects[0])
+                if spec[0] != "object":
+                    self._add_rows(objects, spec, pending)
+                    continue
+                # Other objects can each have different attributes
+                for value in objects:
+                    self._add_rows([value], _spec(value), pending)
+
+    def _add_rows(self, objects: list, spec: tuple, pending: list[list]):
+        table = self.tables.get(spec[:3])
+        if table is None:
+            table = self.tables[spec[:3]] = _Table(len(self.tables), spec)
+        start = len(table.objects)
+        self.rows_by_id.update(zip(map(id, objects), range(start, start + len(objects))))
+        table.objects.extend(objects)
+        for column, values in zip(table.columns, zip(*map(spec[3], objects))):
+            column.extend(values)
+            # Most columns only hold numbers and strings, which don't refer to anything else
+            if not _SCALAR_TYPES.issuperset(map(type, values)):
+                pending.append(list(values))
+
+    def _blob(self, content: bytes | array) -> int:
+        self.blobs.append(content if isinstance(content, bytes) else content.tobytes())
+        return len(self.blobs) - 1
+
+    def _encode_column(self, values: list, table: _Table | None) -> dict:
+        # Nearly every column holds a single kind of value, which can be told from the types alone without looking at every value
+        group = self._type_group(set(map(type, values)))
+        if group is not None:
+            return self._encode_group(group, values, table)
+        groups: dict[object, list] = {}
+        for value in values:
+            groups.setdefault(self._group(value), []).append(value)
+        if len(groups) == 1:
+            (group,) = groups
+            return self._encode_group(group, values, table)
+        ref_groups = [group for group in groups if group[0] == "ref"]
+        if len(groups) == 2 and len(ref_groups) == 1 and ("none",) in groups:
+            return self._encode_group(ref_groups[0], values, table)
+        kinds = list(groups)
+        kind_index = {group: index for index, group in enumerate(kinds)}
+        tags = array("B", [kind_index[self._group(value)] for value in values])
+        return {"kind": "mixed", "tags": self._blob(tags), "columns": [self._encode_group(group, groups[group], table) for group in kinds]}
+
+    # The group of all values of a column with these types, or None if the values have to be grouped one by one
+    def _type_group(self, types: set[type]) -> tuple | None:
+        optional = types - {type(None)}
+        if len(types) == 1 and len(optional) == 0:
+            return ("none",)
+        if len(optional) != 1:
+            return None
+        (value_type,) = optional
+        spec = _specs.get(value_type)
+        if spec is not None:
+            # None in a column of refs is stored as row -1
+            return ("ref", self.tables[spec[:3]].index)
+        if len(types) != 1:
+            return None
+        if value_type in (int, float, str, bool, list, tuple, dict):
+            return (value_type.__name__,)
+        if issubclass(value_type, CompactArray):
+            return ("compact", value_type)
+        if issubclass(value_type, enum.IntEnum):
+            return ("enum", value_type)
+        return None
+
+    def _group(self, value) -> tuple:
+        value_type = type(value)
+        if value_type is int:
+            return ("int",)
+        if value_type is float:
+            return ("float",)
+        if value_type is str:
+            return ("str",)
+        if value_type is bool:
+            return ("bool",)
+        if value is None:
+            return ("none",)
+        if value_type is list or value_type is tuple or value_type is dict:
+            return (value_type.__name__,)
+        if isinstance(value, CompactArray):
+            return ("compact", value_type)
+        if isinstance(value, enum.IntEnum):
+            return ("enum", value_type)
+        return ("ref", self.tables[_spec(value)[:3]].index)
+
+    def _encode_group(self, group: tuple, values: list, table: _Table | None) -> dict:
+        kind = group[0]
+        if kind == "int":
+            typecode = next((typecode for typecode, low, high in _INT_TYPECODES if low <= min(values) and max(values) <= high), None)
+            if typecode is None:
+                return {"kind": "json", "values": values}
+            return {"kind": "int", "type": typecode, "blob": self._blob(array(typecode, values))}
+        if kind == "float":
+            doubles = array("d", values)
+            # Values read from the dat file are 32-bit floats, which take half the space and still read back exactly
+            floats = array("f", doubles)
+            if floats == doubles:
+                return {"kind": "float", "type": "f", "blob": self._blob(floats)}
+            return {"kind": "float", "type": "d", "blob": self._blob(doubles)}
+        if kind == "bool":
+            return {"kind": "bool", "type": "B", "blob": self._blob(array("B", values))}
+        if kind == "str":
+            strings = self.strings
+            indexes = array("i", [strings.setdefault(value, len(strings)) for value in values])
+            return {"kind": "str", "type": "i", "blob": self._blob(indexes)}
+        if kind == "enum":
+            return {**self._encode_group(("int",), [value.value for value in values], table), "kind": "enum", "class": _class_path(group[1])}
+        if kind == "none":
+            return {"kind": "none", "count": len(values)}
+        if kind == "ref":
+            rows_by_id = self.rows_by_id
+            if table is not None:
+                table.depends_on.add(group[1])
+            rows = array("i", [-1 if value is None else rows_by_id[id(value)] for value in values])
+            return {"kind": "ref", "table": group[1], "type": "i", "blob": self._blob(rows)}
+        if kind == "compact":
+            compact_class = group[1]
+            lengths = array("i", map(len, values))
+            columns = []
+            for field_index, typecode in enumerate(compact_class.typecodes):
+                column = array(typecode)
+                for compact_array in values:
+                    column.extend(compact_array.columns[field_index])
+                columns.append({"type": typecode, "blob": self._blob(column)})
+            return {"kind": "compact", "class": _class_path(compact_class), "lengths": self._blob(lengths), "columns": columns}
+        lengths = array("i", map(len, values))
+        if kind == "dict":
+            keys = [key for value in values for key in value.keys()]
+            items = [item for value in values for item in value.values()]
+            return {"kind": "dict", "lengths": self._blob(lengths), "keys": self._encode_column(keys, table), "values": self._encode_column(items, table)}
+        items = [item for value in values for item in value]
+        return {"kind": kind, "lengths": self._blob(lengths), "items": self._encode_column(items, table)}
+
+
+class _Decoder:
+    def __init__(self, blobs: memoryview, manifest: dict):
+        self.blobs = blobs
+        self.manifest = manifest
+        self.strings: list[str] = manifest["strings"]
+        self.tables: list[list] = []
+
+    def decode(self):
+        for table in self.manifest["tables"]:
+            factory = _factory(table["kind"], _load_class(table["class"]), table["fields"])
+            columns = [self._decode_column(column, table["rows"]) for column in table["columns"]]
+            rows = list(map(factory, *columns)) if columns else [factory() for _ in range(table["rows"])]
+            # A ref of -1 is None
+            rows.append(None)
+            self.tables.append(rows)
+        return self._decode_column(self.manifest["root"], 1)[0]
+
+    def _array(self, blob: int, typecode: str) -> list:
+        offset, size = self.manifest["blobs"][blob]
+        return self.blobs[offset : offset + size].cast(typecode).tolist()
+
+    def _decode_column(self, column: dict, count: int) -> list:
+        kind = column["kind"]
+        if kind in ("int", "float", "bool"):
+            values = self._array(column["blob"], column["type"])
+            return list(map(bool, values)) if kind == "bool" else values
+        if kind == "enum":
+            return list(map(_load_class(column["class"]), self._array(column["blob"], column["type"])))
+        if kind == "str":
+            return list(map(self.strings.__getitem__, self._array(column["blob"], "i")))
+        if kind == "ref":
+            return list(map(self.tables[column["table"]].__getitem__, self._array(column["blob"], "i")))
+        if kind == "none":
+            return [None] * count
+        if kind == "json":
+            return column["values"]
+        if kind == "mixed":
+            tags = self._array(column["tags"], "B")
+            groups = [iter(self._decode_column(group, tags.count(tag))) for tag, group in enumerate(column["columns"])]
+            return [next(groups[tag]) for tag in tags]
+        lengths = self._array(column["lengths"], "i")
+        ends = list(itertools.accumulate(lengths))
+        starts = [end - length for end, length in zip(ends, lengths)]
+        total = ends[-1] if ends else 0
+        if kind == "compact":
+            compact_class = _load_class(column["class"])
+            fields = [self._raw_array(field["blob"], field["type"]) for field in column["columns"]]
+            return [_from_columns(compact_class, tuple(field[start:end] for field in fields)) for start, end in zip(starts, ends)]
+        if kind == "dict":
+            keys = self._decode_column(column["keys"], total)
+            values = self._decode_column(column["values"], total)
+            return [dict(zip(keys[start:end], values[start:end])) for start, end in zip(starts, ends)]
+        items = self._decode_column(column["items"], total)
+        sequences = list(map(items.__getitem__, map(slice, starts, ends)))
+        if kind == "list":
+            return sequences
+        if column["items"]["kind"] == "ref" and self.manifest["tables"][column["items"]["table"]]["kind"] == "interned":
+            # Units with the same costs share one tuple of them, see mods/compact.py
+            return list(map(intern_costs, sequences))
+        return list(map(tuple, sequences))
+
+    def _raw_array(self, blob: int, typecode: str) -> array:
+        offset, size = self.manifest["blobs"][blob]
+        raw = array(typecode)
+        raw.frombytes(self.blobs[offset : offset + size])
+        return raw
+
+
+_specs: dict[type, tuple] = {}
+
+
+# How objects of a type are stored: (kind, class, fields, function returning the values of the fields)
+# Interned costs are stored as interned costs, anything else that is a genieutils object as the genieutils class it is or stands in for
+# (compact array entries, lazily loaded DatFiles and civs), and other objects such as the DatLayout with their attributes
+def _spec(value) -> tuple:
+    value_type = type(value)
+    spec = _specs.get(value_type)
+    if spec is not None:
+        return spec
+    if value_type in INTERNED_TYPES:
+        spec = ("interned", value_type.base_class, value_type.fields, _getter(value_type.fields))
+        _specs[value_type] = spec
+    elif isinstance(value, GenieClass):
+        cls = next(base for base in value_type.__mro__ if "__dataclass_fields__" in base.__dict__)
+        fields = tuple(field.name for field in dataclasses.fields(cls))
+        spec = _specs[value_type] = ("dataclass", cls, fields, _getter(fields))
+    elif hasattr(value, "__dict__") and value_type.__module__ != "builtins":
+        # Not cached, the attributes can differ from one object to the next
+        fields = tuple(vars(value))
+        spec = ("object", value_type, fields, _getter(fields))
+    else:
+        raise SnapshotError(f"can't store {value_type.__name__} objects in a snapshot")
+    return spec
+
+
+def _getter(fields: tuple[str, ...]):
+    if len(fields) == 1:
+        get = operator.attrgetter(fields[0])
+        return lambda value: (get(value),)
+    if not fields:
+        return lambda value: ()
+    return operator.attrgetter(*fields)
+
+
+def _factory(kind: str, cls: type, fields: list[str]):
+    if kind == "interned":
+        return lambda *values: _intern_item(cls, values)
+    if kind == "dataclass" and all(field.init for field in dataclasses.fields(cls)) and [field.name for field in dataclasses.fields(cls)] == fields:
+        return cls
+
+    def create(*values):
+        created = cls.__new__(cls)
+        for field, value in zip(fields, values):
+            setattr(created, field, value)
+        return created
+
+    return create
+
+
+# Sort the tables so that every table comes after the tables it refers to
+def _dependency_order(tables: list[_Table]) -> list[_Table]:
+    order, done, visiting = [], set(), set()
+
+    def add(table: _Table):
+        if table.index in done:
+            return
+        if table.index in visiting:
+            raise SnapshotError(f"{table.cls.__name__} objects refer to themselves, which snapshots can't store")
+        visiting.add(table.index)
+        for dependency in sorted(table.depends_on):
+            add(tables[dependency])
+        visiting.discard(table.index)
+        done.add(table.index)
+        order.append(table)
+
+    for table in tables:
+        add(table)
+    return order
+
+
+# Tables are numbered in the order they were found, point the refs at their position in the snapshot instead
+def _renumber(column, position: dict[int, int]):
+    if isinstance(column, list):
+        return [_renumber(item, position) for item in column]
+    if not isinstance(column, dict) or column.get("kind") == "json":
+        return column
+    renumbered = {key: _renumber(value, position) for key, value in column.items()}
+    if column.get("kind") == "ref":
+        renumbered["table"] = position[column["table"]]
+    return renumbered
+
+
+_snapshot_classes: dict[str, type] = {}
+
+
+# The classes a snapshot can store and create by name: the genieutils classes (see tools/diff.py patch_classes()),
+# the IntEnums of genieutils such as UnitType, the compact arrays of mods/compact.py and the DatLayout of tools/tracking.py
+# Interned costs and lazily loaded DatFiles and civs don't need to be here, they are stored as the genieutils classes they stand in for
+def snapshot_classes() -> dict[str, type]:
+    if not _snapshot_classes:
+        # Both import tools/cache.py, which imports this module
+        from tools.diff import patch_classes
+        from tools.tracking import DatLayout
+
+        classes = [*patch_classes().values(), *_subclasses(CompactArray), DatLayout]
+        classes.extend(cls for cls in _subclasses(enum.IntEnum) if cls.__module__.startswith("genieutils."))
+        _snapshot_classes.update((f"{cls.__module__}.{cls.__qualname__}", cls) for cls in classes)
+    return _snapshot_classes
+
+
+def _subclasses(cls: type) -> list[type]:
+    subclasses = cls.__subclasses__()
+    return [*subclasses, *itertools.chain.from_iterable(map(_subclasses, subclasses))]
+
+
+def _class_path(cls: type) -> str:
+    path = f"{cls.__module__}.{cls.__qualname__}"
+    if snapshot_classes().get(path) is not cls:
+        raise SnapshotError(f"can't store {cls.__name__} objects in a snapshot")
+    return path
+
+
+def _load_class(path: str) -> type:
+    cls = snapshot_classes().get(path)
+    if cls is None:
+        raise SnapshotError(f"snapshot contains {path!r}, which isn't a class snapshots can store")
+    return cls
+
+
+def _aligned(offset: int) -> int:
+    return (offset + _BLOB_ALIGNMENT - 1) // _BLOB_ALIGNMENT * _BLOB_ALIGNMENT
@@ -0,0 +1,518 @@
+import dataclasses
+import random
+import types
+import typing
+import zlib
+from os import PathLike
+from pathlib import Path
+
+from genieutils.civ import Civ
+from genieutils.common import TERRAIN_COUNT, TERRAIN_UNITS_SIZE, TILE_TYPE_COUNT, GenieClass, UnitType
+from genieutils.datfile import DatFile
+from genieutils.effect import Effect, EffectCommand
+from genieutils.randommaps import RandomMaps
+from genieutils.task import Task
+from genieutils.tech import Tech
+from genieutils.techtree import TechTree
+from genieutils.terrainblock import FrameData, Terrain, TerrainBlock, TileSize
+from genieutils.unit import AttackOrArmor, Bird, Building, BuildingAnnex, Creatable, DeadFish, Projectile, ResourceStorage, Type50, Unit
+from genieutils.versions import Version
+
+from constants import armor_classes, attributes, civilizations, command_types, resources, techs, unit_classes, units
+from mods import helpers
+from tools.tracking import SECTIONS, encode_civ_header, encode_section
+
+NAME = "synthetic"
+
+# Everything in this repository starts from datfiles/base_game.dat, which can't be shipped along with it
+# A synthetic DatFile has the same structure as the real one but is filled with made-up values
+# It saves and parses like the real one, so it can stand in for it when testing mods or benchmarking without the game files
+#
+# The parts mods usually touch look like the real ones: units of every type with attacks and armours (type_50), costs (creatable) and tasks (bird),
+# technologies that require the ages and each other, effects with the common kinds of commands and a tech tree effect for every civ
+# Every civ, unit and technology named in constants/ exists, whatever the counts, so the example mods run against it
+# The named units are units that can be trained or buildings. With named_ids=False only the IDs within the counts exist, which makes a far smaller DatFile for tests that don't run the mods
+# The values themselves are random, but the same arguments always give the same DatFile
+#
+#   df = make_datfile(**scaled_counts(1))                          # about the size of the base game data
+#   write_datfile("/tmp/synthetic.dat", **scaled_counts(10))       # 10 times as much, written without holding all of it in memory
+
+VERSION = Version.VER_84.value
+MAX_INT16 = 2**15 - 1
+
+# Roughly the size of the base game data at the time of writing
+BASE_GAME_COUNTS = {"civs": 50, "units_per_civ": 4000, "techs": 1100, "effects": 1100}
+
+# The share of the units of each type, and the classes they are picked from
+UNIT_TYPE_WEIGHTS = {
+    UnitType.EyeCandy: 8,
+    UnitType.Trees: 2,
+    UnitType.Flag: 3,
+    UnitType.DeadFish: 12,
+    UnitType.Bird: 3,
+    UnitType.Combatant: 6,
+    UnitType.Projectile: 10,
+    UnitType.Creatable: 36,
+    UnitType.Building: 18,
+    UnitType.AoeTrees: 2,
+}
+CREATABLE_CLASSES = [
+    unit_classes.ARCHER, unit_classes.INFANTRY, unit_classes.CAVALRY, unit_classes.CAVALRY_ARCHER, unit_classes.SIEGE_WEAPON,
+    unit_classes.CIVILIAN, unit_classes.MONK, unit_classes.TRADE_CART, unit_classes.WARSHIP, unit_classes.FISHING_BOAT,
+    unit_classes.HAND_CANNONEER, unit_classes.SCOUT, unit_classes.PREY_ANIMAL, unit_classes.LIVESTOCK,
+]
+BUILDING_CLASSES = [unit_classes.BUILDING, unit_classes.BUILDING, unit_classes.BUILDING, unit_classes.WALL, unit_classes.GATE, unit_classes.TOWER, unit_classes.FARM]
+UNIT_TYPE_CLASSES = {
+    UnitType.EyeCandy: [unit_classes.TERRAIN, unit_classes.CLIFF, unit_classes.MISCELLANEOUS],
+    UnitType.Trees: [unit_classes.TREE],
+    UnitType.Flag: [unit_classes.FLAG],
+    UnitType.DeadFish: [unit_classes.MISCELLANEOUS, unit_classes.TREE_STUMP],
+    UnitType.Bird: [unit_classes.BIRD],
+    UnitType.Combatant: [unit_classes.GOLD_MINE, unit_classes.STONE_MINE, unit_classes.BERRY_BUSH, unit_classes.SHORE_FISH, unit_classes.RELIC],
+    UnitType.Projectile: [unit_classes.MISCELLANEOUS],
+    UnitType.Creatable: CREATABLE_CLASSES,
+    UnitType.Building: BUILDING_CLASSES,
+    UnitType.AoeTrees: [unit_classes.TREE],
+}
+# Base attacks and armours every fighting unit has, and the bonus classes the others are picked from
+BASE_ARMOR_CLASSES = [armor_classes.MELEE, armor_classes.PIERCE]
+BONUS_ARMOR_CLASSES = [
+    armor_classes.INFANTRY, armor_classes.ELEPHANT, armor_classes.CAVALRY, armor_classes.BUILDING,
+    armor_classes.STONE_WALL_GATE, armor_classes.ARCHER, armor_classes.SHIP,
+]
+MODIFIED_ATTRIBUTES = [attributes.HIT_POINTS, attributes.LINE_OF_SIGHT, attributes.MOVEMENT_SPEED, attributes.ATTACK_RELOAD_TIME, attributes.MAXIMUM_RANGE]
+RESOURCE_COUNT = max(value for value in vars(resources).values() if isinstance(value, int)) + 1
+# Amounts a 32-bit float holds exactly, so that the DatFile reads back exactly as it was made
+EXACT_FRACTIONS = [0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0]
+# How many civs and technologies it takes for every one named in constants/ to exist
+NAMED_CIVS = max(value for value in vars(civilizations).values() if isinstance(value, int)) + 1
+NAMED_TECHS = max(value for value in vars(techs).values() if isinstance(value, int)) + 1
+
+
+# Counts of a synthetic DatFile `scale` times the size of the base game data, e.g. 10 for 10x or 0.1 for a quick test
+# The civs hold nearly all of the data, so the number of civs and the units per civ both grow with the square root of scale
+# Technologies and effects grow with scale, up to the most the file format can refer to
+# Small scales are bigger than asked for, since everything named in constants/ is always there, see _make_parts()
+def scaled_counts(scale: float) -> dict[str, int]:
+    return {
+        "civs": min(max(1, round(BASE_GAME_COUNTS["civs"] * scale**0.5)), MAX_INT16),
+        "units_per_civ": min(max(1, round(BASE_GAME_COUNTS["units_per_civ"] * scale**0.5)), MAX_INT16),
+        "techs": min(max(1, round(BASE_GAME_COUNTS["techs"] * scale)), MAX_INT16),
+        "effects": min(max(1, round(BASE_GAME_COUNTS["effects"] * scale)), MAX_INT16),
+    }
+
+
+# Build a synthetic DatFile in memory
+# Every civ gets its own copy of the same units, like in the real data where the civs mostly differ in graphics and which units are enabled
+def make_datfile(civs: int = 50, units_per_civ: int = 4000, techs: int = 1100, effects: int = 1100, seed: int = 0, named_ids: bool = True) -> DatFile:
+    df, civ_units = _make_parts(civs, units_per_civ, techs, effects, seed, named_ids)
+    for civ_id, civ in enumerate(df.civs):
+        civ.units = civ_units if civ_id == 0 else helpers.fast_copy(civ_units)
+    return df
+
+
+# Write a synthetic DatFile to disk, compressed like the real one
+# The units of every civ are the same, so they are encoded once and the file is written a civ at a time,
+# which makes even DatFiles far bigger than the memory of the machine quick to write
+def write_datfile(target_file: Path | PathLike | str, civs: int = 50, units_per_civ: int = 4000, techs: int = 1100, effects: int = 1100, seed: int = 0, named_ids: bool = True):
+    df, civ_units = _make_parts(civs, units_per_civ, techs, effects, seed, named_ids)
+    version = Version(df.version)
+    template = Civ(player_type=1, name="", tech_tree_id=-1, team_bonus_id=-1, resources=[], icon_set=0, units=civ_units)
+    encoded_units = b"".join([
+        template.write_int_16(len(civ_units)),
+        template.write_int_32_array(template.unit_pointers),
+        template.write_class_array(civ_units, version),
+    ])
+    compressor = zlib.compressobj(level=-1, wbits=-15)
+    with open(target_file, "wb") as f:
+        for section in SECTIONS:
+            if section != "civs":
+                f.write(compressor.compress(encode_section(df, section, version)))
+                continue
+            f.write(compressor.compress(df.write_int_16(len(df.civs))))
+            for civ in df.civs:
+                f.write(compressor.compress(encode_civ_header(civ)))
+                f.write(compressor.compress(encoded_units))
+        f.write(compressor.flush())
+
+
+# The DatFile with civs that don't have their units yet, and the units of a civ
+# With named_ids there are at least as many civs and technologies as it takes for every one named in constants/ to exist, the same goes for the unit slots
+def _make_parts(civs: int, units_per_civ: int, techs: int, effects: int, seed: int, named_ids: bool) -> tuple[DatFile, list[Unit | None]]:
+    for name, count in [("civs", civs), ("units_per_civ", units_per_civ), ("techs", techs), ("effects", effects)]:
+        # All of them are saved as or referred to by 16-bit numbers
+        if not 0 <= count <= MAX_INT16:
+            raise ValueError(f"{name} has to be between 0 and {MAX_INT16}, got {count}")
+    if named_ids:
+        civs = max(civs, NAMED_CIVS)
+        techs = max(techs, NAMED_TECHS)
+    rng = random.Random(seed)
+    civ_units = _make_units(units_per_civ, rng, named_ids)
+    unit_ids = [unit.id for unit in civ_units if unit is not None]
+    building_ids = [unit.id for unit in civ_units if unit is not None and unit.type == UnitType.Building]
+
+    # The first effects are the tech tree effects of the civs, the others belong to the technologies
+    tree_effect_count = civs if effects > civs else 0
+    tech_effect_ids = range(tree_effect_count, effects)
+    tech_list = [_make_tech(tech_id, techs, civs, tech_effect_ids, rng) for tech_id in range(techs)]
+
+    # Units are trained and technologies researched in the buildings, each of them with its own button in its building
+    buttons: dict[int, int] = {}
+    if building_ids:
+        for unit in civ_units:
+            if unit is not None and unit.type == UnitType.Creatable:
+                unit.creatable.train_location_id = rng.choice(building_ids)
+                unit.creatable.button_id = _next_button(buttons, unit.creatable.train_location_id)
+        for tech in tech_list:
+            tech.research_location = rng.choice(building_ids)
+            tech.button_id = _next_button(buttons, tech.research_location)
+    effect_list = [
+        _make_tree_effect(effect_id, techs, rng) if effect_id < tree_effect_count else _make_effect(effect_id, unit_ids, rng)
+        for effect_id in range(effects)
+    ]
+    civ_list = [_make_civ(civ_id, civ_id if civ_id < tree_effect_count else -1) for civ_id in range(civs)]
+
+    df = DatFile(
+        version=VERSION,
+        float_ptr_terrain_tables=[],
+        terrain_pass_graphic_pointers=[],
+        terrain_restrictions=[],
+        player_colours=[],
+        sounds=[],
+        graphics=[],
+        terrain_block=blank_terrain_block(),
+        random_maps=blank(RandomMaps),
+        effects=effect_list,
+        unit_headers=[],
+        civs=civ_list,
+        techs=tech_list,
+        time_slice=0,
+        unit_kill_rate=0,
+        unit_kill_total=0,
+        unit_hit_point_rate=0,
+        unit_hit_point_total=0,
+        razing_kill_rate=0,
+        razing_kill_total=0,
+        tech_tree=blank(TechTree),
+    )
+    return df, civ_units
+
+
+# Buttons are numbered from 1, and there are only so many of them. Later units and technologies share the last one
+def _next_button(buttons: dict[int, int], building_id: int) -> int:
+    buttons[building_id] = min(buttons.get(building_id, 0) + 1, 127)
+    return buttons[building_id]
+
+
+# A GenieClass with every number 0, every string and list empty, every optional part None and every tuple filled with blank values
+def blank(cls: type[GenieClass]) -> GenieClass:
+    return cls(**{field: make_value() for field, make_value in _field_factories(cls)})
+
+
+_factories: dict[type, list[tuple[str, typing.Callable[[], object]]]] = {}
+
+
+def _field_factories(cls: type[GenieClass]) -> list[tuple[str, typing.Callable[[], object]]]:
+    if cls not in _factories:
+        hints = typing.get_type_hints(cls)
+        _factories[cls] = [(field.name, _factory(hints[field.name])) for field in dataclasses.fields(cls)]
+    return _factories[cls]
+
+
+def _factory(hint) -> typing.Callable[[], object]:
+    if hint in (int, float, str):
+        value = hint()
+        return lambda: value
+    origin = typing.get_origin(hint)
+    if origin is list:
+        return list
+    if origin is tuple:
+        item_factories = [_factory(item_hint) for item_hint in typing.get_args(hint)]
+        return lambda: tuple(make_item() for make_item in item_factories)
+    if origin is types.UnionType:
+        return lambda: None
+    if isinstance(hint, type) and issubclass(hint, GenieClass):
+        return lambda: blank(hint)
+    raise TypeError(f"Don't know how to make a blank {hint}")
+
+
+# The terrain block always holds the same number of terrains and tile sizes, which the blank lists don't
+def blank_terrain_block() -> TerrainBlock:
+    terrain_block = blank(TerrainBlock)
+    terrain_block.tile_sizes = [blank(TileSize) for _ in range(TILE_TYPE_COUNT)]
+    terrain_block.terrains = [_blank_terrain() for _ in range(TERRAIN_COUNT)]
+    return terrain_block
+
+
+def _blank_terrain() -> Terrain:
+    terrain = blank(Terrain)
+    terrain.frame_data = [blank(FrameData) for _ in range(TILE_TYPE_COUNT)]
+    terrain.terrain_unit_masked_density = [0] * TERRAIN_UNITS_SIZE
+    terrain.terrain_unit_id = [0] * TERRAIN_UNITS_SIZE
+    terrain.terrain_unit_density = [0] * TERRAIN_UNITS_SIZE
+    terrain.terrain_unit_centering = [0] * TERRAIN_UNITS_SIZE
+    return terrain
+
+
+# The units of a civ. Units named in constants/units.py exist: the ones in the building lists (e.g. TOWN_CENTER_ALL) as buildings,
+# the others as units that can be trained, so that mods can change their attacks and costs
+# The other slots up to units_per_civ are random, some of them empty. With named_ids the slots after them, up to the last named unit, are empty
+def _make_units(units_per_civ: int, rng: random.Random, named_ids: bool) -> list[Unit | None]:
+    named_buildings = {unit_id for value in vars(units).values() if isinstance(value, list) for unit_id in value}
+    named_units = {value for value in vars(units).values() if isinstance(value, int)} - named_buildings
+    unit_types = list(UNIT_TYPE_WEIGHTS)
+    weights = list(UNIT_TYPE_WEIGHTS.values())
+    civ_units = []
+    for unit_id in range(max(units_per_civ, max(named_buildings | named_units) + 1) if named_ids else units_per_civ):
+        if unit_id in named_buildings:
+            unit_type, class_ = UnitType.Building, unit_classes.BUILDING
+        elif unit_id in named_units:
+            unit_type, class_ = UnitType.Creatable, rng.choice(CREATABLE_CLASSES)
+        elif unit_id >= units_per_civ or rng.random() < 0.15:
+            civ_units.append(None)
+            continue
+        else:
+            unit_type = rng.choices(unit_types, weights)[0]
+            class_ = rng.choice(UNIT_TYPE_CLASSES[unit_type])
+        civ_units.append(make_unit(unit_id, unit_type, class_, rng))
+    return civ_units
+
+
+# A unit of the given type, with the parts a unit of that type has, see Unit.to_bytes
+def make_unit(unit_id: int, unit_type: int, class_: int, rng: random.Random) -> Unit:
+    unit = blank(Unit)
+    unit.type = unit_type
+    unit.id = unit_id
+    unit.copy_id = unit_id
+    unit.base_id = unit_id
+    unit.class_ = class_
+    unit.name = f"Unit {unit_id}"
+    unit.language_dll_name = 5000 + unit_id
+    unit.language_dll_creation = 6000 + unit_id
+    unit.standing_graphic = (rng.randrange(10000), -1)
+    unit.dying_graphic = rng.randrange(10000)
+    unit.undead_graphic = -1
+    unit.hit_points = rng.randint(1000, 4800) if unit_type == UnitType.Building else rng.randint(1, 300)
+    unit.line_of_sight = float(rng.randint(2, 12))
+    unit.collision_size_x = unit.collision_size_y = rng.choice(EXACT_FRACTIONS)
+    unit.collision_size_z = 2.0
+    unit.dead_unit_id = -1
+    unit.blood_unit_id = -1
+    unit.icon_id = rng.randrange(500)
+    unit.enabled = 1
+    unit.resource_storages = (ResourceStorage(-1, 0.0, 0), ResourceStorage(-1, 0.0, 0), ResourceStorage(-1, 0.0, 0))
+    if unit_type >= UnitType.Flag and unit_type != UnitType.AoeTrees:
+        unit.speed = 0.0 if unit_type == UnitType.Building else rng.choice(EXACT_FRACTIONS)
+    if unit_type >= UnitType.DeadFish and unit_type != UnitType.AoeTrees:
+        unit.dead_fish = blank(DeadFish)
+        unit.dead_fish.walking_graphic = rng.randrange(10000)
+        unit.dead_fish.running_graphic = -1
+        unit.dead_fish.tracking_unit = -1
+    if unit_type >= UnitType.Bird and unit_type != UnitType.AoeTrees:
+        unit.bird = _make_bird(unit_type, rng)
+    if unit_type >= UnitType.Combatant and unit_type != UnitType.AoeTrees:
+        unit.type_50 = _make_type_50(rng)
+    if unit_type == UnitType.Projectile:
+        unit.projectile = blank(Projectile)
+    if unit_type in (UnitType.Creatable, UnitType.Building):
+        unit.creatable = _make_creatable(unit_type, rng)
+        if unit_type == UnitType.Creatable:
+            # Trainable units take up population, like in the real data
+            unit.resource_storages = (
+                ResourceStorage(resources.POPULATION_HEADROOM, -1.0, 2),
+                ResourceStorage(resources.CURRENT_POPULATION, 1.0, 2),
+                ResourceStorage(resources.TOTAL_UNITS_OWNED, 1.0, 1),
+            )
+    if unit_type == UnitType.Building:
+        unit.building = _make_building(rng)
+    return unit
+
+
+def _make_bird(unit_type: int, rng: random.Random) -> Bird:
+    bird = blank(Bird)
+    bird.default_task_id = -1
+    bird.search_radius = float(rng.randint(0, 12))
+    bird.work_rate = rng.choice(EXACT_FRACTIONS)
+    task_count = rng.randint(1, 8) if unit_type in (UnitType.Creatable, UnitType.Bird) else rng.randint(0, 2)
+    bird.tasks = [_make_task(task_id, rng) for task_id in range(task_count)]
+    return bird
+
+
+def _make_task(task_id: int, rng: random.Random) -> Task:
+    task = blank(Task)
+    task.task_type = 1
+    task.id = task_id
+    task.is_default = 1 if task_id == 0 else 0
+    task.action_type = rng.choice([5, 6, 7, 10, 12, 101, 104, 105])
+    task.class_id = rng.choice([-1, *CREATABLE_CLASSES])
+    task.unit_id = -1
+    task.terrain_id = -1
+    task.resource_in = rng.choice([-1, resources.FOOD, resources.WOOD, resources.STONE, resources.GOLD])
+    task.resource_multiplier = -1
+    task.resource_out = -1
+    task.unused_resource = -1
+    task.work_value_1 = rng.choice(EXACT_FRACTIONS)
+    task.work_range = float(rng.randint(0, 6))
+    task.moving_graphic_id = rng.randrange(10000)
+    task.proceeding_graphic_id = rng.randrange(10000)
+    task.working_graphic_id = rng.randrange(10000)
+    task.carrying_graphic_id = rng.randrange(10000)
+    task.resource_gathering_sound_id = -1
+    task.resource_deposit_sound_id = -1
+    return task
+
+
+# Every fighting unit attacks and is armoured against melee and pierce, with a few bonus classes on top
+def _make_type_50(rng: random.Random) -> Type50:
+    type_50 = blank(Type50)
+    type_50.base_armor = 1000
+    type_50.attacks = [AttackOrArmor(class_, amount) for class_, amount in _armor_values(rng, 1, 6)]
+    type_50.armours = [AttackOrArmor(class_, amount) for class_, amount in _armor_values(rng, 0, 4)]
+    type_50.defense_terrain_bonus = -1
+    type_50.max_range = float(rng.randint(0, 8))
+    type_50.reload_time = rng.choice(EXACT_FRACTIONS) * 2
+    type_50.projectile_unit_id = -1
+    type_50.accuracy_percent = 100
+    type_50.displayed_attack = type_50.attacks[0].amount
+    type_50.displayed_melee_armour = type_50.armours[0].amount
+    type_50.displayed_range = type_50.max_range
+    type_50.displayed_reload_time = type_50.reload_time
+    type_50.attack_graphic = rng.randrange(10000)
+    type_50.attack_graphic_2 = -1
+    return type_50
+
+
+def _armor_values(rng: random.Random, minimum: int, maximum: int) -> list[tuple[int, int]]:
+    bonus_classes = rng.sample(BONUS_ARMOR_CLASSES, rng.randint(minimum, maximum))
+    return [(class_, rng.randint(0, 12)) for class_ in BASE_ARMOR_CLASSES + bonus_classes]
+
+
+# Costs are made the way mods make them, see helpers.costs_array_to_unit_cost
+def _make_creatable(unit_type: int, rng: random.Random) -> Creatable:
+    creatable = blank(Creatable)
+    is_building = unit_type == UnitType.Building
+    stockpile_costs = [0, 0, 0, 0]
+    for resource in rng.sample(range(4), rng.randint(1, 2)):
+        stockpile_costs[resource] = rng.randint(1, 60) * 5
+    creatable.resource_costs = helpers.costs_array_to_unit_cost(stockpile_costs, is_building)
+    creatable.train_time = rng.randint(20, 150) if is_building else rng.randint(5, 60)
+    creatable.train_location_id = -1
+    creatable.garrison_graphic = -1
+    creatable.spawning_graphic = -1
+    creatable.upgrade_graphic = -1
+    creatable.hero_glow_graphic = -1
+    creatable.idle_attack_graphic = -1
+    creatable.charge_projectile_unit = -1
+    creatable.secondary_projectile_unit = -1
+    creatable.special_graphic = -1
+    creatable.button_icon_id = -1
+    creatable.displayed_pierce_armor = rng.randint(0, 10)
+    return creatable
+
+
+def _make_building(rng: random.Random) -> Building:
+    building = blank(Building)
+    building.construction_graphic_id = rng.randrange(10000)
+    building.snow_graphic_id = -1
+    building.destruction_graphic_id = -1
+    building.destruction_rubble_graphic_id = -1
+    building.researching_graphic = -1
+    building.research_completed_graphic = -1
+    building.stack_unit_id = -1
+    building.foundation_terrain_id = -1
+    building.old_overlap_id = -1
+    building.tech_id = -1
+    building.annexes = tuple(BuildingAnnex(-1, 0.0, 0.0) for _ in range(4))
+    building.head_unit = -1
+    building.transform_unit = -1
+    building.transform_sound = -1
+    building.construction_sound = -1
+    building.pile_unit = -1
+    return building
+
+
+# Every technology requires an age, and some another technology as well. The ages require the age before them
+# Most technologies are available to every civ, some only to one of them
+def _make_tech(tech_id: int, tech_count: int, civ_count: int, effect_ids: range, rng: random.Random) -> Tech:
+    tech = blank(Tech)
+    tech.name = f"Tech {tech_id}"
+    ages = [age for age in (techs.DARK_AGE, techs.FEUDAL_AGE, techs.CASTLE_AGE, techs.IMPERIAL_AGE) if age < tech_count]
+    if tech_id == techs.DARK_AGE:
+        required_techs = []
+    elif tech_id in ages:
+        required_techs = [techs.DARK_AGE if tech_id == techs.FEUDAL_AGE else tech_id - 1]
+    else:
+        required_techs = [rng.choice(ages)] if ages else []
+        if tech_id > len(ages) and rng.random() < 0.3:
+            earlier_tech = rng.randrange(tech_id)
+            if earlier_tech not in ages:
+                required_techs.append(earlier_tech)
+    tech.required_techs = tuple(required_techs + [-1] * (6 - len(required_techs)))
+    tech.required_tech_count = len(required_techs)
+    stockpile_costs = [0, 0, 0, 0]
+    for resource in rng.sample(range(4), rng.randint(1, 3)):
+        stockpile_costs[resource] = rng.randint(1, 200) * 5
+    tech.resource_costs = helpers.costs_array_to_tech_research_cost(stockpile_costs)
+    tech.civ = rng.randrange(1, civ_count) if civ_count > 1 and tech_id not in ages and rng.random() < 0.1 else -1
+    tech.research_location = -1
+    tech.research_time = rng.randint(10, 150)
+    tech.effect_id = effect_ids[tech_id % len(effect_ids)] if effect_ids else -1
+    tech.language_dll_name = 7000 + tech_id
+    tech.language_dll_description = 8000 + tech_id
+    tech.icon_id = rng.randrange(200)
+    tech.hot_key = -1
+    tech.repeatable = 1
+    return tech
+
+
+# Attribute modifiers for single units and whole classes, resource modifiers, and enabling and upgrading units
+def _make_effect(effect_id: int, unit_ids: list[int], rng: random.Random) -> Effect:
+    attribute_modifiers = [command_types.ATTRIBUTE_MODIFIER_ADDITIVE, command_types.ATTRIBUTE_MODIFIER_MULTIPLICATIVE, command_types.ATTRIBUTE_MODIFIER_SET]
+    commands = []
+    for _ in range(rng.randint(1, 8)):
+        command_type = rng.choice([*attribute_modifiers, command_types.ATTRIBUTE_MODIFIER_ADDITIVE, command_types.RESOURCE_MODIFIER_SET_ADDITIVE, command_types.ENABLE_DISABLE_UNIT, command_types.UPGRADE_UNIT])
+        if command_type in attribute_modifiers:
+            unit_id, class_ = (rng.choice(unit_ids), -1) if unit_ids and rng.random() < 0.6 else (-1, rng.choice(CREATABLE_CLASSES))
+            attribute = rng.choice([*MODIFIED_ATTRIBUTES, attributes.ATTACK, attributes.ARMOR])
+            if attribute in (attributes.ATTACK, attributes.ARMOR):
+                d = helpers.amount_type_to_d(rng.randint(1, 4), rng.choice(BASE_ARMOR_CLASSES + BONUS_ARMOR_CLASSES))
+            elif command_type == command_types.ATTRIBUTE_MODIFIER_MULTIPLICATIVE:
+                d = rng.choice(EXACT_FRACTIONS)
+            else:
+                d = float(rng.randint(1, 50))
+            commands.append(EffectCommand(command_type, unit_id, class_, attribute, d))
+        elif command_type == command_types.RESOURCE_MODIFIER_SET_ADDITIVE:
+            commands.append(EffectCommand(command_type, rng.randrange(RESOURCE_COUNT), 1, -1, float(rng.randint(-100, 100))))
+        elif not unit_ids:
+            continue
+        elif command_type == command_types.ENABLE_DISABLE_UNIT:
+            commands.append(EffectCommand(command_type, rng.choice(unit_ids), 1, -1, 0.0))
+        else:
+            commands.append(EffectCommand(command_type, rng.choice(unit_ids), rng.choice(unit_ids), -1, 0.0))
+    return Effect(name=f"Effect {effect_id}", effect_commands=commands)
+
+
+# The tech tree effect of a civ disables a few technologies for it, but never the ages
+def _make_tree_effect(effect_id: int, tech_count: int, rng: random.Random) -> Effect:
+    ages = {techs.DARK_AGE, techs.FEUDAL_AGE, techs.CASTLE_AGE, techs.IMPERIAL_AGE}
+    disabled = [tech_id for tech_id in range(tech_count) if tech_id not in ages and rng.random() < 0.05]
+    commands = [EffectCommand(command_types.DISABLE_TECH, -1, -1, -1, float(tech_id)) for tech_id in disabled]
+    return Effect(name=f"Tech Tree {effect_id}", effect_commands=commands)
+
+
+# Civs named in constants/civilizations.py get their name
+def _make_civ(civ_id: int, tech_tree_id: int) -> Civ:
+    names = {value: name.replace("_", " ").title() for name, value in vars(civilizations).items() if isinstance(value, int)}
+    civ_resources = [0.0] * RESOURCE_COUNT
+    civ_resources[resources.FOOD] = civ_resources[resources.WOOD] = civ_resources[resources.STONE] = 200.0
+    civ_resources[resources.GOLD] = 100.0
+    civ_resources[resources.POPULATION_HEADROOM] = 5.0
+    return Civ(
+        player_type=0 if civ_id == civilizations.GAIA else 1,
+        name=names.get(civ_id, f"Civ {civ_id}"),
+        tech_tree_id=tech_tree_id,
+        team_bonus_id=-1,
+        resources=civ_resources,
+        icon_set=civ_id % 8,
+        units=[],
+    )
@@ -0,0 +1,589 @@
+import dataclasses
+import operator
+import os
+import zlib
+from os import PathLike
+from pathlib import Path
+from types import ModuleType, UnionType
+from typing import Iterable, Iterator, Union, get_args, get_origin
+
+from genieutils.civ import Civ
+from genieutils.common import ByteHandler
+from genieutils.datfile import DatFile
+from genieutils.effect import Effect
+from genieutils.graphic import Graphic
+from genieutils.playercolour import PlayerColour
+from genieutils.randommaps import RandomMaps
+from genieutils.sound import Sound
+from genieutils.tech import Tech
+from genieutils.techtree import TechTree
+from genieutils.terrainblock import TerrainBlock
+from genieutils.terrainrestriction import TerrainRestriction
+from genieutils.unit import Unit
+from genieutils.unitheaders import UnitHeaders
+from genieutils.versions import Version
+
+from tools.mapped import open_uncompressed
+from tools.warmup import file_state
+
+NAME = "tracking"
+
+# Saving a DatFile encodes every section of it again, even though most mods only change a few of them
+# The tracker remembers where every section (and every unit of every civ) starts and ends in the uncompressed base file,
+# so that saving can copy the bytes of the unchanged parts straight from the base file and only encode the parts that changed
+#
+# Sections, in the order they are written, with the DatFile fields each of them holds
+SECTIONS = {
+    "version": ["version"],
+    "terrain_restrictions": ["float_ptr_terrain_tables", "terrain_pass_graphic_pointers", "terrain_restrictions"],
+    "player_colours": ["player_colours"],
+    "sounds": ["sounds"],
+    "graphics": ["graphics"],
+    "terrain_block": ["terrain_block"],
+    "random_maps": ["random_maps"],
+    "effects": ["effects"],
+    "unit_headers": ["unit_headers"],
+    "civs": ["civs"],
+    "techs": ["techs"],
+    "kill_rates": ["time_slice", "unit_kill_rate", "unit_kill_total", "unit_hit_point_rate", "unit_hit_point_total", "razing_kill_rate", "razing_kill_total"],
+    "tech_tree": ["tech_tree"],
+}
+
+# Which sections a mod changes is declared with MODIFIED_SECTIONS in its module, using the DatFile field names, e.g. ["techs", "effects"]
+# Mods that don't declare it are assumed to change everything
+# A declaration that leaves out something the mod changes would lose that change when saving. Saving compares the values of every unit and section element
+# that wasn't marked against the values it had when tracking started, and encodes the ones that differ again, see DirtyTracker.mark_changed_values()
+# That only looks at the values held by the units and elements themselves, e.g. the hit points of a unit or its costs being replaced,
+# changes further down like the amount of a cost that is changed in place are only found by find_undeclared_changes()
+# Units don't have to be declared with "civs" when the mod only changes units it looked up through mods/indexes.py or changed with mods/rules.py,
+# because the unit index marks every unit it returns (unless asked not to) and the rules mark every unit they change. Units added to or replaced in a civ are noticed as well
+ALL_SECTIONS = [field for fields in SECTIONS.values() for field in fields]
+
+# The zlib compression level of saved dat files: 1 is the fastest, 9 the smallest and 0 doesn't compress at all
+# -1 is zlib's default (6), which DatFile.save uses as well
+DEFAULT_COMPRESSION_LEVEL = -1
+COMPRESSION_LEVELS = range(-1, 10)
+
+SECTION_CLASSES = {
+    "player_colours": PlayerColour,
+    "sounds": Sound,
+    "terrain_block": TerrainBlock,
+    "random_maps": RandomMaps,
+    "effects": Effect,
+    "unit_headers": UnitHeaders,
+    "techs": Tech,
+    "tech_tree": TechTree,
+}
+
+
+# Where every section starts and ends in the uncompressed base file
+# For the civs the range of every unit is kept as well, None for the empty unit slots
+class DatLayout:
+    def __init__(self, sections: dict[str, tuple[int, int]], unit_ranges: list[list[tuple[int, int] | None]]):
+        self.sections = sections
+        self.unit_ranges = unit_ranges
+
+    # The length of the uncompressed file, which ends with the last section
+    def size(self) -> int:
+        return self.sections["tech_tree"][1]
+
+
+# Parse a dat file the same way DatFile.parse does, but also record the layout of the file
+# With a scratch_dir the uncompressed file is memory-mapped instead of read into memory, see tools/mapped.py
+def parse_with_layout(input_file: Path | PathLike | str, scratch_dir: Path | None = None) -> tuple[DatFile, DatLayout]:
+    data = open_uncompressed(input_file, scratch_dir)
+    content = ByteHandler(data)
+    values = {}
+    sections = {}
+    unit_ranges = []
+    for section in SECTIONS:
+        start = content.offset
+        if section == "civs":
+            civs = []
+            for _ in range(content.read_int_16()):
+                civ, civ_unit_ranges = read_civ(content)
+                civs.append(civ)
+                unit_ranges.append(civ_unit_ranges)
+            values["civs"] = civs
+        else:
+            values.update(read_section(content, section))
+        sections[section] = (start, content.offset)
+    return DatFile(**values), DatLayout(sections, unit_ranges)
+
+
+# Read one section, other than the civs, the same way DatFile.from_bytes does and return the values of its fields
+def read_section(content: ByteHandler, section: str) -> dict:
+    if section == "version":
+        version = content.read_string(8)
+        content.version = Version(version)
+        return {"version": version}
+    if section == "terrain_restrictions":
+        terrain_restrictions_size = content.read_int_16()
+        terrains_used_1 = content.read_int_16()
+        return {
+            "float_ptr_terrain_tables": content.read_int_32_array(terrain_restrictions_size),
+            "terrain_pass_graphic_pointers": content.read_int_32_array(terrain_restrictions_size),
+            "terrain_restrictions": content.read_class_array_with_param(TerrainRestriction, terrain_restrictions_size, terrains_used_1),
+        }
+    if section == "graphics":
+        graphics_size = content.read_int_16()
+        return {"graphics": content.read_class_array_with_pointers(Graphic, graphics_size, content.read_int_32_array(graphics_size))}
+    if section in ("player_colours", "sounds", "techs"):
+        return {section: content.read_class_array(SECTION_CLASSES[section], content.read_int_16())}
+    if section in ("effects", "unit_headers"):
+        return {section: content.read_class_array(SECTION_CLASSES[section], content.read_int_32())}
+    if section == "kill_rates":
+        return {field: content.read_int_32() for field in SECTIONS["kill_rates"]}
+    return {section: content.read_class(SECTION_CLASSES[section])}
+
+
+# Records what changed in a DatFile since it was parsed from the base file
+# The uncompressed base file is opened right away and kept open until saving, so that the unchanged parts are copied from the bytes
+# the DatFile was parsed from, even if the base file gets replaced in the meantime, e.g. while create_mod.py --serve keeps running
+# The layout only fits those bytes if the file didn't change since source_state, the state of the file (see warmup.file_state) from before
+# it was hashed to find the cached DatFile and layout. Without a source_state the file is assumed to be unchanged until now
+class DirtyTracker:
+    def __init__(self, df: DatFile, input_file: Path | PathLike | str, layout: DatLayout, scratch_dir: Path | None = None, source_state: tuple[int, int, int] | None = None):
+        self.df = df
+        self.input_file = Path(input_file)
+        self.layout = layout
+        self.scratch_dir = scratch_dir
+        state = file_state(self.input_file) if source_state is None else source_state
+        self.data = open_uncompressed(self.input_file, scratch_dir)
+        if file_state(self.input_file) != state or len(self.data) != layout.size():
+            raise ValueError(f"{self.input_file} changed since it was loaded, load it again before modifying it")
+        self.dirty_sections: set[str] = set()
+        self.dirty_civs: set[int] = set()
+        # Units are marked by identity, so that marking doesn't depend on where the unit sits in its civ
+        self.dirty_units: set[int] = set()
+        # Sections whose value got replaced or whose list changed length, and units that got replaced, are noticed by comparing against these
+        # They hold on to the original objects, so that a new object can never end up with the id of an original one
+        # Lazily loaded sections and units that weren't decoded yet are left out, see tools/lazy.py
+        self._sections = {field: _shape(getattr(df, field)) for field in ALL_SECTIONS if is_loaded(df, field)}
+        self._civs = list(df.civs)
+        self._units = [list(civ.units) if is_loaded(civ, "units") else None for civ in df.civs]
+        # The values of the sections and units, see get_values()
+        self._values = {field: get_values(getattr(df, field)) for field in ALL_SECTIONS if field != "civs" and is_loaded(df, field)}
+        self._unit_values = [get_values(units) if units is not None else None for units in self._units]
+
+    def mark_sections(self, *fields: str):
+        for field in fields:
+            if field not in ALL_SECTIONS:
+                raise ValueError(f"Unknown DatFile section {field}, expected one of {ALL_SECTIONS}")
+        self.dirty_sections.update(fields)
+
+    def mark_all(self):
+        self.dirty_sections.update(ALL_SECTIONS)
+
+    def mark_civ(self, civ_id: int):
+        self.dirty_civs.add(civ_id)
+
+    def mark_units(self, units: list[Unit]):
+        self.dirty_units.update(id(unit) for unit in units)
+
+    # The names of the sections that have to be encoded again, in file order
+    def changed_sections(self) -> list[str]:
+        changed = []
+        for section, fields in SECTIONS.items():
+            for field in fields:
+                # A lazily loaded section that was never decoded can't have been changed
+                if not is_loaded(self.df, field):
+                    continue
+                if field in self.dirty_sections or not _same_shape(_shape(getattr(self.df, field)), self._original_shape(field)):
+                    changed.append(section)
+                    break
+        return changed
+
+    def to_bytes(self) -> bytes:
+        return b"".join(self.chunks())
+
+    # The unchanged sections are slices of the uncompressed base file, so they are never copied on the way to the compressor
+    # Returns what was changed without being declared, which is encoded again as well, see mark_changed_values()
+    def save(self, target_file: Path | PathLike | str, compression_level: int = DEFAULT_COMPRESSION_LEVEL) -> list[str]:
+        undeclared = self.mark_changed_values()
+        write_compressed(target_file, self.chunks(), compression_level)
+        return undeclared
+
+    # Mark the sections and units whose values differ from when tracking started although nothing marked them, and return them
+    # Comparing the values is about ten times faster than encoding them, so it is done on every save, unlike find_undeclared_changes()
+    def mark_changed_values(self) -> list[str]:
+        changed = self.changed_sections()
+        undeclared = []
+        for section in SECTIONS:
+            if section in changed:
+                continue
+            if section != "civs":
+                if any(get_values(getattr(self.df, field)) != self._original_values(field) for field in SECTIONS[section] if is_loaded(self.df, field)):
+                    self.dirty_sections.update(SECTIONS[section])
+                    undeclared.append(section)
+                continue
+            for civ_id, civ in enumerate(self.df.civs):
+                unchanged_units = self.unchanged_units(civ_id)
+                if not unchanged_units:
+                    continue
+                original_values = self._original_unit_values(civ_id, civ)
+                changed_ids = [unit_id for unit_id in sorted(unchanged_units) if get_values(civ.units[unit_id]) != original_values[unit_id]]
+                self.mark_units([civ.units[unit_id] for unit_id in changed_ids])
+                undeclared.extend(f"civs[{civ_id}].units[{unit_id}]" for unit_id in changed_ids)
+        return undeclared
+
+    # The encoded DatFile in pieces, in file order
+    # The pieces are encoded one at a time while they are consumed, so only the piece being compressed is held in memory
+    def chunks(self) -> Iterator[bytes | memoryview]:
+        data = self.data
+        version = Version(self.df.version)
+        changed = self.changed_sections()
+        for section in SECTIONS:
+            if section == "civs" and section not in changed:
+                yield self.df.write_int_16(len(self.df.civs))
+                for civ_id, civ in enumerate(self.df.civs):
+                    yield from self._civ_chunks(data, version, civ_id, civ)
+            elif section in changed:
+                yield from section_chunks(self.df, section, version)
+            else:
+                start, end = self.layout.sections[section]
+                yield data[start:end]
+
+    # The civ header is tiny and always encoded again, the units are copied from the base file unless they changed
+    def _civ_chunks(self, data: memoryview, version: Version, civ_id: int, civ: Civ) -> Iterator[bytes | memoryview]:
+        if civ_id in self.dirty_civs:
+            yield from _civ_chunks(civ, version)
+            return
+        yield encode_civ_header(civ)
+        if not is_loaded(civ, "units"):
+            yield civ.raw_units()
+            return
+        yield civ.write_int_16(len(civ.units))
+        yield civ.write_int_32_array(civ.unit_pointers)
+        unchanged_units = self.unchanged_units(civ_id)
+        unit_ranges = self.layout.unit_ranges[civ_id]
+        for unit_id, unit in enumerate(civ.units):
+            if unit is None:
+                continue
+            if unit_id in unchanged_units:
+                start, end = unit_ranges[unit_id]
+                yield data[start:end]
+            else:
+                yield unit.to_bytes(version)
+
+    # The indexes of the units of a civ that saving copies from the base file instead of encoding them again
+    # None if the units of the civ were never decoded (see tools/lazy.py), in which case all of them are copied
+    def unchanged_units(self, civ_id: int) -> set[int] | None:
+        civ = self.df.civs[civ_id]
+        if civ_id in self.dirty_civs:
+            return set()
+        if not is_loaded(civ, "units"):
+            return None
+        original_units = self._original_units(civ_id, civ)
+        return {
+            unit_id
+            for unit_id, unit in enumerate(civ.units[: len(original_units)])
+            if unit is not None and original_units[unit_id] is unit and id(unit) not in self.dirty_units
+        }
+
+    # Everything that saving would copy from the base file although it differs from it, e.g. a unit changed by a mod whose MODIFIED_SECTIONS leave out "civs"
+    # Takes about as long as encoding the whole DatFile, which is what the tracker saves, so it is meant for checking mods rather than for every build
+    def find_undeclared_changes(self) -> list[str]:
+        version = Version(self.df.version)
+        changed = self.changed_sections()
+        undeclared = []
+        for section in SECTIONS:
+            if section in changed:
+                continue
+            if section != "civs":
+                start, end = self.layout.sections[section]
+                if encode_section(self.df, section, version) != self.data[start:end]:
+                    undeclared.append(section)
+                continue
+            for civ_id, civ in enumerate(self.df.civs):
+                # The civ header is always encoded again, see _civ_chunks()
+                if civ_id in self.dirty_civs:
+                    continue
+                unchanged_units = self.unchanged_units(civ_id) or set()
+                for unit_id in sorted(unchanged_units):
+                    start, end = self.layout.unit_ranges[civ_id][unit_id]
+                    if civ.units[unit_id].to_bytes(version) != self.data[start:end]:
+                        undeclared.append(f"civs[{civ_id}].units[{unit_id}]")
+        return undeclared
+
+    def _original_shape(self, field: str) -> tuple[object, int]:
+        if field not in self._sections:
+            # Decoded after tracking started, so it was unchanged right after it was decoded
+            self._sections[field] = self.df.original_shape(field)
+        return self._sections[field]
+
+    def _original_values(self, field: str):
+        if field not in self._values:
+            self._values[field] = self.df.original_values(field)
+        return self._values[field]
+
+    # Only called for civs with unchanged units, which were neither replaced nor added after tracking started, see unchanged_units()
+    def _original_unit_values(self, civ_id: int, civ: Civ) -> list[tuple | None]:
+        if self._unit_values[civ_id] is None:
+            self._unit_values[civ_id] = civ.original_values()
+        return self._unit_values[civ_id]
+
+    def _original_units(self, civ_id: int, civ: Civ) -> list[Unit | None]:
+        if civ_id >= len(self._civs):
+            return []
+        if self._units[civ_id] is not None:
+            return self._units[civ_id]
+        # The units of this civ were decoded after tracking started, see tools/lazy.py
+        # If the civ itself got replaced, none of its units can be copied from the base file
+        if civ is not self._civs[civ_id]:
+            return []
+        return civ.original_units()
+
+
+_tracker: DirtyTracker | None = None
+
+
+# Start tracking the changes made to a DatFile parsed from input_file
+# Only the most recently tracked DatFile is kept track of
+def track(df: DatFile, input_file: Path | PathLike | str, layout: DatLayout, scratch_dir: Path | None = None, source_state: tuple[int, int, int] | None = None) -> DirtyTracker:
+    global _tracker
+    _tracker = DirtyTracker(df, input_file, layout, scratch_dir, source_state)
+    return _tracker
+
+
+def get_tracker(df: DatFile) -> DirtyTracker | None:
+    if _tracker is None or _tracker.df is not df:
+        return None
+    return _tracker
+
+
+# The functions below do nothing for DatFiles that aren't tracked, so they can be called from anywhere
+def mark_module(df: DatFile, module: ModuleType):
+    tracker = get_tracker(df)
+    if tracker is not None:
+        tracker.mark_sections(*getattr(module, "MODIFIED_SECTIONS", ALL_SECTIONS))
+
+
+def mark_sections(df: DatFile, *fields: str):
+    tracker = get_tracker(df)
+    if tracker is not None:
+        tracker.mark_sections(*fields)
+
+
+def mark_civ(df: DatFile, civ_id: int):
+    tracker = get_tracker(df)
+    if tracker is not None:
+        tracker.mark_civ(civ_id)
+
+
+def mark_units(df: DatFile, units: list[Unit]):
+    tracker = get_tracker(df)
+    if tracker is not None:
+        tracker.mark_units(units)
+
+
+# The parts of a tracked DatFile that were changed without being declared, see DirtyTracker.find_undeclared_changes()
+def find_undeclared_changes(df: DatFile) -> list[str]:
+    tracker = get_tracker(df)
+    return [] if tracker is None else tracker.find_undeclared_changes()
+
+
+# Save a DatFile, only encoding what changed if it is tracked
+# Unlike DatFile.save, the encoded DatFile is never held in memory as a whole, see write_compressed()
+def save(df: DatFile, target_file: Path | PathLike | str, compression_level: int = DEFAULT_COMPRESSION_LEVEL):
+    tracker = get_tracker(df)
+    if tracker is None:
+        write_compressed(target_file, encode_chunks(df), compression_level)
+        return
+    undeclared = tracker.save(target_file, compression_level)
+    if undeclared:
+        print(f"Warning: the mods changed {', '.join(undeclared[:10])}{' and more' if len(undeclared) > 10 else ''} without declaring it in MODIFIED_SECTIONS, so they were encoded again")
+
+
+# Compress the chunks of an encoded DatFile into target_file while they are encoded, the same raw deflate stream DatFile.save writes
+# The file is only put in place once it is complete, so a save that fails never leaves a broken dat file behind
+# Unlike the cache files (see cache.write_atomic) it gets the usual permissions of new files, the game may run as another user
+def write_compressed(target_file: Path | PathLike | str, chunks: Iterable[bytes | memoryview], compression_level: int = DEFAULT_COMPRESSION_LEVEL):
+    target_file = Path(target_file)
+    tmp_file = target_file.with_name(f".{target_file.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_file, "wb") as f:
+            for compressed in _compress(chunks, compression_level):
+                f.write(compressed)
+        os.replace(tmp_file, target_file)
+    except BaseException:
+        tmp_file.unlink(missing_ok=True)
+        raise
+
+
+def _compress(chunks: Iterable[bytes | memoryview], compression_level: int) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level=compression_level, wbits=-15)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        # Most chunks are small enough that the compressor keeps them until it has a whole block together
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+# The encoded DatFile in pieces, in file order, the same bytes DatFile.to_bytes returns
+def encode_chunks(df: DatFile) -> Iterator[bytes]:
+    version = Version(df.version)
+    for section in SECTIONS:
+        yield from section_chunks(df, section, version)
+
+
+def read_civ(content: ByteHandler) -> tuple[Civ, list[tuple[int, int] | None]]:
+    header = read_civ_header(content)
+    units, unit_ranges = read_civ_units(content)
+    return Civ(**header, units=units), unit_ranges
+
+
+# Everything of a civ up to its units
+def read_civ_header(content: ByteHandler) -> dict:
+    player_type = content.read_int_8()
+    name = content.read_debug_string()
+    resources_size = content.read_int_16()
+    tech_tree_id = content.read_int_16()
+    team_bonus_id = content.read_int_16()
+    return {
+        "player_type": player_type,
+        "name": name,
+        "tech_tree_id": tech_tree_id,
+        "team_bonus_id": team_bonus_id,
+        "resources": content.read_float_array(resources_size),
+        "icon_set": content.read_int_8(),
+    }
+
+
+# Encode everything of a civ up to its units, the same way Civ.to_bytes does
+def encode_civ_header(civ: Civ) -> bytes:
+    return b"".join([
+        civ.write_int_8(civ.player_type),
+        civ.write_debug_string(civ.name),
+        civ.write_int_16(len(civ.resources)),
+        civ.write_int_16(civ.tech_tree_id),
+        civ.write_int_16(civ.team_bonus_id),
+        civ.write_float_array(civ.resources),
+        civ.write_int_8(civ.icon_set),
+    ])
+
+
+# The units of a civ together with the range of every unit, None for the empty unit slots
+def read_civ_units(content: ByteHandler) -> tuple[list[Unit | None], list[tuple[int, int] | None]]:
+    units_size = content.read_int_16()
+    units = []
+    unit_ranges = []
+    for unit_pointer in content.read_int_32_array(units_size):
+        if not unit_pointer:
+            units.append(None)
+            unit_ranges.append(None)
+            continue
+        start = content.offset
+        units.append(Unit.from_bytes(content))
+        unit_ranges.append((start, content.offset))
+    return units, unit_ranges
+
+
+# Encode one section the same way DatFile.to_bytes does
+def encode_section(df: DatFile, section: str, version: Version) -> bytes:
+    return b"".join(section_chunks(df, section, version))
+
+
+# Encode one section in pieces, one element of a list at a time
+def section_chunks(df: DatFile, section: str, version: Version) -> Iterator[bytes]:
+    if section == "version":
+        yield df.write_string(8, df.version)
+    elif section == "terrain_restrictions":
+        terrains_used = 0
+        if df.terrain_restrictions:
+            terrains_used = len(df.terrain_restrictions[0].passable_buildable_dmg_multiplier)
+        yield df.write_int_16(len(df.terrain_restrictions))
+        yield df.write_int_16(terrains_used)
+        yield df.write_int_32_array(df.float_ptr_terrain_tables)
+        yield df.write_int_32_array(df.terrain_pass_graphic_pointers)
+        yield from _class_chunks(df.terrain_restrictions, version)
+    elif section == "civs":
+        yield df.write_int_16(len(df.civs))
+        for civ in df.civs:
+            yield from _civ_chunks(civ, version)
+    elif section in ("player_colours", "sounds", "techs"):
+        values = getattr(df, section)
+        yield df.write_int_16(len(values))
+        yield from _class_chunks(values, version)
+    elif section == "graphics":
+        yield df.write_int_16(len(df.graphics))
+        yield df.write_int_32_array(df.graphic_pointers)
+        yield from _class_chunks(df.graphics, version)
+    elif section in ("effects", "unit_headers"):
+        values = getattr(df, section)
+        yield df.write_int_32(len(values))
+        yield from _class_chunks(values, version)
+    elif section == "kill_rates":
+        for field in SECTIONS["kill_rates"]:
+            yield df.write_int_32(getattr(df, field))
+    else:
+        yield df.write_class(getattr(df, section), version)
+
+
+# A civ holds most of the data, so its units are encoded one at a time as well, the same way Civ.to_bytes does
+def _civ_chunks(civ: Civ, version: Version) -> Iterator[bytes]:
+    yield encode_civ_header(civ)
+    yield civ.write_int_16(len(civ.units))
+    yield civ.write_int_32_array(civ.unit_pointers)
+    yield from _class_chunks(civ.units, version)
+
+
+# The elements of a list section, skipping the empty slots like write_class_array does
+def _class_chunks(values: list, version: Version) -> Iterator[bytes]:
+    for value in values:
+        if value is not None:
+            yield value.to_bytes(version)
+
+
+# A section together with its length, if it is a list
+def _shape(value) -> tuple[object, int]:
+    return value, len(value) if isinstance(value, list) else -1
+
+
+# What saving compares to notice changes that weren't declared: the fields of an object, or of every element if it is a list,
+# together with the fields of the objects it holds directly, e.g. the creatable and type_50 of a unit
+# Lists and tuples are compared by identity first, so the comparison stays cheap unless they got replaced
+def get_values(value):
+    if type(value) is list:
+        return [_get_fields(item) for item in value]
+    return _get_fields(value)
+
+
+def _get_fields(value):
+    value_type = type(value)
+    if value_type not in _getters:
+        _getters[value_type] = _make_getters(value_type)
+    fields, objects = _getters[value_type]
+    if fields is None:
+        return value
+    if not objects:
+        return fields(value)
+    return fields(value), [_get_fields(getattr(value, name)) for name in objects]
+
+
+# An attrgetter for all fields of a class, and the names of the fields holding another dataclass, e.g. "creatable: Creatable | None"
+def _make_getters(value_type: type) -> tuple[operator.attrgetter | None, list[str]]:
+    if not dataclasses.is_dataclass(value_type):
+        return None, []
+    fields = dataclasses.fields(value_type)
+    objects = [field.name for field in fields if any(dataclasses.is_dataclass(held_type) for held_type in _held_types(field.type))]
+    return operator.attrgetter(*[field.name for field in fields]), objects
+
+
+def _held_types(annotation) -> tuple:
+    if get_origin(annotation) in (Union, UnionType):
+        return get_args(annotation)
+    return (annotation,)
+
+
+_getters = {}
+
+
+# False for the fields of a lazily loaded DatFile or civ that weren't decoded yet, see tools/lazy.py
+def is_loaded(value, field: str) -> bool:
+    return not hasattr(value, "is_loaded") or value.is_loaded(field)
+
+
+def _same_shape(shape: tuple[object, int], original: tuple[object, int]) -> bool:
+    return shape[0] is original[0] and shape[1] == original[1]
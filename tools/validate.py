@@ -0,0 +1,344 @@
+import struct
+from dataclasses import dataclass
+from operator import attrgetter
+
+from genieutils.datfile import DatFile
+from genieutils.tech import ResearchResourceCost
+from genieutils.unit import ResourceCost, ResourceStorage
+
+from constants import command_types, resources
+from mods import indexes, techtree
+from tools import tracking
+
+NAME = "validate"
+
+# genieutils saves whatever values the DatFile holds, so a mistake in a mod only shows up when saving fails halfway through
+# or, worse, when the game misbehaves with the saved file. The checks here catch the common mistakes before saving:
+#   - values that don't fit the field they are saved in (e.g. hit points above 32767, or a float in an integer field)
+#   - unit, technology and effect IDs pointing at something that doesn't exist
+#   - costs with the wrong number of slots or negative amounts
+#   - two technologies or units in the same building using the same button
+# Errors are values that can't be saved as they are, so the saved file would be broken. Everything else is a warning:
+# it is usually a mistake but can be intended, and these checks haven't been compared against every use of IDs and amounts in the game data
+
+ERROR = "error"
+WARNING = "warning"
+
+INT_RANGES = {
+    "int8": (-(2**7), 2**7 - 1),
+    "uint8": (0, 2**8 - 1),
+    "int16": (-(2**15), 2**15 - 1),
+    "int32": (-(2**31), 2**31 - 1),
+}
+FORMAT_CODES = {"int8": "b", "uint8": "B", "int16": "h", "int32": "i", "float": "f"}
+
+# The fields mods commonly change and how genieutils saves them. Nested fields are written as a dotted path from the unit
+UNIT_FIELDS = [
+    ("id", "int16"),
+    ("base_id", "int16"),
+    ("class_", "int16"),
+    ("hit_points", "int16"),
+    ("line_of_sight", "float"),
+    ("speed", "float"),
+    ("dead_unit_id", "int16"),
+    ("enabled", "int8"),
+    ("creatable.train_time", "int16"),
+    ("creatable.train_location_id", "int16"),
+    ("creatable.button_id", "int8"),
+    ("creatable.displayed_pierce_armor", "int16"),
+    ("type_50.displayed_attack", "int16"),
+    ("type_50.displayed_melee_armour", "int16"),
+]
+TECH_FIELDS = [
+    ("required_tech_count", "int16"),
+    ("civ", "int16"),
+    ("research_location", "int16"),
+    ("research_time", "int16"),
+    ("effect_id", "int16"),
+    ("button_id", "uint8"),
+]
+COST_FIELDS = {
+    ResourceCost: [("type", "int16"), ("amount", "int16"), ("flag", "int16")],
+    ResourceStorage: [("type", "int16"), ("amount", "float"), ("flag", "int8")],
+    ResearchResourceCost: [("type", "int16"), ("amount", "int16"), ("flag", "uint8")],
+}
+COMMAND_FIELDS = [("type", "uint8"), ("a", "int16"), ("b", "int16"), ("c", "int16"), ("d", "float")]
+
+COST_SLOTS = 3
+REQUIRED_TECH_SLOTS = 6
+# Food, wood, stone and gold
+STOCKPILE_RESOURCES = range(4)
+
+
+@dataclass
+class Issue:
+    severity: str
+    location: str
+    message: str
+
+    def __str__(self) -> str:
+        return f"{self.severity}: {self.location}: {self.message}"
+
+
+class ValidationError(ValueError):
+    pass
+
+
+# Check the whole DatFile and return everything that looks wrong
+def validate(df: DatFile) -> list[Issue]:
+    issues = []
+    _check_units(df, issues)
+    _check_techs(df, issues)
+    _check_effects(df, issues)
+    _check_civs(df, issues)
+    _check_buttons(df, issues)
+    return issues
+
+
+# Print every issue and raise ValidationError if any of them is an error
+def ensure_valid(df: DatFile):
+    issues = validate(df)
+    for issue in issues:
+        print(issue)
+    errors = [issue for issue in issues if issue.severity == ERROR]
+    if errors:
+        raise ValidationError(f"The data has {len(errors)} errors, see above")
+
+
+# There are a lot of units and nearly all of them are fine, so every unit first gets a quick check of all its values at once
+# Only the units failing it are checked again value by value, to report what exactly is wrong
+# Units that saving copies from the base file as they are (see tools/tracking.py) aren't checked at all
+def _check_units(df: DatFile, issues: list[Issue]):
+    unit_count = _get_unit_count(df)
+    fields = [(path.split("."), kind) for path, kind in UNIT_FIELDS]
+    tracker = tracking.get_tracker(df)
+    for civ_id, civ in enumerate(df.civs):
+        unchanged_units = tracker.unchanged_units(civ_id) if tracker else set()
+        if unchanged_units is None:
+            continue
+        for unit_id, unit in enumerate(civ.units):
+            if unit is None or unit_id in unchanged_units or _unit_looks_valid(unit, unit_count):
+                continue
+            location = f"civs[{civ_id}].units[{unit_id}]"
+            for path, kind in fields:
+                value = unit
+                for name in path:
+                    value = getattr(value, name)
+                    if value is None:
+                        break
+                else:
+                    _check_value(value, kind, f"{location}.{'.'.join(path)}", issues)
+            _check_id(unit.dead_unit_id, unit_count, "unit", f"{location}.dead_unit_id", issues)
+            _check_costs(unit.resource_storages, f"{location}.resource_storages", issues)
+            if unit.creatable is not None:
+                _check_id(unit.creatable.train_location_id, unit_count, "unit", f"{location}.creatable.train_location_id", issues)
+                _check_costs(unit.creatable.resource_costs, f"{location}.creatable.resource_costs", issues)
+                # Units need a free slot for their population headroom cost, only buildings can cost three resources
+                if unit.building is None and sum(1 for cost in unit.creatable.resource_costs if cost.type in STOCKPILE_RESOURCES and cost.amount > 0) > 2:
+                    issues.append(Issue(WARNING, f"{location}.creatable.resource_costs", "Only buildings can cost more than two resources"))
+            if unit.type_50 is not None:
+                for field in ("attacks", "armours"):
+                    for index, attack in enumerate(getattr(unit.type_50, field)):
+                        _check_value(attack.class_, "int16", f"{location}.type_50.{field}[{index}].class_", issues)
+                        _check_value(attack.amount, "int16", f"{location}.type_50.{field}[{index}].amount", issues)
+
+
+# Packing values the way they are saved fails if any of them doesn't fit, which checks all of them at once
+def _unit_looks_valid(unit, unit_count: int) -> bool:
+    speed = unit.speed
+    if speed is not None and type(speed) is not float and type(speed) is not int:
+        return False
+    if not (unit.dead_unit_id == -1 or 0 <= unit.dead_unit_id < unit_count):
+        return False
+    creatable = unit.creatable
+    type_50 = unit.type_50
+    try:
+        _UNIT_STRUCT.pack(*_UNIT_VALUES(unit))
+        if not _costs_fit(unit.resource_storages, ResourceStorage):
+            return False
+        if creatable is not None:
+            _CREATABLE_STRUCT.pack(*_CREATABLE_VALUES(creatable))
+            if not (creatable.train_location_id == -1 or 0 <= creatable.train_location_id < unit_count):
+                return False
+            if not _costs_fit(creatable.resource_costs, ResourceCost):
+                return False
+            if unit.building is None and sum(1 for cost in creatable.resource_costs if cost.type in STOCKPILE_RESOURCES and cost.amount > 0) > 2:
+                return False
+        if type_50 is not None:
+            _TYPE_50_STRUCT.pack(*_TYPE_50_VALUES(type_50))
+            for attack in type_50.attacks:
+                _ATTACK_STRUCT.pack(attack.class_, attack.amount)
+            for armour in type_50.armours:
+                _ATTACK_STRUCT.pack(armour.class_, armour.amount)
+    except struct.error:
+        return False
+    return True
+
+
+# Raises struct.error if any of the values doesn't fit
+def _costs_fit(costs: tuple, cost_class: type) -> bool:
+    if len(costs) != COST_SLOTS or not (isinstance(costs[0], cost_class) and isinstance(costs[1], cost_class) and isinstance(costs[2], cost_class)):
+        return False
+    values = _COST_VALUES(costs[0]) + _COST_VALUES(costs[1]) + _COST_VALUES(costs[2])
+    _COSTS_STRUCTS[cost_class].pack(*values)
+    if cost_class is not ResourceStorage:
+        if (values[1] < 0 and values[0] != resources.NULL) or (values[4] < 0 and values[3] != resources.NULL) or (values[7] < 0 and values[6] != resources.NULL):
+            return False
+    return True
+
+
+def _compile(fields: list[tuple[str, str]]) -> tuple[attrgetter, struct.Struct]:
+    names = [field for field, _ in fields]
+    return attrgetter(*names), struct.Struct("<" + "".join(FORMAT_CODES[kind] for _, kind in fields))
+
+
+# speed is None for units that don't save it, so it is checked on its own
+_UNIT_VALUES, _UNIT_STRUCT = _compile([(path, kind) for path, kind in UNIT_FIELDS if "." not in path and path != "speed"])
+_CREATABLE_VALUES, _CREATABLE_STRUCT = _compile([(path.split(".")[1], kind) for path, kind in UNIT_FIELDS if path.startswith("creatable.")])
+_TYPE_50_VALUES, _TYPE_50_STRUCT = _compile([(path.split(".")[1], kind) for path, kind in UNIT_FIELDS if path.startswith("type_50.")])
+_ATTACK_STRUCT = struct.Struct("<hh")
+_COST_VALUES = attrgetter("type", "amount", "flag")
+# All the slots of a cost tuple at once
+_COSTS_STRUCTS = {cost_class: _compile(fields * COST_SLOTS)[1] for cost_class, fields in COST_FIELDS.items()}
+
+
+def _check_techs(df: DatFile, issues: list[Issue]):
+    unit_count = _get_unit_count(df)
+    for tech_id, tech in enumerate(df.techs):
+        location = f"techs[{tech_id}]"
+        for field, kind in TECH_FIELDS:
+            _check_value(getattr(tech, field), kind, f"{location}.{field}", issues)
+        _check_id(tech.research_location, unit_count, "unit", f"{location}.research_location", issues)
+        _check_id(tech.effect_id, len(df.effects), "effect", f"{location}.effect_id", issues)
+        if len(tech.required_techs) != REQUIRED_TECH_SLOTS:
+            issues.append(Issue(ERROR, f"{location}.required_techs", f"Has {len(tech.required_techs)} entries instead of {REQUIRED_TECH_SLOTS}"))
+        for index, required_tech in enumerate(tech.required_techs):
+            if _check_value(required_tech, "int16", f"{location}.required_techs[{index}]", issues):
+                _check_id(required_tech, len(df.techs), "technology", f"{location}.required_techs[{index}]", issues)
+        listed = sum(1 for required_tech in tech.required_techs if required_tech >= 0)
+        if tech.required_tech_count > listed:
+            issues.append(Issue(WARNING, f"{location}.required_tech_count", f"Needs {tech.required_tech_count} of only {listed} required technologies, so it can never be researched"))
+        _check_costs(tech.resource_costs, f"{location}.resource_costs", issues)
+
+
+def _check_effects(df: DatFile, issues: list[Issue]):
+    unit_count = _get_unit_count(df)
+    for effect_id, effect in enumerate(df.effects):
+        for command_index, command in enumerate(effect.effect_commands):
+            location = f"effects[{effect_id}].effect_commands[{command_index}]"
+            if not all([_check_value(getattr(command, field), kind, f"{location}.{field}", issues) for field, kind in COMMAND_FIELDS]):
+                continue
+            unit, _, _, tech = indexes.command_targets(command)
+            if unit is not None:
+                _check_id(unit, unit_count, "unit", f"{location}.a", issues)
+            if indexes.command_family(command.type) == command_types.UPGRADE_UNIT:
+                _check_id(command.b, unit_count, "unit", f"{location}.b", issues)
+            if tech is not None:
+                _check_id(tech, len(df.techs), "technology", f"{location}.{'d' if command.type == command_types.DISABLE_TECH else 'a'}", issues)
+
+
+def _check_civs(df: DatFile, issues: list[Issue]):
+    for civ_id, civ in enumerate(df.civs):
+        _check_id(civ.tech_tree_id, len(df.effects), "effect", f"civs[{civ_id}].tech_tree_id", issues)
+        _check_id(civ.team_bonus_id, len(df.effects), "effect", f"civs[{civ_id}].team_bonus_id", issues)
+
+
+# Two technologies researched in the same building can share a button if one of them requires the other (e.g. the blacksmith armor upgrades),
+# if they belong to different civs, or if researching one disables the other. Otherwise the second one can never be clicked
+# The same goes for units trained in the same building that are both available from the start
+def _check_buttons(df: DatFile, issues: list[Issue]):
+    tech_graph = techtree.get_tech_graph(df)
+    tech_graph.invalidate()
+    tech_graph.refresh()
+    by_button: dict[tuple[int, int], list[int]] = {}
+    for tech_id, tech in enumerate(df.techs):
+        if tech.research_location >= 0 and tech.button_id > 0:
+            by_button.setdefault((tech.research_location, tech.button_id), []).append(tech_id)
+    requirements: dict[int, set[int]] = {}
+    for (building, button), tech_ids in by_button.items():
+        for index, tech_id in enumerate(tech_ids):
+            for other_id in tech_ids[index + 1 :]:
+                tech, other = df.techs[tech_id], df.techs[other_id]
+                if tech.civ != other.civ and -1 not in (tech.civ, other.civ):
+                    continue
+                if other_id in tech_graph.exclusions(tech_id) or tech_id in tech_graph.exclusions(other_id):
+                    continue
+                if other_id in _all_requirements(tech_graph, tech_id, requirements) or tech_id in _all_requirements(tech_graph, other_id, requirements):
+                    continue
+                issues.append(Issue(WARNING, f"techs[{other_id}].button_id", f"Uses button {button} in building {building}, like technology {tech_id}"))
+
+    for civ_id, civ in enumerate(df.civs):
+        # The units of a lazily loaded civ that were never decoded are the units of the base file
+        if not tracking.is_loaded(civ, "units"):
+            continue
+        by_button = {}
+        for unit_id, unit in enumerate(civ.units):
+            if unit is None or unit.creatable is None or not unit.enabled:
+                continue
+            if unit.creatable.train_location_id >= 0 and unit.creatable.button_id > 0:
+                by_button.setdefault((unit.creatable.train_location_id, unit.creatable.button_id), []).append(unit_id)
+        for (building, button), unit_ids in by_button.items():
+            for unit_id in unit_ids[1:]:
+                issues.append(Issue(WARNING, f"civs[{civ_id}].units[{unit_id}].creatable.button_id", f"Uses button {button} in building {building}, like unit {unit_ids[0]}"))
+
+
+# The number of unit slots of the civ with the most of them, without decoding the units of lazily loaded civs, see tools/lazy.py
+def _get_unit_count(df: DatFile) -> int:
+    return max((civ.units_size() if hasattr(civ, "units_size") else len(civ.units) for civ in df.civs), default=0)
+
+
+# Every technology that is required, directly or through other technologies, to research this one
+def _all_requirements(tech_graph: techtree.TechGraph, tech_id: int, requirements: dict[int, set[int]]) -> set[int]:
+    if tech_id in requirements:
+        return requirements[tech_id]
+    found = requirements[tech_id] = set()
+    pending = [tech_id]
+    while pending:
+        for prerequisite in tech_graph.prerequisites[pending.pop()]:
+            if prerequisite not in found and prerequisite < len(tech_graph.prerequisites):
+                found.add(prerequisite)
+                pending.append(prerequisite)
+    return found
+
+
+def _check_costs(costs: tuple, location: str, issues: list[Issue]):
+    if len(costs) != COST_SLOTS:
+        issues.append(Issue(ERROR, location, f"Has {len(costs)} slots instead of {COST_SLOTS}"))
+    for index, cost in enumerate(costs):
+        for field, kind in COST_FIELDS[_cost_class(cost)]:
+            _check_value(getattr(cost, field), kind, f"{location}[{index}].{field}", issues)
+        if isinstance(cost, (ResourceCost, ResearchResourceCost)) and cost.type != resources.NULL and cost.amount < 0:
+            issues.append(Issue(WARNING, f"{location}[{index}].amount", f"Costs a negative amount ({cost.amount})"))
+
+
+# The genieutils class of a cost, which may be a subclass of it, e.g. an interned cost from mods/compact.py
+def _cost_class(cost) -> type:
+    if type(cost) in COST_FIELDS:
+        return type(cost)
+    for cost_class in COST_FIELDS:
+        if isinstance(cost, cost_class):
+            return cost_class
+    raise TypeError(f"{type(cost).__name__} is not a cost")
+
+
+# Return whether the value can be saved as the given kind of field
+def _check_value(value, kind: str, location: str, issues: list[Issue]) -> bool:
+    if kind == "float":
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return True
+        issues.append(Issue(ERROR, location, f"{value!r} is not a number"))
+        return False
+    if not isinstance(value, int):
+        issues.append(Issue(ERROR, location, f"{value!r} is not an integer, round it with int()"))
+        return False
+    low, high = INT_RANGES[kind]
+    if not low <= value <= high:
+        issues.append(Issue(ERROR, location, f"{value} doesn't fit in an {kind} field ({low} to {high})"))
+        return False
+    return True
+
+
+# IDs are either -1 for none, or point at an existing unit, technology or effect
+def _check_id(value: int, count: int, kind: str, location: str, issues: list[Issue]):
+    if value != -1 and not 0 <= value < count:
+        issues.append(Issue(WARNING, location, f"There is no {kind} {value}"))
@@ -0,0 +1,56 @@
+import os
+import time
+import traceback
+from pathlib import Path
+from typing import Callable
+
+NAME = "warmup"
+
+DEFAULT_POLL_SECONDS = 2.0
+
+# Watches the base dat file and fills the cache as soon as it appears or changes, e.g. after a game patch,
+# so that the next build loads the parsed data from the cache instead of parsing it while someone waits for it
+#
+# The file is polled rather than watched with inotify and the like, which works the same everywhere and costs nothing noticeable every few seconds
+# A file that is still being copied keeps changing, so warm-up only starts once it stayed the same for one whole poll
+# warm() does the actual work, create_mod.py passes a function that loads the base data the same way a build does,
+# which parses and caches it if it isn't cached yet and holds the cache lock while doing so, see create_mod.parse_base_data
+
+
+# The size, modification time and inode of a file, None if it doesn't exist
+def file_state(input_file: Path) -> tuple[int, int, int] | None:
+    try:
+        stat = os.stat(input_file)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+# Call warm(input_file) now and every time the file changed afterwards, until interrupted
+# An error while warming up is printed and the file is tried again once it changes
+def watch(input_file: Path, warm: Callable[[Path], None], poll_seconds: float = DEFAULT_POLL_SECONDS):
+    print(f"Watching {input_file} for changes, press Ctrl+C to stop")
+    warmed_state = None
+    previous_state = file_state(input_file)
+    try:
+        while True:
+            state = file_state(input_file)
+            if state is not None and state == previous_state and state != warmed_state:
+                _warm(input_file, warm)
+                warmed_state = state
+            previous_state = state
+            time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+
+
+def _warm(input_file: Path, warm: Callable[[Path], None]):
+    print(f"Warming up the cache for {input_file}...")
+    start_time = time.perf_counter()
+    try:
+        warm(input_file)
+    except Exception:
+        traceback.print_exc()
+        print(f"Warming up the cache for {input_file} failed, trying again once it changes")
+        return
+    print(f"Cache for {input_file} is ready ({time.perf_counter() - start_time:.1f}s)")